@@ -0,0 +1,322 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Headless client of gaitech_bci_device data for algorithm nodes, runs without PyQt
+Messages are collected into numpy blocks with sample times, kept in a ring of recent history and handed to callbacks
+per block or per hop of a sliding window
+"""
+import rospy
+from threading import Lock
+import numpy as np
+from gaitech_bci_bringup.EEGMontage import EEG_MONTAGES, EEG_MONTAGE_TYPES
+from gaitech_bci_bringup.EEGSharedRing import GaitechSharedSubscriber, SharedRingOfTopic
+
+EEG_SAMPLE_RATE = 1000.0    # Sample rate of device
+EEG_CLIENT_BLOCK = 50       # Samples collected before a block is delivered
+EEG_CLIENT_HISTORY = 10.0   # Default seconds of history kept
+
+
+class GaitechSampleRing():
+    """
+    Ring of latest samples, (channels x samples) block and time of every sample
+    """
+    def __init__(self, nchannels, capacity):
+        self.capacity = max(int(capacity), 1)
+        self.time = np.empty(self.capacity, dtype='float64')
+        self.block = np.empty((nchannels, self.capacity), dtype='float64')
+        self.count = 0      # Samples held, at most capacity
+        self.head = 0       # Position of next sample
+
+    def extend(self, _time, _block):
+        """
+        Add block of samples, oldest samples are overwritten once ring is full
+        :param _time: np.array of sample times
+        :param _block: np.array (channels x samples)
+        :return: None
+        """
+        _n = len(_time)
+        if _n >= self.capacity:
+            _time, _block = _time[-self.capacity:], _block[:, -self.capacity:]
+            _n = self.capacity
+        _first = min(_n, self.capacity - self.head)
+        self.time[self.head:self.head + _first] = _time[:_first]
+        self.block[:, self.head:self.head + _first] = _block[:, :_first]
+        if _first < _n:
+            self.time[:_n - _first] = _time[_first:]
+            self.block[:, :_n - _first] = _block[:, _first:]
+        self.head = (self.head + _n) % self.capacity
+        self.count = min(self.count + _n, self.capacity)
+
+    def latest(self, nsamples=None):
+        """
+        Copy of latest samples in order of time
+        :param nsamples: samples to return, None for all held
+        :return: (np.array of times, np.array (channels x samples))
+        """
+        _n = self.count if nsamples is None else min(int(nsamples), self.count)
+        _start = (self.head - _n) % self.capacity
+        if _start + _n <= self.capacity:
+            return self.time[_start:_start + _n].copy(), self.block[:, _start:_start + _n].copy()
+        return np.concatenate((self.time[_start:], self.time[:self.head])), \
+            np.concatenate((self.block[:, _start:], self.block[:, :self.head]), axis=1)
+
+
+class GaitechEEGClient():
+    """
+    Client of data of one montage, subscribes to a data topic itself or is fed messages by another subscriber
+    Data of common reference is derived for any montage, so montage can be changed without losing history
+    Callbacks are called in thread of subscriber with (times, block, montage), block is (channels x samples) in volts
+    """
+    def __init__(self, montage=None, history=EEG_CLIENT_HISTORY, blocksamples=EEG_CLIENT_BLOCK,
+                 rate=EEG_SAMPLE_RATE):
+        """
+        :param montage: GaitechMontage or mode index of data delivered, default common reference
+        :param history: seconds of history kept, grown to longest window of window callbacks
+        :param blocksamples: samples in each delivered block
+        :param rate: sample rate of data
+        """
+        self.montage = EEG_MONTAGES[montage] if isinstance(montage, int) else (montage or EEG_MONTAGES[0])
+        self.rate = float(rate)
+        self.blocksamples = max(int(blocksamples), 1)
+        self.historysamples = int(history * self.rate)
+        self.source = None          # Montage of incoming data
+        self.ring = None            # GaitechSampleRing of incoming data
+        self.subscriber = None
+        self.blockcallbacks = []
+        self.windowcallbacks = []   # [func, window samples, hop samples, samples since last call]
+        self._lock = Lock()
+        self._time = None
+        self._block = None
+        self._count = 0
+
+    def subscribe(self, topic, source=None, shared=True):
+        """
+        Subscribe to data topic, shared memory ring of topic is read instead if device node runs on this host
+        :param topic: topic name
+        :param source: GaitechMontage of topic, default montage of client
+        :param shared: use shared memory ring if advertised
+        :return: None
+        """
+        self.unsubscribe()
+        _source = source or self.montage
+        if shared and SharedRingOfTopic(topic) is not None:
+            self.subscriber = GaitechSharedSubscriber(topic, self.addCommonBlock, fallback=lambda: rospy.Subscriber(
+                topic, _source.msgclass, self.addMessage, _source))
+            rospy.loginfo('Reading shared memory data of %s', self.subscriber.name)
+            return
+        self.subscriber = rospy.Subscriber(topic, _source.msgclass, self.addMessage, _source)
+        rospy.loginfo('Subscribed to %s Data on %s', _source.name, self.subscriber.resolved_name)
+
+    def unsubscribe(self):
+        """
+        Unsubscribe from data topic, history is kept
+        :return: None
+        """
+        if self.subscriber is not None:
+            self.subscriber.unregister()
+            self.subscriber = None
+
+    def setMontage(self, montage):
+        """
+        Change montage of delivered data, history is kept if incoming data can be derived for it
+        :param montage: GaitechMontage or mode index
+        :return: None
+        """
+        with self._lock:
+            self.montage = EEG_MONTAGES[montage] if isinstance(montage, int) else montage
+            for _cb in self.windowcallbacks:
+                _cb[3] = 0
+
+    def addBlockCallback(self, func):
+        """
+        Call func(times, block, montage) for every block of new samples
+        :param func:
+        :return: None
+        """
+        self.blockcallbacks.append(func)
+
+    def addWindowCallback(self, func, window, hop):
+        """
+        Call func(times, block, montage) with latest window seconds of data, once hop seconds of new samples arrived
+        and a full window is held
+        :param func:
+        :param window: seconds
+        :param hop: seconds
+        :return: None
+        """
+        _window = max(int(window * self.rate), 1)
+        with self._lock:
+            if _window > self.historysamples:
+                self.historysamples = _window
+                if self.ring is not None:
+                    self.ring = self.__regrow(self.ring, _window)
+            self.windowcallbacks.append([func, _window, max(int(hop * self.rate), 1), 0])
+
+    def addMessage(self, msg, source=None):
+        """
+        Add sample of data message, suitable as subscriber callback
+        :param msg: data message of any montage
+        :param source: GaitechMontage of message, found from message type if None
+        :return: None
+        """
+        if source is None:
+            source = EEG_MONTAGE_TYPES[msg._type]
+        _stamp = msg.header.stamp
+        _calls = None
+        with self._lock:
+            if source is not self.source:
+                self.__reset(source)
+            self._time[self._count] = _stamp.secs + _stamp.nsecs * 1e-9
+            self._block[:, self._count] = source.decode(msg)
+            self._count += 1
+            if self._count == self.blocksamples:
+                _calls = self.__deliver(self._time[:self._count], self._block[:, :self._count])
+                self._count = 0
+        self.__call(_calls)
+
+    def addBlock(self, times, block, source):
+        """
+        Add block of samples at once, e.g. read from shared memory
+        :param times: np.array of sample times
+        :param block: np.array (channels x samples) of source montage, copied before return
+        :param source: GaitechMontage of block
+        :return: None
+        """
+        with self._lock:
+            if source is not self.source:
+                self.__reset(source)
+            _calls = []
+            if self._count > 0:
+                _calls = self.__deliver(self._time[:self._count], self._block[:, :self._count])
+                self._count = 0
+            _calls.extend(self.__deliver(times, block))
+        self.__call(_calls)
+
+    def addCommonBlock(self, times, block):
+        """
+        Add block of common reference samples
+        :param times:
+        :param block:
+        :return: None
+        """
+        self.addBlock(times, block, EEG_MONTAGES[0])
+
+    def flush(self):
+        """
+        Deliver samples collected so far, e.g. once data stopped
+        :return: None
+        """
+        _calls = None
+        with self._lock:
+            if self._count > 0:
+                _calls = self.__deliver(self._time[:self._count], self._block[:, :self._count])
+                self._count = 0
+        self.__call(_calls)
+
+    def window(self, seconds=None):
+        """
+        Latest data of history
+        :param seconds: length of window, None for all history
+        :return: (np.array of times, np.array (channels x samples), montage)
+        """
+        with self._lock:
+            if self.ring is None:
+                return np.empty(0), np.empty((len(self.montage.channels), 0)), self.montage
+            _time, _block = self.ring.latest(None if seconds is None else int(seconds * self.rate))
+            _montage, _block = self.__output(_block)
+            return _time, _block, _montage
+
+    ####### Helping Functions ######
+    def __reset(self, source):
+        """
+        Start collecting data of a new source montage, history of old source is discarded
+        :param source:
+        :return:
+        """
+        self.source = source
+        self.ring = GaitechSampleRing(len(source.channels), self.historysamples)
+        self._time = np.empty(self.blocksamples, dtype='float64')
+        self._block = np.empty((len(source.channels), self.blocksamples), dtype='float64')
+        self._count = 0
+        for _cb in self.windowcallbacks:
+            _cb[3] = 0
+
+    def __output(self, block):
+        """
+        Data of source in montage of client if it can be derived, otherwise in source montage
+        :param block: np.array (source channels x samples)
+        :return: (montage, np.array (channels x samples))
+        """
+        if self.source is self.montage:
+            return self.montage, block
+        if self.source.index == 0:
+            return self.montage, self.montage.derive(block)
+        return self.source, block
+
+    def __deliver(self, _time, _block):
+        """
+        Move samples to history, called with lock held
+        :param _time: np.array of sample times
+        :param _block: np.array (source channels x samples)
+        :return: list of (func, args) to call once lock is released
+        """
+        _n = len(_time)
+        self.ring.extend(_time, _block)
+        _calls = []
+        if len(self.blockcallbacks) > 0:
+            _montage, _out = self.__output(np.array(_block, dtype='float64'))
+            _args = (np.array(_time, dtype='float64'), _out, _montage)
+            _calls.extend([(_func, _args) for _func in self.blockcallbacks])
+        for _cb in self.windowcallbacks:
+            _cb[3] += _n
+            if _cb[3] >= _cb[2] and self.ring.count >= _cb[1]:
+                _cb[3] %= _cb[2]
+                _wtime, _wblock = self.ring.latest(_cb[1])
+                _montage, _wblock = self.__output(_wblock)
+                _calls.append((_cb[0], (_wtime, _wblock, _montage)))
+        return _calls
+
+    @staticmethod
+    def __call(calls):
+        if calls is None:
+            return
+        for (_func, _args) in calls:
+            _func(*_args)
+
+    @staticmethod
+    def __regrow(ring, capacity):
+        _time, _block = ring.latest()
+        _ring = GaitechSampleRing(_block.shape[0], capacity)
+        _ring.extend(_time, _block)
+        return _ring
@@ -0,0 +1,141 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Registry of montage modes of H10C device
+Channel names, message class and message fields of every mode are defined once here
+"""
+from operator import attrgetter
+import numpy as np
+from gaitech_bci_bringup.msg import AverageReference, CommonReference, LongitudinalBipolar, TransverseBipolar
+
+EEG_ELECTRODES = ['Fp1', 'Fp2', 'F7', 'F8', 'T3', 'T4', 'T5', 'T6', 'O1', 'O2']   # Order of device samples
+
+
+class GaitechMontage():
+    """
+    One montage mode, decodes messages into vectors and derives its channels from common reference samples
+    """
+    def __init__(self, index, name, msgclass, topic, channels, fields, pairs):
+        """
+        :param index: mode number used by UI, 0 : Common Ref, 1 : Average Ref, 2 : Longitudinal-Bipolar,
+         3 : Transverse-Bipolar
+        :param name: mode name used in data dicts
+        :param msgclass: ROS message class
+        :param topic: topic name of device node and saved bags, relative to node namespace
+        :param channels: channel names in order of fields
+        :param fields: message field names
+        :param pairs: (electrode, reference) of every channel, reference is None for common reference and 'avg' for
+         average of all electrodes
+        """
+        self.index = index
+        self.name = name
+        self.msgclass = msgclass
+        self.msgtype = msgclass._type
+        self.topic = topic
+        self.channels = channels
+        self.fields = fields
+        self.decode = attrgetter(*fields)   # decode(msg) returns tuple of values in order of channels
+        # Matrix to derive channels from common reference samples #
+        self.matrix = np.zeros((len(channels), len(EEG_ELECTRODES)), dtype='float64')
+        for _i, (_el, _ref) in enumerate(pairs):
+            self.matrix[_i, EEG_ELECTRODES.index(_el)] += 1.0
+            if _ref == 'avg':
+                self.matrix[_i, :] -= 1.0 / len(EEG_ELECTRODES)
+            elif _ref is not None:
+                self.matrix[_i, EEG_ELECTRODES.index(_ref)] -= 1.0
+
+    def encode(self, values, header=None):
+        """
+        Create message from values in order of channels
+        :param values:
+        :param header: std_msgs/Header or None
+        :return: message of msgclass
+        """
+        _msg = self.msgclass(**dict(zip(self.fields, values)))
+        if header is not None:
+            _msg.header = header
+        return _msg
+
+    def derive(self, common):
+        """
+        Channels of this montage from common reference samples
+        :param common: samples of EEG_ELECTRODES, vector or (electrodes x samples) block
+        :return: np.array of channels, vector or (channels x samples) block
+        """
+        return np.dot(self.matrix, common)
+
+    def picks(self, names):
+        """
+        Index of channels by name
+        :param names: list of channel names
+        :return: list of indices
+        """
+        return [self.channels.index(_n) for _n in names]
+
+
+EEG_MONTAGES = [
+    GaitechMontage(0, 'Common Reference', CommonReference, 'data_comref',
+                   ['Fp1', 'Fp2', 'F7', 'F8', 'T3', 'T4', 'T5', 'T6', 'O1', 'O2'],
+                   ['fp1', 'fp2', 'f7', 'f8', 't3', 't4', 't5', 't6', 'o1', 'o2'],
+                   [(_el, None) for _el in EEG_ELECTRODES]),
+    GaitechMontage(1, 'Average Reference', AverageReference, 'data_avgref',
+                   ['Fp1-Avg', 'Fp2-Avg', 'F7-Avg', 'F8-Avg', 'T3-Avg', 'T4-Avg', 'T5-Avg', 'T6-Avg', 'O1-Avg',
+                    'O2-Avg'],
+                   ['fp1_avg', 'fp2_avg', 'f7_avg', 'f8_avg', 't3_avg', 't4_avg', 't5_avg', 't6_avg', 'o1_avg',
+                    'o2_avg'],
+                   [(_el, 'avg') for _el in EEG_ELECTRODES]),
+    GaitechMontage(2, 'Longitudinal-Bipolar', LongitudinalBipolar, 'data_lb',
+                   ['Fp1-F7', 'F7-T3', 'T3-T5', 'T5-O1', 'Fp2-F8', 'F8-T4', 'T4-T6', 'T6-O2'],
+                   ['fp1_fp7', 'f7_t3', 't3_t5', 't5_o1', 'fp2_f8', 'f8_t4', 't4_t6', 't6_o2'],
+                   [('Fp1', 'F7'), ('F7', 'T3'), ('T3', 'T5'), ('T5', 'O1'), ('Fp2', 'F8'), ('F8', 'T4'),
+                    ('T4', 'T6'), ('T6', 'O2')]),
+    GaitechMontage(3, 'Transverse-Bipolar', TransverseBipolar, 'data_tb',
+                   ['Fp1-Fp2', 'F7-F8', 'T3-T4', 'T5-T6', 'O1-O2'],
+                   ['fp1_fp2', 'f7_f8', 't3_t4', 't5_t6', 'o1_o2'],
+                   [('Fp1', 'Fp2'), ('F7', 'F8'), ('T3', 'T4'), ('T5', 'T6'), ('O1', 'O2')]),
+]
+EEG_MONTAGE_NAMES = dict((_m.name, _m) for _m in EEG_MONTAGES)    # Montage by mode name
+EEG_MONTAGE_TYPES = dict((_m.msgtype, _m) for _m in EEG_MONTAGES)     # Montage by message type
+
+
+def MontageOfType(msgtype):
+    """
+    Montage of a message type string, as reported by rosbag or rosnode
+    :param msgtype: e.g. 'gaitech_bci_bringup/CommonReference'
+    :return: GaitechMontage or None
+    """
+    for _m in EEG_MONTAGES:
+        if _m.msgtype in msgtype:
+            return _m
+    return None
@@ -0,0 +1,278 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Recorder of EEG data in device node
+Samples are written to a set of preallocated raw segment files by a background thread, markers go to a sidecar file
+and a manifest describes the recording
+"""
+import os, json, time, Queue
+from threading import Thread, Lock
+import numpy as np
+
+RECORDING_VERSION = 1
+RECORDING_CHANNELS = ['Fp1', 'Fp2', 'F7', 'F8', 'T3', 'T4', 'T5', 'T6', 'O1', 'O2']
+RECORDING_DTYPE = 'float64'     # Each row is [time, Fp1, ..., O2]
+
+
+class GaitechEEGRecorder():
+    """
+    Records filtered common reference samples and events without blocking acquisition
+    Samples are collected in blocks in caller thread, blocks are handed to writer thread and dropped if it falls behind
+    """
+    def __init__(self, directory, prefix='eeg', segmentsamples=600000, blocksamples=100, queueblocks=600,
+                 info=None):
+        """
+        Create recorder, call start to begin recording
+        :param directory: parent directory of recordings
+        :param prefix: name prefix of recording directory
+        :param segmentsamples: samples in each segment file, files are preallocated to this size
+        :param blocksamples: samples handed to writer thread at once
+        :param queueblocks: blocks that can be waiting for writer before data is dropped
+        :param info: dict of extra information stored in manifest (device name, filters etc)
+        """
+        self.path = os.path.join(os.path.expanduser(directory),
+                                 '%s_%s' % (prefix, time.strftime('%Y%m%d_%H%M%S')))
+        self.segmentsamples = int(segmentsamples)
+        self.blocksamples = int(blocksamples)
+        self.info = info if info is not None else dict()
+        self.samples = 0            # Samples written to disk
+        self.events = 0             # Events written to disk
+        self.dropped = 0            # Samples dropped because writer was behind
+        self.droppedevents = 0      # Events dropped because writer was behind
+        self.error = None           # Last error of writer thread
+        self._ncols = len(RECORDING_CHANNELS) + 1
+        self._block = np.zeros((self.blocksamples, self._ncols), dtype=RECORDING_DTYPE)
+        self._nblock = 0
+        self._lock = Lock()
+        self._queue = Queue.Queue(maxsize=queueblocks)
+        self._thread = None
+        self._running = False
+        self._segments = []
+        self._segfile = None
+        self._segused = 0
+        self._evfile = None
+
+    def isRunning(self):
+        return self._running
+
+    def start(self):
+        """
+        Create recording directory and start writer thread
+        :return: path of recording
+        """
+        if self._running:
+            return self.path
+        os.makedirs(self.path)
+        self._evfile = open(os.path.join(self.path, 'events.jsonl'), 'a')
+        self._running = True
+        self._writemanifest()
+        self._thread = Thread(target=self._writer, name='gaitech_bci_recorder')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.path
+
+    def stop(self):
+        """
+        Flush pending samples, wait for writer and close all files
+        :return: None
+        """
+        if not self._running:
+            return
+        with self._lock:
+            self._running = False
+            self._flushblock()
+        self._queue.put(None)   # Writer exits when it reaches this, so wait for it even if queue is full
+        self._thread.join()
+        self._thread = None
+
+    def addSample(self, _time, _sample):
+        """
+        Add one sample, called from acquisition thread, never blocks on disk
+        :param _time: time of sample in seconds
+        :param _sample: values of [Fp1, Fp2, F7, F8, T3, T4, T5, T6, O1, O2]
+        :return: None
+        """
+        with self._lock:
+            if not self._running:
+                return
+            _row = self._block[self._nblock]
+            _row[0] = _time
+            _row[1:] = _sample
+            self._nblock += 1
+            if self._nblock == self.blocksamples:
+                self._flushblock()
+
+    def addEvent(self, _time, event_id, event_status, event_remark):
+        """
+        Add an event, written in order with samples
+        :return: None
+        """
+        if not self._running:
+            return
+        try:
+            self._queue.put_nowait(('event', (_time, event_id, event_status, event_remark)))
+        except Queue.Full:
+            self.droppedevents += 1
+
+    def _flushblock(self):
+        # Called with lock held, hands current block to writer and starts a new one #
+        if self._nblock == 0:
+            return
+        try:
+            self._queue.put_nowait(('data', self._block[:self._nblock]))
+        except Queue.Full:
+            self.dropped += self._nblock
+        self._block = np.zeros((self.blocksamples, self._ncols), dtype=RECORDING_DTYPE)
+        self._nblock = 0
+
+    ##################################################
+    ############ Writer Thread #######################
+    def _writer(self):
+        while True:
+            _item = self._queue.get()
+            if _item is None:
+                break
+            try:
+                if _item[0] == 'data':
+                    self._writeblock(_item[1])
+                else:
+                    self._writeevent(*_item[1])
+            except (IOError, OSError) as e:
+                self.error = str(e)
+                self.dropped += _item[1].shape[0] if _item[0] == 'data' else 0
+        try:
+            self._closesegment()
+            self._evfile.flush()
+            os.fsync(self._evfile.fileno())
+            self._evfile.close()
+            self._writemanifest()
+        except (IOError, OSError) as e:
+            self.error = str(e)
+
+    def _writeblock(self, _block):
+        _pos = 0
+        while _pos < _block.shape[0]:
+            if self._segfile is None or self._segused == self.segmentsamples:
+                self._opensegment()
+            _n = min(_block.shape[0] - _pos, self.segmentsamples - self._segused)
+            self._segfile.write(_block[_pos:_pos + _n].tobytes())
+            if self._segused == 0:
+                self._segments[-1]['start'] = float(_block[_pos, 0])
+            self._segments[-1]['end'] = float(_block[_pos + _n - 1, 0])
+            self._segused += _n
+            self._segments[-1]['samples'] = self._segused
+            self.samples += _n
+            _pos += _n
+
+    def _writeevent(self, _time, event_id, event_status, event_remark):
+        self._evfile.write(json.dumps({'time': _time, 'id': event_id, 'status': event_status,
+                                       'remark': event_remark}) + '\n')
+        self.events += 1
+
+    def _opensegment(self):
+        """
+        Close current segment and open next one preallocated to full size
+        :return: None
+        """
+        self._closesegment()
+        _fname = 'segment_%04d.dat' % len(self._segments)
+        self._segfile = open(os.path.join(self.path, _fname), 'wb')
+        self._segfile.truncate(self.segmentsamples * self._ncols * np.dtype(RECORDING_DTYPE).itemsize)
+        self._segused = 0
+        self._segments.append({'file': _fname, 'samples': 0, 'start': None, 'end': None})
+        self._writemanifest()
+
+    def _closesegment(self):
+        """
+        Trim segment file to written samples and fsync it, so a rotated segment is always complete on disk
+        :return: None
+        """
+        if self._segfile is None:
+            return
+        self._segfile.truncate(self._segused * self._ncols * np.dtype(RECORDING_DTYPE).itemsize)
+        self._segfile.flush()
+        os.fsync(self._segfile.fileno())
+        self._segfile.close()
+        self._segfile = None
+        self._evfile.flush()
+        os.fsync(self._evfile.fileno())
+        self._writemanifest()
+
+    def _writemanifest(self):
+        _manifest = {'version': RECORDING_VERSION, 'mode': 'Common Reference', 'channels': RECORDING_CHANNELS,
+                     'dtype': RECORDING_DTYPE, 'columns': ['time'] + RECORDING_CHANNELS,
+                     'segment_samples': self.segmentsamples, 'segments': self._segments,
+                     'events': 'events.jsonl', 'samples': self.samples, 'dropped': self.dropped,
+                     'dropped_events': self.droppedevents, 'complete': not self._running,
+                     'info': self.info}
+        _tmp = os.path.join(self.path, 'manifest.json.tmp')
+        with open(_tmp, 'w') as _f:
+            json.dump(_manifest, _f, indent=1)
+            _f.flush()
+            os.fsync(_f.fileno())
+        os.rename(_tmp, os.path.join(self.path, 'manifest.json'))
+
+
+def LoadEEGRecording(_path):
+    """
+    Load recording written by GaitechEEGRecorder, segments are memory mapped
+    :param _path: recording directory
+    :return: {'mode': 'Common Reference', 'time': np.array, 'data': {chname: np.array}, 'markers': [(id, time, event, note), ...]}
+    """
+    with open(os.path.join(_path, 'manifest.json'), 'r') as _f:
+        _manifest = json.load(_f)
+    _ncols = len(_manifest['columns'])
+    _parts = []
+    for _seg in _manifest['segments']:
+        if _seg['samples'] > 0:
+            _parts.append(np.memmap(os.path.join(_path, _seg['file']), dtype=_manifest['dtype'], mode='r',
+                                    shape=(_seg['samples'], _ncols)))
+    if len(_parts) == 1:
+        _rows = _parts[0]
+    elif len(_parts) > 1:
+        _rows = np.concatenate(_parts, axis=0)
+    else:
+        _rows = np.zeros((0, _ncols), dtype=_manifest['dtype'])
+    _data = {'mode': _manifest['mode'], 'time': _rows[:, 0], 'data': dict(), 'markers': []}
+    for _i, _ch in enumerate(_manifest['channels']):
+        _data['data'][_ch] = _rows[:, _i + 1]
+    _evfile = os.path.join(_path, _manifest['events'])
+    if os.path.isfile(_evfile):
+        with open(_evfile, 'r') as _f:
+            for _line in _f:
+                if _line.strip() == '':
+                    continue
+                _ev = json.loads(_line)
+                _data['markers'].append((_ev['id'], _ev['time'], _ev['status'], _ev['remark']))
+    return _data
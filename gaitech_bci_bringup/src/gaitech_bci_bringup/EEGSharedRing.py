@@ -0,0 +1,288 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Shared memory ring of common reference samples, written by gaitech_bci_device for consumers on same host
+File holds a small header and a ring of rows [time, Fp1, ..., O2], readers map it read-only and get numpy views
+Metadata is advertised as parameter shared_memory under every data topic of device node
+"""
+import os, mmap, socket, tempfile, time
+from threading import Thread, Lock
+import numpy as np
+import rospy
+
+SHARED_RING_MAGIC = 0x314d485349434247     # 'GBCISHM1'
+SHARED_RING_VERSION = 1
+SHARED_RING_HEADER = 8                      # uint64 fields : magic, version, channels, capacity, written, rate(float)
+SHARED_RING_POLL = 0.01                     # Seconds between polls of readers
+SHARED_RING_RECHECK = 1.0                   # Seconds without samples before readers look for a restarted writer
+SHARED_RING_PARAM = 'shared_memory'         # Name of metadata parameter under data topic
+
+
+class GaitechSharedRingWriter():
+    """
+    Writer side of shared ring, one sample at a time from acquisition thread
+    """
+    def __init__(self, name, nchannels, capacity, rate):
+        """
+        Create and map ring file, an existing file of same name is replaced
+        :param name: file name, created in /dev/shm if present
+        :param nchannels: channels of every sample
+        :param capacity: samples held
+        :param rate: sample rate, for readers
+        """
+        _dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.path = os.path.join(_dir, name)
+        self.nchannels = int(nchannels)
+        self.capacity = int(capacity)
+        self.rate = float(rate)
+        _size = 8 * SHARED_RING_HEADER + 8 * self.capacity * (self.nchannels + 1)
+        if os.path.exists(self.path):
+            os.unlink(self.path)    # Readers of old ring keep their mapping until they see file changed
+        _fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            os.ftruncate(_fd, _size)
+            self._map = mmap.mmap(_fd, _size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(_fd)
+        self.header = np.frombuffer(self._map, dtype='uint64', count=SHARED_RING_HEADER)
+        self.rows = np.frombuffer(self._map, dtype='float64', offset=8 * SHARED_RING_HEADER).reshape(
+            (self.capacity, self.nchannels + 1))
+        self.header[1] = SHARED_RING_VERSION
+        self.header[2] = self.nchannels
+        self.header[3] = self.capacity
+        self.header[4] = 0
+        self.header[5:6].view('float64')[0] = self.rate
+        self.header[0] = SHARED_RING_MAGIC     # Written last, marks ring as ready
+        self.written = 0
+
+    def write(self, _time, sample):
+        """
+        Add sample, counter is published after row is complete
+        :param _time: sample time in seconds
+        :param sample: values of channels
+        :return: None
+        """
+        _row = self.rows[self.written % self.capacity]
+        _row[0] = _time
+        _row[1:] = sample
+        self.written += 1
+        self.header[4] = self.written
+
+    def metadata(self):
+        """
+        :return: dict advertised to readers
+        """
+        return {'path': self.path, 'host': socket.gethostname(), 'channels': self.nchannels,
+                'capacity': self.capacity, 'rate': self.rate, 'version': SHARED_RING_VERSION}
+
+    def close(self):
+        """
+        Unmap and remove ring file
+        :return: None
+        """
+        self.header = None
+        self.rows = None
+        self._map = None    # Unmapped once views handed out are released
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class GaitechSharedRingReader():
+    """
+    Reader side of shared ring, maps file read-only and returns copies of new samples
+    """
+    def __init__(self, path, position=None):
+        """
+        :param path: ring file
+        :param position: first sample read, None to read only samples written after opening
+        """
+        _fd = os.open(path, os.O_RDONLY)
+        try:
+            _stat = os.fstat(_fd)
+            self._map = mmap.mmap(_fd, _stat.st_size, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(_fd)
+        self.path = path
+        self.inode = _stat.st_ino   # A restarted writer creates a new file at path
+        self.header = np.frombuffer(self._map, dtype='uint64', count=SHARED_RING_HEADER)
+        if self.header[0] != SHARED_RING_MAGIC or self.header[1] != SHARED_RING_VERSION:
+            raise ValueError('%s is not a gaitech_bci shared ring' % path)
+        self.nchannels = int(self.header[2])
+        self.capacity = int(self.header[3])
+        self.rate = float(self.header[5:6].view('float64')[0])
+        self.rows = np.frombuffer(self._map, dtype='float64', offset=8 * SHARED_RING_HEADER).reshape(
+            (self.capacity, self.nchannels + 1))
+        self.position = int(self.header[4]) if position is None else int(position)
+        self.dropped = 0
+
+    def read(self):
+        """
+        Samples written since last read, at most up to end of ring
+        Rows are copied and counter is read again after copy, rows writer overwrote meanwhile are dropped
+        :return: (np.array of times, np.array (channels x samples))
+        """
+        _written = int(self.header[4])
+        if _written < self.position:
+            self.position = _written    # Writer restarted
+        if _written - self.position > self.capacity - 1:
+            _skip = _written - self.position - (self.capacity - 1)
+            self.dropped += _skip
+            self.position += _skip
+        _start = self.position % self.capacity
+        _n = min(_written - self.position, self.capacity - _start)
+        _rows = np.array(self.rows[_start:_start + _n])
+        # Writer is at row of sample _written, so samples before _written - capacity + 1 may be torn #
+        _torn = min(max(int(self.header[4]) - self.capacity + 1 - self.position, 0), _n)
+        self.dropped += _torn
+        self.position += _n
+        _rows = _rows[_torn:]
+        return _rows[:, 0], _rows[:, 1:].T
+
+    def changed(self):
+        """
+        :return: True if file at path is gone or was replaced by a restarted writer
+        """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def close(self):
+        self.header = None
+        self.rows = None
+        self._map = None
+
+
+class GaitechSharedSubscriber():
+    """
+    Subscriber like object that polls shared ring of a data topic on its own thread
+    Calls callback(times, block) with new samples, block is (channels x samples) of common reference
+    When no samples arrive for SHARED_RING_RECHECK seconds ring of topic is looked up again, a ring replaced by a
+    restarted device node is opened again and if ring is gone subscriber made by fallback is used instead
+    """
+    def __init__(self, topic, callback, poll=SHARED_RING_POLL, fallback=None):
+        """
+        :param topic: data topic that advertises shared ring, see SharedRingOfTopic
+        :param callback: func(times, block)
+        :param poll: seconds between polls
+        :param fallback: func() returning a rospy.Subscriber of topic, None to wait for ring to come back
+        """
+        _meta = SharedRingOfTopic(topic)
+        if _meta is None:
+            raise ValueError('No shared ring for %s on this host' % topic)
+        self.topic = topic
+        self.name = rospy.resolve_name(topic)
+        self.reader = GaitechSharedRingReader(_meta['path'])
+        self.callback = callback
+        self.poll = poll
+        self.fallback = fallback
+        self.subscriber = None      # Subscriber made by fallback once ring is gone
+        self._running = True
+        self._lock = Lock()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def unregister(self):
+        """
+        Stop polling, callback is not called afterwards
+        :return: None
+        """
+        with self._lock:
+            self._running = False
+            if self.subscriber is not None:
+                self.subscriber.unregister()
+                self.subscriber = None
+
+    def _run(self):
+        _lastdata = time.time()
+        while self._running and not rospy.is_shutdown():
+            _times, _block = self.reader.read()
+            if len(_times) > 0 and self._running:
+                self.callback(_times, _block)
+                _lastdata = time.time()
+            elif time.time() - _lastdata >= SHARED_RING_RECHECK:
+                _lastdata = time.time()
+                if self.reader.changed() and not self._reopen():
+                    break
+            if len(_times) == 0 or self.reader.position == int(self.reader.header[4]):
+                time.sleep(self.poll)
+        self.reader.close()
+
+    def _reopen(self):
+        """
+        Open ring of restarted writer, or switch to fallback subscriber if ring is gone
+        :return: True if ring is read further
+        """
+        _meta = SharedRingOfTopic(self.topic)
+        if _meta is not None:
+            try:
+                _reader = GaitechSharedRingReader(_meta['path'], position=0)
+            except (EnvironmentError, ValueError) as e:
+                rospy.logwarn('Could not open shared memory data of %s, trying again : %s', self.name, e)
+                return True     # Writer may still be setting up ring
+            self.reader.close()
+            self.reader = _reader
+            rospy.loginfo('Reading restarted shared memory data of %s', self.name)
+            return True
+        if self.fallback is None:
+            return True     # Keep waiting for ring to come back
+        with self._lock:
+            if self._running:
+                self.subscriber = self.fallback()
+                rospy.logwarn('Shared memory data of %s is gone, subscribed to topic', self.name)
+            self._running = False
+        return False
+
+
+#################################
+### Helping Functions ###########
+#################################
+def SharedRingOfTopic(topic):
+    """
+    Metadata of shared ring advertised for data topic, if ring is on this host
+    :param topic: topic name, resolved with remappings of this node
+    :return: dict or None
+    """
+    _param = '%s/%s' % (rospy.resolve_name(topic), SHARED_RING_PARAM)
+    try:
+        if not rospy.has_param(_param):
+            return None
+        _meta = rospy.get_param(_param)
+    except (socket.error, KeyError):
+        return None
+    if not isinstance(_meta, dict) or _meta.get('host') != socket.gethostname() or \
+            _meta.get('version') != SHARED_RING_VERSION or not os.path.exists(_meta.get('path', '')):
+        return None
+    return _meta
@@ -0,0 +1,312 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Catalog of recorded bag files
+Bags are summarized from their index and connection records only, samples are never decoded
+"""
+import os, sys, json, time, sqlite3, rosbag
+import numpy as np
+from gaitech_bci_bringup.EEGMontage import EEG_MONTAGES
+from .EEGRecordingCache import GaitechCacheDirectory
+
+CATALOG_VERSION = 1     # Increment whenever catalog schema changes
+CATALOG_GAP = 0.05      # Default interval between samples (sec) above which it is counted as gap
+CATALOG_MODES = dict((_m.msgtype, _m.name) for _m in EEG_MONTAGES)     # Data message type to mode name
+_SCHEMA = ['CREATE TABLE IF NOT EXISTS bags (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL, '
+           'indexed REAL, mode TEXT, start REAL, end REAL, duration REAL, samples INTEGER, period REAL, '
+           'gaps INTEGER, gap_max REAL, gap_total REAL, events INTEGER, quality TEXT)',
+           'CREATE TABLE IF NOT EXISTS topics (bag INTEGER, topic TEXT, type TEXT, count INTEGER)',
+           'CREATE TABLE IF NOT EXISTS events (bag INTEGER, event_id TEXT, status TEXT, count INTEGER)',
+           'CREATE INDEX IF NOT EXISTS bags_mode ON bags (mode)',
+           'CREATE INDEX IF NOT EXISTS topics_bag ON topics (bag)',
+           'CREATE INDEX IF NOT EXISTS events_bag ON events (bag)',
+           'CREATE INDEX IF NOT EXISTS events_id ON events (event_id)',
+           'CREATE INDEX IF NOT EXISTS events_status ON events (status)']
+
+
+class GaitechBagCatalog():
+    """
+    SQLite catalog of bag files with mode, topics, sample counts, durations, gap statistics and events
+    """
+    def __init__(self, dbfile=None, gap=CATALOG_GAP):
+        if dbfile is None:
+            dbfile = os.path.join(GaitechCacheDirectory(), 'catalog.db')
+        if not os.path.isdir(os.path.dirname(os.path.abspath(dbfile))):
+            os.makedirs(os.path.dirname(os.path.abspath(dbfile)))
+        self.dbfile = dbfile
+        self.gap = gap
+        self.db = sqlite3.connect(dbfile)
+        self.db.row_factory = sqlite3.Row
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != CATALOG_VERSION:
+            # Catalog written by older version, rebuild it #
+            for _table in ['bags', 'topics', 'events']:
+                self.db.execute('DROP TABLE IF EXISTS %s' % _table)
+            self.db.execute('PRAGMA user_version = %d' % CATALOG_VERSION)
+        for _stmt in _SCHEMA:
+            self.db.execute(_stmt)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def update(self, directory, recursive=True, callback=None):
+        """
+        Index new or modified bags in directory and drop bags that were removed from it
+        :param directory: directory to scan
+        :param recursive: scan sub directories
+        :param callback: function(path, status) called for each bag, status is 'indexed', 'unchanged' or error
+        :return: number of bags indexed
+        """
+        directory = os.path.abspath(directory)
+        _found = set()
+        _indexed = 0
+        for _root, _dirs, _files in os.walk(directory):
+            if not recursive:
+                del _dirs[:]
+            for _f in sorted(_files):
+                if not _f.endswith('.bag'):
+                    continue
+                _path = os.path.join(_root, _f)
+                _dbpath = CatalogText(_path, sys.getfilesystemencoding())
+                _found.add(_dbpath)
+                try:
+                    _st = os.stat(_path)
+                    _row = self.db.execute('SELECT size, mtime FROM bags WHERE path = ?', (_dbpath,)).fetchone()
+                    if _row is not None and _row['size'] == _st.st_size and _row['mtime'] == _st.st_mtime:
+                        if callback is not None:
+                            callback(_path, 'unchanged')
+                        continue
+                    self._index_bag(_path, _dbpath, _st)
+                    _indexed += 1
+                    if callback is not None:
+                        callback(_path, 'indexed')
+                except (rosbag.ROSBagException, IOError, OSError, ValueError, sqlite3.Error) as e:
+                    self.db.rollback()
+                    if callback is not None:
+                        callback(_path, str(e))
+        # Remove bags no longer present #
+        directory = CatalogText(directory, sys.getfilesystemencoding())
+        _prefix = directory.rstrip(os.sep) + os.sep
+        for _row in self.db.execute('SELECT id, path FROM bags').fetchall():
+            if _row['path'].startswith(_prefix) and _row['path'] not in _found:
+                if recursive or os.path.dirname(_row['path']) == directory:
+                    self._remove_bag(_row['id'])
+        self.db.commit()
+        return _indexed
+
+    def search(self, mode=None, event=None, topic=None, minduration=None, path=None):
+        """
+        Search catalog
+        :param mode: mode of data e.g. Common Reference
+        :param event: event id or event status contained in bag, sql wildcards allowed
+        :param topic: topic recorded in bag, sql wildcards allowed
+        :param minduration: minimum duration of data (sec)
+        :param path: path of bag, sql wildcards allowed
+        :return: list of dict, one per bag, with topics and events
+        """
+        _where = []
+        _args = []
+        if mode is not None:
+            _where.append('mode LIKE ?')
+            _args.append(u'%%%s%%' % CatalogText(mode))
+        if event is not None:
+            _where.append('id IN (SELECT bag FROM events WHERE event_id LIKE ? OR status LIKE ?)')
+            _args.extend([CatalogText(event), CatalogText(event)])
+        if topic is not None:
+            _where.append('id IN (SELECT bag FROM topics WHERE topic LIKE ?)')
+            _args.append(CatalogText(topic))
+        if minduration is not None:
+            _where.append('duration >= ?')
+            _args.append(minduration)
+        if path is not None:
+            _where.append('path LIKE ?')
+            _args.append(CatalogText(path, sys.getfilesystemencoding()))
+        _sql = 'SELECT * FROM bags'
+        if len(_where) > 0:
+            _sql += ' WHERE ' + ' AND '.join(_where)
+        _bags = []
+        for _row in self.db.execute(_sql + ' ORDER BY start', _args).fetchall():
+            _bag = dict(zip(_row.keys(), _row))
+            _bag['quality'] = json.loads(_bag['quality']) if _bag['quality'] else None
+            _bag['topics'] = [dict(zip(_t.keys(), _t)) for _t in
+                              self.db.execute('SELECT topic, type, count FROM topics WHERE bag = ?', (_bag['id'],))]
+            _bag['eventlist'] = [dict(zip(_e.keys(), _e)) for _e in
+                                 self.db.execute('SELECT event_id, status, count FROM events WHERE bag = ?',
+                                                 (_bag['id'],))]
+            _bags.append(_bag)
+        return _bags
+
+    def _index_bag(self, _path, _dbpath, _st):
+        """
+        Summarize a bag and store it in catalog
+        :param _path:
+        :param _dbpath: _path as text stored in catalog
+        :param _st: os.stat of bag
+        :return: None
+        """
+        _summary = {'mode': '', 'start': None, 'end': None, 'duration': 0.0, 'samples': 0, 'period': None,
+                    'gaps': 0, 'gap_max': 0.0, 'gap_total': 0.0, 'events': 0, 'quality': None}
+        _topics = []
+        _events = dict()
+        with rosbag.Bag(_path, 'r') as _bag:
+            _info = _bag.get_type_and_topic_info()[1]
+            _modes = []
+            _datatopic = None
+            for _topic, _tinfo in sorted(_info.items()):
+                _topics.append((CatalogText(_topic), CatalogText(_tinfo.msg_type), _tinfo.message_count))
+                if _tinfo.msg_type in CATALOG_MODES:
+                    _modes.append(CATALOG_MODES[_tinfo.msg_type])
+                    if _datatopic is None or _tinfo.message_count > _info[_datatopic].message_count:
+                        _datatopic = _topic
+            _summary['mode'] = ', '.join(sorted(set(_modes)))
+            if _datatopic is not None:
+                _summary.update(self._index_times(_bag, _datatopic))
+            # Event and device info topics are small, these are the only messages read #
+            for _topic, _tinfo in _info.items():
+                if _tinfo.msg_type == 'gaitech_bci_bringup/EEGEvent':
+                    for _, _msg, _ in _bag.read_messages(topics=[_topic]):
+                        _k = (CatalogText(_msg.event_id), CatalogText(_msg.event_status))
+                        _events[_k] = _events.get(_k, 0) + 1
+                        _summary['events'] += 1
+                elif _tinfo.msg_type == 'gaitech_bci_bringup/DeviceInfo':
+                    _summary['quality'] = self._index_quality(_bag, _topic)
+        if _summary['quality'] is not None:
+            _summary['quality'] = json.dumps(_summary['quality'])
+        _row = self.db.execute('SELECT id FROM bags WHERE path = ?', (_dbpath,)).fetchone()
+        if _row is not None:
+            self._remove_bag(_row['id'])
+        _cur = self.db.execute('INSERT INTO bags (path, size, mtime, indexed, mode, start, end, duration, samples, '
+                               'period, gaps, gap_max, gap_total, events, quality) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (_dbpath, _st.st_size, _st.st_mtime, time.time(), _summary['mode'], _summary['start'],
+                                _summary['end'], _summary['duration'], _summary['samples'], _summary['period'],
+                                _summary['gaps'], _summary['gap_max'], _summary['gap_total'], _summary['events'],
+                                _summary['quality']))
+        _bagid = _cur.lastrowid
+        self.db.executemany('INSERT INTO topics (bag, topic, type, count) VALUES (?, ?, ?, ?)',
+                            [(_bagid, ) + _t for _t in _topics])
+        self.db.executemany('INSERT INTO events (bag, event_id, status, count) VALUES (?, ?, ?, ?)',
+                            [(_bagid, _k[0], _k[1], _v) for _k, _v in _events.items()])
+        self.db.commit()
+
+    def _index_times(self, _bag, _topic):
+        """
+        Sample count, duration and gap statistics of a topic from receipt times in index of bag
+        :param _bag: open rosbag.Bag
+        :param _topic:
+        :return: dict
+        """
+        _times = IndexTimesOfTopic(_bag, _topic)
+        if _times is None:
+            # No usable index, chunks of topic are read but messages are not deserialized #
+            _times = np.fromiter((_t.to_sec() for _, _, _t in _bag.read_messages(topics=[_topic], raw=True)),
+                                 dtype='float64')
+        _times = np.sort(_times)
+        _stats = {'samples': int(_times.shape[0])}
+        if _times.shape[0] == 0:
+            return _stats
+        _stats['start'] = _times[0]
+        _stats['end'] = _times[-1]
+        _stats['duration'] = _times[-1] - _times[0]
+        if _times.shape[0] > 1:
+            _diff = np.diff(_times)
+            _gaps = _diff[_diff > self.gap]
+            _stats['period'] = float(np.median(_diff))
+            _stats['gaps'] = int(_gaps.shape[0])
+            _stats['gap_max'] = float(_diff.max())
+            _stats['gap_total'] = float(_gaps.sum())
+        return _stats
+
+    @staticmethod
+    def _index_quality(_bag, _topic):
+        """
+        Mean electrode quality while device was connected
+        :param _bag: open rosbag.Bag
+        :param _topic: DeviceInfo topic
+        :return: dict or None
+        """
+        _elecs = ['fp1', 'fp2', 'f7', 'f8', 't3', 't4', 't5', 't6', 'o1', 'o2']
+        _vals = []
+        for _, _msg, _ in _bag.read_messages(topics=[_topic]):
+            if _msg.device_connected:
+                _vals.append([getattr(_msg, _e) for _e in _elecs])
+        if len(_vals) == 0:
+            return None
+        _mean = np.mean(np.asarray(_vals, dtype='float64'), axis=0)
+        return dict((_e.capitalize() if _e.startswith('fp') else _e.upper(), float(_v))
+                    for _e, _v in zip(_elecs, _mean))
+
+    def _remove_bag(self, _bagid):
+        self.db.execute('DELETE FROM topics WHERE bag = ?', (_bagid,))
+        self.db.execute('DELETE FROM events WHERE bag = ?', (_bagid,))
+        self.db.execute('DELETE FROM bags WHERE id = ?', (_bagid,))
+
+
+#################################
+### Helping Functions ###########
+#################################
+def IndexTimesOfTopic(_bag, _topic):
+    """
+    Receipt times of messages of a topic from index entries of its connections, no chunk of bag is read
+    rosbag has no public API for index entries, its internals are only used for bag format 2.0 where they hold
+    every entry once the bag is opened
+    :param _bag: open rosbag.Bag
+    :param _topic:
+    :return: np.array of times, not sorted, or None if index is not available
+    """
+    _connections = getattr(_bag, '_connections', None)
+    _indexes = getattr(_bag, '_connection_indexes', None)
+    if getattr(_bag, 'version', None) != 200 or not isinstance(_connections, dict) or \
+            not isinstance(_indexes, dict):
+        return None
+    _times = []
+    for _conn in _connections.values():
+        if getattr(_conn, 'topic', None) == _topic:
+            _times.append(np.fromiter((_entry.time.to_sec() for _entry in _indexes.get(_conn.id, [])),
+                                      dtype='float64'))
+    if len(_times) == 0:
+        return np.zeros(0, dtype='float64')
+    return np.concatenate(_times)
+
+
+def CatalogText(_s, encoding='utf-8'):
+    """
+    Text as unicode for sqlite, byte strings with non ascii characters are rejected by sqlite of python 2
+    :param _s: str or unicode
+    :param encoding: encoding of byte strings
+    :return: unicode
+    """
+    if isinstance(_s, bytes):
+        return _s.decode(encoding or 'utf-8', 'replace')
+    return _s
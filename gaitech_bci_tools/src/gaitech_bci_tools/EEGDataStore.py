@@ -0,0 +1,185 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Numpy storage of time and channel samples for data viewer
+"""
+import numpy as np
+
+STORE_CHUNK = 60000         # Samples added to capacity whenever store grows, one minute of device data
+STORE_DTYPE = 'float32'     # Type of channel samples, time is always float64
+
+
+class GaitechDataStore():
+    """
+    Growable column store of sample times and channels
+    Samples live in preallocated numpy arrays that grow in chunks, time and channel properties are views of stored
+    samples so they can be passed to plots without copy. Views are invalidated by next extend, take them again after
+    With maxsamples only latest samples are kept, every sample is written twice in a ring of double size so the
+    kept samples are always one contiguous view
+    """
+    def __init__(self, channels, maxsamples=None, dtype=STORE_DTYPE, chunk=STORE_CHUNK):
+        """
+        :param channels: channel names
+        :param maxsamples: samples kept in ring mode, None to keep all samples
+        :param dtype: type of channel samples
+        :param chunk: growth of capacity in samples
+        """
+        self.channels = list(channels)
+        self.dtype = dtype
+        self.chunk = max(int(chunk), 1)
+        self.maxsamples = None if maxsamples is None else max(int(maxsamples), 1)
+        self.count = 0      # Samples added so far, in ring mode samples before count - maxsamples are gone
+        if self.maxsamples is None:
+            self._allocate(self.chunk)
+        else:
+            self._allocate(2 * self.maxsamples)
+
+    def __len__(self):
+        if self.maxsamples is None:
+            return self.count
+        return min(self.count, self.maxsamples)
+
+    @property
+    def first(self):
+        """
+        Number of samples added before first kept sample, index i of views is sample first + i of all added samples
+        """
+        return self.count - len(self)
+
+    @property
+    def time(self):
+        """
+        View of sample times
+        """
+        _s = self._start()
+        return self._time[_s:_s + len(self)]
+
+    @property
+    def block(self):
+        """
+        View of samples, (channels x samples)
+        """
+        _s = self._start()
+        return self._block[:, _s:_s + len(self)]
+
+    def channel(self, name):
+        """
+        View of samples of one channel
+        :param name: channel name
+        :return: np.array
+        """
+        _s = self._start()
+        return self._block[self.channels.index(name), _s:_s + len(self)]
+
+    def columns(self):
+        """
+        Views of all channels
+        :return: {chname: np.array}
+        """
+        return dict(zip(self.channels, self.block))
+
+    def extend(self, _time, columns):
+        """
+        Add samples
+        :param _time: sample times, list or np.array
+        :param columns: {chname: samples} with an entry for every channel, or np.array (channels x samples)
+        :return: None
+        """
+        _time = np.asarray(_time, dtype='float64')
+        _n = _time.shape[0]
+        if _n == 0:
+            return
+        if isinstance(columns, dict):
+            _block = np.empty((len(self.channels), _n), dtype=self.dtype)
+            for (_i, _ch) in enumerate(self.channels):
+                _block[_i] = columns[_ch]
+        else:
+            _block = np.asarray(columns)
+        if self.maxsamples is None:
+            if self.count + _n > self._time.shape[0]:
+                self._grow(self.count + _n)
+            self._time[self.count:self.count + _n] = _time
+            self._block[:, self.count:self.count + _n] = _block
+        else:
+            if _n > self.maxsamples:
+                self.count += _n - self.maxsamples
+                _time, _block = _time[-self.maxsamples:], _block[:, -self.maxsamples:]
+                _n = self.maxsamples
+            _cap = self.maxsamples
+            _pos = self.count % _cap
+            _first = min(_n, _cap - _pos)
+            for _off in (0, _cap):
+                self._time[_off + _pos:_off + _pos + _first] = _time[:_first]
+                self._block[:, _off + _pos:_off + _pos + _first] = _block[:, :_first]
+                if _first < _n:
+                    self._time[_off:_off + _n - _first] = _time[_first:]
+                    self._block[:, _off:_off + _n - _first] = _block[:, _first:]
+        self.count += _n
+
+    def todict(self):
+        """
+        :return: {time: np.array, data: {chname: np.array}} of views
+        """
+        return {'time': self.time, 'data': self.columns()}
+
+    def _start(self):
+        if self.maxsamples is None or self.count <= self.maxsamples:
+            return 0
+        return self.count % self.maxsamples
+
+    def _allocate(self, capacity):
+        self._time = np.zeros(capacity, dtype='float64')
+        self._block = np.zeros((len(self.channels), capacity), dtype=self.dtype)
+
+    def _grow(self, size):
+        _time, _block = self._time, self._block
+        self._allocate(max(size, _time.shape[0] + self.chunk))
+        self._time[:self.count] = _time[:self.count]
+        self._block[:, :self.count] = _block[:, :self.count]
+
+
+def DataStoreFromColumns(channels, _time, columns, maxsamples=None, dtype=STORE_DTYPE):
+    """
+    Create store holding given samples, e.g. data loaded from a bag file
+    :param channels: channel names
+    :param _time: sample times
+    :param columns: {chname: samples}
+    :param maxsamples: see GaitechDataStore
+    :param dtype: see GaitechDataStore
+    :return: GaitechDataStore
+    """
+    _n = len(_time)
+    _store = GaitechDataStore(channels, maxsamples, dtype, chunk=max(_n, 1))
+    _store.extend(_time, columns)
+    return _store
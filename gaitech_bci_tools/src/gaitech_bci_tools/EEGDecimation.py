@@ -0,0 +1,289 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Decimation of channel data for display, paint cost depends on pixels of plot instead of samples in view
+"""
+import numpy as np
+
+PYRAMID_FACTOR = 4      # Bins of a level combined into one bin of next level
+PYRAMID_LEVELS = 8      # Bins of top level hold PYRAMID_FACTOR ** PYRAMID_LEVELS samples
+PYRAMID_CHUNK = 4096    # Bins added to capacity of a level whenever it grows
+DISPLAY_METHODS = ('none', 'minmax', 'lttb')    # Decimation methods of GaitechDisplayDecimator
+DISPLAY_POINTS_PER_PIXEL = 2    # Points of decimated curve per pixel of plot width
+DISPLAY_RATE = 1000.0   # Samples per second of device
+
+
+class GaitechMinMaxPyramid():
+    """
+    Min/max decimation pyramid over all channels of a GaitechDataStore
+    Level j keeps min, max and start time of bins of PYRAMID_FACTOR ** (j + 1) samples, first level is computed from
+    samples and every next level from level below it. update only computes bins completed since last update, so it
+    can be called after every live batch. Bins are numbered from first sample added to store, bins of samples dropped
+    by a ring store are dropped too
+    """
+    def __init__(self, store, factor=PYRAMID_FACTOR, levels=PYRAMID_LEVELS):
+        """
+        :param store: GaitechDataStore
+        :param factor: bins combined into one bin of next level
+        :param levels: number of levels
+        """
+        self.store = store
+        self.factor = int(factor)
+        self.sizes = [self.factor ** (_j + 1) for _j in range(levels)]   # Samples per bin of each level
+        _nch = len(store.channels)
+        self._time = [np.zeros(PYRAMID_CHUNK, dtype='float64') for _ in self.sizes]
+        self._min = [np.zeros((_nch, PYRAMID_CHUNK), dtype=store.dtype) for _ in self.sizes]
+        self._max = [np.zeros((_nch, PYRAMID_CHUNK), dtype=store.dtype) for _ in self.sizes]
+        self._base = [0] * len(self.sizes)  # Bin number at position 0 of arrays
+        self._done = [0] * len(self.sizes)  # Bins computed, bin numbers below this are complete
+        self.update()
+
+    def update(self):
+        """
+        Compute bins completed by samples added to store since last update
+        :return: None
+        """
+        _first = self.store.first
+        _count = self.store.count
+        for (_j, _size) in enumerate(self.sizes):
+            self._trim(_j, -(-_first // _size))     # First bin with all samples still in store
+            _lo = self._done[_j]
+            _hi = _count // _size
+            if _hi <= _lo:
+                continue
+            _nbins = _hi - _lo
+            if _j == 0:
+                _i0 = _lo * _size - _first
+                _src = self.store.block[:, _i0:_i0 + _nbins * _size]
+                _src = _src.reshape((_src.shape[0], _nbins, _size))
+                _mins = _src.min(axis=2)
+                _maxs = _src.max(axis=2)
+                _times = self.store.time[_i0:_i0 + _nbins * _size:_size]
+            else:
+                _p0 = _lo * self.factor - self._base[_j - 1]
+                _p1 = _p0 + _nbins * self.factor
+                _nch = self._min[_j - 1].shape[0]
+                _mins = self._min[_j - 1][:, _p0:_p1].reshape((_nch, _nbins, self.factor)).min(axis=2)
+                _maxs = self._max[_j - 1][:, _p0:_p1].reshape((_nch, _nbins, self.factor)).max(axis=2)
+                _times = self._time[_j - 1][_p0:_p1:self.factor]
+            self._reserve(_j, _lo - self._base[_j] + _nbins)
+            _at = _lo - self._base[_j]
+            self._time[_j][_at:_at + _nbins] = _times
+            self._min[_j][:, _at:_at + _nbins] = _mins
+            self._max[_j][:, _at:_at + _nbins] = _maxs
+            self._done[_j] = _hi
+
+    def envelope(self, channel, i0, i1, pixels):
+        """
+        Points to draw samples i0 to i1 of channel on pixels wide plot
+        Samples are returned as they are if there are less than PYRAMID_FACTOR per pixel, otherwise min and max of
+        bins of the coarsest level with at least one bin per pixel, in order of time
+        :param channel: channel name
+        :param i0: first sample, index of store views
+        :param i1: last sample, inclusive
+        :param pixels: width of plot
+        :return: (x, y) np.arrays
+        """
+        _ch = self.store.channels.index(channel)
+        _n = i1 - i0 + 1
+        _j = -1
+        for (_k, _size) in enumerate(self.sizes):
+            if _n // _size >= pixels:
+                _j = _k
+        if _j == -1:
+            return self.store.time[i0:i1 + 1], self.store.block[_ch, i0:i1 + 1]
+        _size = self.sizes[_j]
+        _first = self.store.first
+        _b0 = max((_first + i0) // _size, self._base[_j])
+        _b1 = min((_first + i1) // _size, self._done[_j] - 1)
+        _p0, _p1 = _b0 - self._base[_j], _b1 - self._base[_j] + 1
+        _times = self._time[_j][_p0:_p1]
+        _mins = self._min[_j][_ch, _p0:_p1]
+        _maxs = self._max[_j][_ch, _p0:_p1]
+        # Samples after last complete bin #
+        _t0 = max(self._done[_j] * _size - _first, i0)
+        if _t0 <= i1:
+            _tail = self.store.block[_ch, _t0:i1 + 1]
+            _times = np.append(_times, self.store.time[_t0])
+            _mins = np.append(_mins, _tail.min())
+            _maxs = np.append(_maxs, _tail.max())
+        _x = np.repeat(_times, 2)
+        _y = np.empty(_x.shape[0], dtype=_mins.dtype)
+        _y[0::2] = _mins
+        _y[1::2] = _maxs
+        return _x, _y
+
+    def _trim(self, _j, _need):
+        """
+        Drop bins of level before bin _need whose samples are gone from a ring store
+        """
+        if _need > self._done[_j]:
+            # Samples dropped before their bins were computed, start again at _need #
+            self._base[_j] = self._done[_j] = _need
+        elif _need - self._base[_j] >= PYRAMID_CHUNK:
+            _shift = _need - self._base[_j]
+            _keep = self._done[_j] - self._base[_j]
+            self._time[_j][:_keep - _shift] = self._time[_j][_shift:_keep]
+            self._min[_j][:, :_keep - _shift] = self._min[_j][:, _shift:_keep]
+            self._max[_j][:, :_keep - _shift] = self._max[_j][:, _shift:_keep]
+            self._base[_j] = _need
+
+    def _reserve(self, _j, size):
+        """
+        Grow arrays of level to hold at least size bins
+        """
+        if size <= self._time[_j].shape[0]:
+            return
+        _cap = max(size, self._time[_j].shape[0] + PYRAMID_CHUNK)
+        _time = np.zeros(_cap, dtype='float64')
+        _min = np.zeros((self._min[_j].shape[0], _cap), dtype=self._min[_j].dtype)
+        _max = np.zeros((self._max[_j].shape[0], _cap), dtype=self._max[_j].dtype)
+        _n = self._done[_j] - self._base[_j]
+        _time[:_n] = self._time[_j][:_n]
+        _min[:, :_n] = self._min[_j][:, :_n]
+        _max[:, :_n] = self._max[_j][:, :_n]
+        self._time[_j], self._min[_j], self._max[_j] = _time, _min, _max
+
+
+def DisplayBucket(seconds, pixels, method='minmax', rate=DISPLAY_RATE):
+    """
+    Samples per bucket of GaitechDisplayDecimator for a plot showing seconds of data on pixels of width
+    :param seconds: width of view in seconds
+    :param pixels: width of plot in pixels
+    :param method: one of DISPLAY_METHODS
+    :param rate: samples per second
+    :return: samples per bucket, 1 when samples are drawn as they are
+    """
+    if method == 'none' or pixels <= 0:
+        return 1
+    _samples = seconds * rate / (pixels * DISPLAY_POINTS_PER_PIXEL)    # Samples per point of curve
+    if method == 'minmax':
+        _samples *= 2   # Every bucket gives two points
+    return max(int(_samples), 1)
+
+
+class GaitechDisplayDecimator():
+    """
+    Streaming decimation of live batches for display, full rate samples stay in store
+    minmax gives min and max of every bucket, lttb (largest triangle three buckets) one sample of every bucket that
+    forms largest triangle with sample chosen in previous bucket and mean of next bucket. Samples of a bucket not yet
+    complete are kept until next push so buckets do not depend on size of batches, lttb also keeps last complete
+    bucket since its choice needs next one
+    """
+    def __init__(self, channels, method='minmax'):
+        """
+        :param channels: number of channels
+        :param method: one of DISPLAY_METHODS
+        """
+        if method not in DISPLAY_METHODS:
+            raise ValueError('decimation method must be one of %s' % ', '.join(DISPLAY_METHODS))
+        self.channels = int(channels)
+        self.method = method
+        self.received = 0   # Samples pushed, with emitted used to check reduction of display data
+        self.emitted = 0    # Points given out per channel
+        self.reset(1)
+
+    def reset(self, bucket):
+        """
+        Forget pending samples and start again with a new bucket size, used when curves are drawn again
+        :param bucket: samples per bucket, see DisplayBucket
+        :return: None
+        """
+        self.bucket = max(int(bucket), 1)
+        self._time = np.zeros(0, dtype='float64')
+        self._block = np.zeros((self.channels, 0))
+        self._last = None   # (times, values) per channel of samples chosen in previous bucket by lttb
+
+    def push(self, _time, block):
+        """
+        Decimate new samples
+        :param _time: np.array of sample times
+        :param block: np.array (channels x samples)
+        :return: (x, y), y is np.array (channels x points), x is np.array of points shared by all channels or
+         np.array (channels x points) for lttb
+        """
+        self.received += len(_time)
+        if self.bucket == 1 or self.method == 'none':
+            self.emitted += len(_time)
+            return _time, block
+        if self._time.shape[0] > 0:
+            _time = np.concatenate((self._time, _time))
+            block = np.concatenate((self._block, block), axis=1)
+        if self.method == 'minmax':
+            _x, _y, _keep = self._minmax(_time, block)
+        else:
+            _x, _y, _keep = self._lttb(_time, block)
+        self._time = _time[_keep:].copy()
+        self._block = block[:, _keep:].copy()
+        self.emitted += _y.shape[1]
+        return _x, _y
+
+    def _minmax(self, _time, block):
+        _nb = _time.shape[0] // self.bucket
+        _full = _nb * self.bucket
+        _bins = block[:, :_full].reshape((self.channels, _nb, self.bucket))
+        _x = np.repeat(_time[0:_full:self.bucket], 2)
+        _y = np.empty((self.channels, 2 * _nb), dtype=block.dtype)
+        _y[:, 0::2] = _bins.min(axis=2)
+        _y[:, 1::2] = _bins.max(axis=2)
+        return _x, _y, _full
+
+    def _lttb(self, _time, block):
+        _x = []
+        _y = []
+        _start = 0
+        if self._last is None and _time.shape[0] > 0:
+            # First sample of stream is always kept #
+            self._last = (np.repeat(_time[0], self.channels), block[:, 0].copy())
+            _x.append(self._last[0])
+            _y.append(self._last[1])
+            _start = 1
+        _nb = (_time.shape[0] - _start) // self.bucket
+        _rows = np.arange(self.channels)
+        for _b in range(_nb - 1):   # Last complete bucket waits for next one
+            _i0 = _start + _b * self.bucket
+            _i1 = _i0 + self.bucket
+            _ta, _ya = self._last
+            _tc = _time[_i1:_i1 + self.bucket].mean()
+            _yc = block[:, _i1:_i1 + self.bucket].mean(axis=1)
+            _area = np.abs((_ta - _tc)[:, np.newaxis] * (block[:, _i0:_i1] - _ya[:, np.newaxis]) -
+                           (_ta[:, np.newaxis] - _time[_i0:_i1]) * (_yc - _ya)[:, np.newaxis])
+            _k = _i0 + _area.argmax(axis=1)
+            self._last = (_time[_k], block[_rows, _k])
+            _x.append(self._last[0])
+            _y.append(self._last[1])
+        _keep = _start + max(_nb - 1, 0) * self.bucket
+        if len(_x) == 0:
+            return np.zeros((self.channels, 0)), np.zeros((self.channels, 0), dtype=block.dtype), _keep
+        return np.array(_x).T, np.array(_y).T, _keep
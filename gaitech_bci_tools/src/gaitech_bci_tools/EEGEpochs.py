@@ -0,0 +1,276 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Epoch extraction for EEG recordings
+Cuts event locked windows from the recording without copying it and caches
+resulting epoch tensors on disk
+"""
+import os, json, hashlib, tempfile
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from gaitech_bci_bringup.EEGMontage import EEG_MONTAGES
+from .ROSInterfaceNode import LoadEEGDataFromBagFile
+from .EEGRecordingCache import GaitechCacheDirectory, EvictLeastRecentlyUsed
+
+# Channel order used for each mode when building epoch tensors #
+EPOCH_CHANNELS = dict((_m.name, _m.channels) for _m in EEG_MONTAGES)   # Channel order of epochs per mode
+EPOCH_STORE_VERSION = 1     # Increment whenever layout of stored epochs changes
+EPOCH_STORE_SIZE = 512 * 1024 * 1024    # Default size cap of epoch store in bytes
+
+
+#################################
+### Epoch Extraction ############
+#################################
+def EEGDataToArray(_data, sfreq=1000.0):
+    """
+    Place samples of a recording on a uniform sample grid
+    :param _data: Data as returned by LoadEEGDataFromBagFile
+    :param sfreq: Sampling frequency of grid
+    :return: (channel names, np.array of shape (channels, samples), time of first sample)
+    """
+    _chnames = [_ch for _ch in EPOCH_CHANNELS.get(_data['mode'], sorted(_data['data'].keys()))
+                if _ch in _data['data']]
+    _time = np.asarray(_data['time'], dtype='float64')
+    if _time.shape[0] == 0:
+        return _chnames, np.zeros((len(_chnames), 0)), 0.0
+    _starttime = _time[0]
+    _idx = ((_time - _starttime) * sfreq).astype('int64')
+    _keep = _idx >= 0   # Samples stamped before first sample can not be placed
+    _signal = np.zeros((len(_chnames), _idx.max() + 1), dtype='float64')
+    for _i, _ch in enumerate(_chnames):
+        _signal[_i, _idx[_keep]] = np.asarray(_data['data'][_ch], dtype='float64')[_keep]
+    return _chnames, _signal, _starttime
+
+
+def EpochWindows(_signal, nwin):
+    """
+    All windows of length nwin of a signal, as a view sharing memory with the signal
+    :param _signal: np.array of shape (channels, samples)
+    :param nwin: window length in samples
+    :return: read only view of shape (channels, samples - nwin + 1, nwin)
+    """
+    _signal = np.ascontiguousarray(_signal)
+    _nch, _nsmp = _signal.shape
+    _nwins = max(_nsmp - nwin + 1, 0)
+    _view = as_strided(_signal, shape=(_nch, _nwins, nwin),
+                       strides=(_signal.strides[0], _signal.strides[1], _signal.strides[1]))
+    _view.flags.writeable = False
+    return _view
+
+
+def ExtractEEGEpochs(_data, tmin=-0.3, tmax=0.7, baseline=(None, 0.0), sfreq=1000.0):
+    """
+    Extract event locked epochs from a recording, events are grouped by event status of markers
+    :param _data: Data as returned by LoadEEGDataFromBagFile
+    :param tmin: start of epoch relative to event (sec)
+    :param tmax: end of epoch relative to event (sec)
+    :param baseline: (start, end) of baseline relative to event, None for either means epoch start or end,
+                     baseline=None disables baseline correction
+    :param sfreq: Sampling frequency of data
+    :return: {mode, ch_names, sfreq, tmin, times=np.array, data=np.array(epochs, channels, times),
+              events=np.array(epochs, 3), event_id=dict}
+    """
+    if tmax <= tmin:
+        raise ValueError('tmax must be greater than tmin')
+    _chnames, _signal, _starttime = EEGDataToArray(_data, sfreq)
+    _n0 = int(round(tmin * sfreq))
+    _n1 = int(round(tmax * sfreq))
+    _nwin = _n1 - _n0 + 1
+    _times = np.arange(_n0, _n1 + 1, dtype='float64') / sfreq
+    # Map markers to event ids in order of first appearance #
+    _event_id = dict()
+    _onsets = []
+    _ids = []
+    for _mrk in _data.get('markers', []):
+        if _mrk[2] not in _event_id:
+            _event_id[_mrk[2]] = len(_event_id) + 1
+        _onsets.append(int((_mrk[1] - _starttime) * sfreq))
+        _ids.append(_event_id[_mrk[2]])
+    _onsets = np.asarray(_onsets, dtype='int64')
+    _ids = np.asarray(_ids, dtype='int64')
+    # Keep only epochs completely inside recording #
+    _starts = _onsets + _n0
+    _valid = (_starts >= 0) & (_starts + _nwin <= _signal.shape[1])
+    _starts = _starts[_valid]
+    _events = np.zeros((_starts.shape[0], 3), dtype='int64')
+    _events[:, 0] = _onsets[_valid]
+    _events[:, 2] = _ids[_valid]
+    # Gather all windows at once with epochs as leading axis, indexing makes the only copy, already contiguous #
+    _epochs = EpochWindows(_signal, _nwin).transpose(1, 0, 2)[_starts]
+    if baseline is not None and _epochs.shape[0] > 0:
+        _b0 = 0 if baseline[0] is None else int(np.searchsorted(_times, baseline[0]))
+        _b1 = _nwin if baseline[1] is None else int(np.searchsorted(_times, baseline[1], side='right'))
+        if _b1 > _b0:
+            _epochs -= _epochs[:, :, _b0:_b1].mean(axis=2)[:, :, np.newaxis]
+    return {'mode': _data['mode'], 'ch_names': _chnames, 'sfreq': sfreq, 'tmin': tmin, 'times': _times,
+            'data': _epochs, 'events': _events, 'event_id': _event_id}
+
+
+#################################
+### Epoch Store #################
+#################################
+class GaitechEpochStore():
+    """
+    On disk store of epoch tensors keyed by bag file stamp and epoching parameters, with LRU eviction as in
+    GaitechRecordingCache, each entry is one .npz file whose mtime tells when it was last used
+    """
+    def __init__(self, cachedir=None, maxsize=EPOCH_STORE_SIZE):
+        if cachedir is None:
+            cachedir = os.path.join(GaitechCacheDirectory(), 'epochs')
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+
+    def key(self, bagstamp, **params):
+        """
+        Key for epochs of a bag file
+        :param bagstamp: stamp of bag file, see BagFileStamp
+        :param params: epoching parameters
+        :return: key string
+        """
+        _desc = json.dumps({'bag': bagstamp, 'params': params, 'version': EPOCH_STORE_VERSION}, sort_keys=True)
+        return hashlib.sha1(_desc).hexdigest()
+
+    def load(self, key):
+        """
+        Load stored epochs
+        :param key:
+        :return: epochs dict as returned by ExtractEEGEpochs or None if not in store
+        """
+        _fname = os.path.join(self.cachedir, '%s.npz' % key)
+        if not os.path.isfile(_fname):
+            return None
+        try:
+            with np.load(_fname) as _npz:
+                _meta = json.loads(str(_npz['meta']))
+                _epochs = {'data': _npz['data'], 'events': _npz['events'], 'times': _npz['times']}
+        except (IOError, ValueError, KeyError):
+            return None     # Corrupt entry, will be recomputed
+        try:
+            os.utime(_fname, None)      # Mark as recently used
+        except OSError:
+            pass    # Read only or shared store, entry is still usable
+        _epochs['mode'] = _meta['mode']
+        _epochs['ch_names'] = [str(_ch) for _ch in _meta['ch_names']]
+        _epochs['sfreq'] = _meta['sfreq']
+        _epochs['tmin'] = _meta['tmin']
+        _epochs['event_id'] = dict((str(_k), _v) for _k, _v in _meta['event_id'].items())
+        return _epochs
+
+    def save(self, key, epochs):
+        """
+        Store epochs, write is atomic so readers never see partial files
+        :param key:
+        :param epochs: epochs dict as returned by ExtractEEGEpochs
+        :return: None
+        """
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        _meta = json.dumps({'mode': epochs['mode'], 'ch_names': epochs['ch_names'], 'sfreq': epochs['sfreq'],
+                            'tmin': epochs['tmin'], 'event_id': epochs['event_id']})
+        _fd, _tmpname = tempfile.mkstemp(suffix='.npz', prefix='.tmp', dir=self.cachedir)
+        try:
+            with os.fdopen(_fd, 'wb') as _f:
+                np.savez(_f, data=epochs['data'], events=epochs['events'], times=epochs['times'],
+                         meta=np.array(_meta))
+            os.rename(_tmpname, os.path.join(self.cachedir, '%s.npz' % key))
+        except:
+            if os.path.exists(_tmpname):
+                os.remove(_tmpname)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until store is below its size cap
+        :return: None
+        """
+        _entries = []
+        for _name in os.listdir(self.cachedir):
+            _fname = os.path.join(self.cachedir, _name)
+            if _name.startswith('.') or not _name.endswith('.npz'):
+                continue    # Not an entry or still being written
+            try:
+                _st = os.stat(_fname)
+            except OSError:
+                continue
+            _entries.append((_st.st_mtime, _st.st_size, _fname))
+        EvictLeastRecentlyUsed(_entries, self.maxsize)
+
+
+def BagFileStamp(_fname):
+    """
+    Identity of a bag file as in GaitechRecordingCache, found without reading the bag
+    :param _fname: Path of rosbag
+    :return: {path, size, mtime}
+    """
+    _st = os.stat(_fname)
+    return {'path': os.path.realpath(_fname), 'size': _st.st_size, 'mtime': _st.st_mtime}
+
+
+def LoadEEGEpochsFromBagFile(_fname, tmin=-0.3, tmax=0.7, baseline=(None, 0.0), sfreq=1000.0, store=None):
+    """
+    Loads epochs of a bag file from epoch store, extracting and storing them if not present
+    :param _fname: Path of rosbag to load from
+    :param store: GaitechEpochStore, None for default store, False to disable caching
+    :return: epochs dict as returned by ExtractEEGEpochs or None if bag has no valid data
+    """
+    if store is None:
+        store = GaitechEpochStore()
+    _key = None
+    if store:
+        _baseline = None if baseline is None else list(baseline)
+        _key = store.key(BagFileStamp(_fname), tmin=tmin, tmax=tmax, baseline=_baseline, sfreq=sfreq)
+        _epochs = store.load(_key)
+        if _epochs is not None:
+            _loginfo('Loaded epochs of %s from %s' % (_fname, store.cachedir))
+            return _epochs
+    _data = LoadEEGDataFromBagFile(None, _fname)
+    if _data is None or _data['mode'] == '':
+        return None
+    _epochs = ExtractEEGEpochs(_data, tmin, tmax, baseline, sfreq)
+    if store:
+        store.save(_key, _epochs)
+    return _epochs
+
+
+#################################
+### Helping Functions ###########
+#################################
+def _loginfo(_msg):
+    try:
+        import rospy
+        rospy.get_rostime()
+        rospy.loginfo(_msg)
+    except Exception:
+        print _msg
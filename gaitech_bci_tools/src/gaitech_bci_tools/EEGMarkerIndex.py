@@ -0,0 +1,207 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Index of markers for alignment with samples and time range queries
+"""
+import numpy as np
+
+
+class GaitechMarkerIndex():
+    """
+    Time sorted index over markers [(id, time, event, note), ...], with lookup of markers by id
+    Positions returned by queries are positions of markers in the list the index was built from
+    """
+    def __init__(self, markers=None):
+        self._times = np.zeros(64, dtype='float64')   # Marker times in sorted order
+        self._order = np.zeros(64, dtype='int64')     # Position of marker in original list
+        self._ids = {}                                # Position of marker by id
+        self._n = 0
+        if markers is not None:
+            self.rebuild(markers)
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, markerid):
+        return markerid in self._ids
+
+    def position(self, markerid):
+        """
+        Position of marker with id in original list
+        :param markerid:
+        :return: int, -1 if there is no such marker
+        """
+        return self._ids.get(markerid, -1)
+
+    @property
+    def times(self):
+        """
+        Marker times in sorted order
+        """
+        return self._times[:self._n]
+
+    @property
+    def positions(self):
+        """
+        Positions of markers in original list, in order of time
+        """
+        return self._order[:self._n]
+
+    def rebuild(self, markers):
+        """
+        Rebuild index for a list of markers
+        :param markers: [(id, time, event, note), ...]
+        :return: None
+        """
+        _times = np.fromiter((_mrk[1] for _mrk in markers), dtype='float64', count=len(markers))
+        _order = np.argsort(_times, kind='mergesort')
+        self._ids = dict((_mrk[0], _i) for (_i, _mrk) in enumerate(markers))
+        self._n = 0
+        self._reserve(_times.shape[0])
+        self._times[:_times.shape[0]] = _times[_order]
+        self._order[:_times.shape[0]] = _order
+        self._n = _times.shape[0]
+
+    def append(self, marker):
+        """
+        Add marker appended at end of original list, O(1) when markers arrive in order of time
+        :param marker: (id, time, event, note)
+        :return: None
+        """
+        self.extend([marker])
+
+    def extend(self, markers):
+        """
+        Add markers appended at end of original list
+        :param markers: [(id, time, event, note), ...]
+        :return: None
+        """
+        _count = len(markers)
+        if _count == 0:
+            return
+        _times = np.fromiter((_mrk[1] for _mrk in markers), dtype='float64', count=_count)
+        _order = np.arange(self._n, self._n + _count, dtype='int64')
+        for (_i, _mrk) in enumerate(markers):
+            self._ids[_mrk[0]] = self._n + _i
+        if _count > 1 and np.any(np.diff(_times) < 0):
+            _sort = np.argsort(_times, kind='mergesort')
+            _times = _times[_sort]
+            _order = _order[_sort]
+        self._reserve(self._n + _count)
+        if self._n == 0 or _times[0] >= self._times[self._n - 1]:
+            # Live markers, just append #
+            self._times[self._n:self._n + _count] = _times
+            self._order[self._n:self._n + _count] = _order
+            self._n += _count
+        else:
+            _at = np.searchsorted(self.times, _times, side='right')
+            _newtimes = np.insert(self.times, _at, _times)
+            _neworder = np.insert(self.positions, _at, _order)
+            self._times[:self._n + _count] = _newtimes
+            self._order[:self._n + _count] = _neworder
+            self._n += _count
+
+    def range(self, t0, t1):
+        """
+        Markers with t0 <= time <= t1, O(log n + k)
+        :param t0:
+        :param t1:
+        :return: np.array of positions in original list, in order of time
+        """
+        _i0 = np.searchsorted(self.times, t0, side='left')
+        _i1 = np.searchsorted(self.times, t1, side='right')
+        return self._order[_i0:_i1]
+
+    def nearest(self, t):
+        """
+        Marker nearest to time t, O(log n)
+        :param t:
+        :return: position in original list, -1 if there are no markers
+        """
+        if self._n == 0:
+            return -1
+        _i = int(np.searchsorted(self.times, t, side='left'))
+        if _i == self._n or (_i > 0 and (t - self._times[_i - 1]) <= (self._times[_i] - t)):
+            _i -= 1
+        return int(self._order[_i])
+
+    def count_before(self, t):
+        """
+        Number of markers with time < t
+        :param t:
+        :return: int
+        """
+        return int(np.searchsorted(self.times, t, side='left'))
+
+    def align(self, sampletimes):
+        """
+        Nearest sample of every marker
+        :param sampletimes: sorted sample times
+        :return: np.array of sample index per marker, in order of original list
+        """
+        _idx = np.zeros(self._n, dtype='int64')
+        _idx[self.positions] = NearestSampleIndex(sampletimes, self.times)
+        return _idx
+
+    def _reserve(self, size):
+        if size <= self._times.shape[0]:
+            return
+        _cap = max(size, 2 * self._times.shape[0])
+        _times = np.zeros(_cap, dtype='float64')
+        _order = np.zeros(_cap, dtype='int64')
+        _times[:self._n] = self.times
+        _order[:self._n] = self.positions
+        self._times = _times
+        self._order = _order
+
+
+def NearestSampleIndex(sampletimes, querytimes):
+    """
+    Index of nearest sample for each query time with one np.searchsorted call
+    :param sampletimes: sorted sample times
+    :param querytimes: times to search
+    :return: np.array of indices, -1 for all if there are no samples
+    """
+    _st = np.asarray(sampletimes, dtype='float64')
+    _qt = np.asarray(querytimes, dtype='float64')
+    if _st.shape[0] == 0:
+        return np.zeros(_qt.shape, dtype='int64') - 1
+    _pos = np.searchsorted(_st, _qt, side='left')
+    _after = np.clip(_pos, 0, _st.shape[0] - 1)
+    _before = np.clip(_pos - 1, 0, _st.shape[0] - 1)
+    # Same tie breaking as bisect based search, equal distance goes to earlier sample #
+    _useafter = (_st[_after] - _qt) < (_qt - _st[_before])
+    _idx = np.where(_useafter, _after, _before)
+    _idx[_pos == 0] = 0
+    return _idx
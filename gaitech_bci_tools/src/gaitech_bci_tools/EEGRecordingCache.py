@@ -0,0 +1,197 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+On disk cache of decoded recordings
+Recordings are stored as memory mappable .npy files so re-opening them does not decode the bag again
+"""
+import os, json, shutil, hashlib, tempfile
+import numpy as np
+
+RECORDING_CACHE_SIZE = 2 * 1024 * 1024 * 1024     # Default size cap of cache in bytes
+
+
+class GaitechRecordingCache():
+    """
+    Cache of decoded recordings keyed by bag path, size, mtime and loader version, with LRU eviction
+    Each entry is a directory with time.npy (samples), data.npy (channels x samples) and meta.json
+    """
+    def __init__(self, cachedir=None, maxsize=RECORDING_CACHE_SIZE):
+        if cachedir is None:
+            cachedir = os.path.join(GaitechCacheDirectory(), 'recordings')
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+
+    def key(self, _fname, version):
+        """
+        Key for a bag file
+        :param _fname: Path of rosbag
+        :param version: Version of loader that decodes the bag
+        :return: key string
+        """
+        _st = os.stat(_fname)
+        _desc = json.dumps({'path': os.path.abspath(_fname), 'size': _st.st_size, 'mtime': _st.st_mtime,
+                            'version': version}, sort_keys=True)
+        return hashlib.sha1(_desc).hexdigest()
+
+    def load(self, key):
+        """
+        Load a cached recording, arrays are memory mapped read only
+        :param key:
+        :return: {mode, time, data, markers} as returned by LoadEEGDataFromBagFile or None if not cached
+        """
+        _dir = os.path.join(self.cachedir, key)
+        _metafile = os.path.join(_dir, 'meta.json')
+        if not os.path.isfile(_metafile):
+            return None
+        try:
+            with open(_metafile, 'r') as _f:
+                _meta = json.load(_f)
+            _time = np.load(os.path.join(_dir, 'time.npy'), mmap_mode='r')
+            _data = np.load(os.path.join(_dir, 'data.npy'), mmap_mode='r')
+        except (IOError, ValueError):
+            return None     # Corrupt or evicted while reading, will be decoded again
+        try:
+            os.utime(_metafile, None)   # Mark as recently used
+        except OSError:
+            pass    # Read only or shared cache, entry is still usable
+        _recording = {'mode': str(_meta['mode']), 'time': _time, 'data': dict(), 'markers': []}
+        for _i, _ch in enumerate(_meta['channels']):
+            _recording['data'][str(_ch)] = _data[_i]
+        for _mrk in _meta['markers']:
+            _recording['markers'].append((_utf8(_mrk[0]), _mrk[1], _utf8(_mrk[2]), _utf8(_mrk[3])))
+        return _recording
+
+    def save(self, key, recording):
+        """
+        Store a decoded recording, entry becomes visible atomically
+        :param key:
+        :param recording: {mode, time, data, markers} as returned by LoadEEGDataFromBagFile
+        :return: None
+        """
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        _channels = sorted(recording['data'].keys())
+        _tmpdir = tempfile.mkdtemp(dir=self.cachedir, prefix='.tmp')
+        try:
+            np.save(os.path.join(_tmpdir, 'time.npy'), np.asarray(recording['time'], dtype='float64'))
+            _data = np.empty((len(_channels), len(recording['time'])), dtype='float64')
+            for _i, _ch in enumerate(_channels):
+                _data[_i] = recording['data'][_ch]
+            np.save(os.path.join(_tmpdir, 'data.npy'), _data)
+            with open(os.path.join(_tmpdir, 'meta.json'), 'w') as _f:
+                json.dump({'mode': recording['mode'], 'channels': _channels,
+                           'markers': [list(_mrk) for _mrk in recording['markers']]}, _f)
+            os.rename(_tmpdir, os.path.join(self.cachedir, key))
+        except OSError:
+            # Entry written by another process in the mean time #
+            shutil.rmtree(_tmpdir, ignore_errors=True)
+            return
+        except:
+            shutil.rmtree(_tmpdir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache is below its size cap
+        :return: None
+        """
+        _entries = []
+        for _key in os.listdir(self.cachedir):
+            _dir = os.path.join(self.cachedir, _key)
+            _metafile = os.path.join(_dir, 'meta.json')
+            if _key.startswith('.') or not os.path.isfile(_metafile):
+                continue
+            try:
+                _size = sum(os.path.getsize(os.path.join(_dir, _f)) for _f in os.listdir(_dir))
+                _entries.append((os.path.getmtime(_metafile), _size, _dir))
+            except OSError:
+                continue
+        EvictLeastRecentlyUsed(_entries, self.maxsize)
+
+
+#################################
+### Helping Functions ###########
+#################################
+def GaitechCacheDirectory():
+    """
+    Directory for gaitech_bci caches, inside ROS_HOME
+    :return:
+    """
+    _roshome = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+    return os.path.join(_roshome, 'gaitech_bci')
+
+
+def EvictLeastRecentlyUsed(entries, maxsize):
+    """
+    Remove least recently used cache entries until their total size is at most maxsize
+    :param entries: [(last used time, size in bytes, path of entry file or directory), ...]
+    :param maxsize: size cap in bytes
+    :return: None
+    """
+    _total = sum(_entry[1] for _entry in entries)
+    for _used, _size, _path in sorted(entries):
+        if _total <= maxsize:
+            break
+        if os.path.isdir(_path):
+            shutil.rmtree(_path, ignore_errors=True)
+        else:
+            try:
+                os.remove(_path)
+            except OSError:
+                pass    # Removed by another process
+        _total -= _size
+
+
+def ReadOnlyRecording(recording):
+    """
+    Recording as read only float64 arrays laid out like a cached entry, channels are rows of one array
+    :param recording: {mode, time, data, markers} with time and channel samples as lists or arrays
+    :return: {mode, time, data, markers}
+    """
+    _channels = sorted(recording['data'].keys())
+    _time = np.array(recording['time'], dtype='float64')
+    _data = np.empty((len(_channels), _time.shape[0]), dtype='float64')
+    for _i, _ch in enumerate(_channels):
+        _data[_i] = recording['data'][_ch]
+    _time.setflags(write=False)
+    _data.setflags(write=False)
+    return {'mode': recording['mode'], 'time': _time, 'data': dict(zip(_channels, _data)),
+            'markers': list(recording['markers'])}
+
+
+def _utf8(_txt):
+    if isinstance(_txt, unicode):
+        return _txt.encode('utf-8')
+    return _txt
@@ -0,0 +1,134 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Spectrograms of channel data, spectra are computed like PSD of view_psd over sliding windows
+"""
+import numpy as np
+from gaitech_bci_bringup.EEGClient import GaitechSampleRing
+
+SPECTRO_RATE = 1000.0   # Sample rate of data
+SPECTRO_WINDOW = 1000   # Samples per spectrum, 1 Hz resolution
+SPECTRO_HOP = 100       # Samples between spectra of live spectrogram
+SPECTRO_FMAX = 60.0     # Highest frequency kept
+SPECTRO_FRAMES = 600    # Spectra kept by live spectrogram, one minute with default hop
+
+
+def Spectrogram(samples, window=SPECTRO_WINDOW, hop=SPECTRO_HOP, fmax=SPECTRO_FMAX, rate=SPECTRO_RATE):
+    """
+    Magnitude spectra of sliding windows, every window is demeaned and hamming weighted
+    :param samples: np.array (channels x samples)
+    :param window: samples per spectrum
+    :param hop: samples between spectra
+    :param fmax: highest frequency kept
+    :param rate: sample rate
+    :return: np.array (channels x spectra x frequencies), spectrum k is of samples k * hop to k * hop + window
+    """
+    samples = np.ascontiguousarray(samples, dtype='float64')
+    _nbins = SpectrogramBins(window, fmax, rate)
+    _nframes = (samples.shape[1] - window) // hop + 1
+    if _nframes <= 0:
+        return np.zeros((samples.shape[0], 0, _nbins))
+    _frames = np.lib.stride_tricks.as_strided(samples, shape=(samples.shape[0], _nframes, window),
+                                              strides=(samples.strides[0], samples.strides[1] * hop,
+                                                       samples.strides[1]))
+    _frames = (_frames - _frames.mean(axis=2)[:, :, np.newaxis]) * np.hamming(window)
+    return 2.0 * np.abs(np.fft.rfft(_frames, n=window, axis=2))[:, :, :_nbins]
+
+
+def SpectrogramBins(window=SPECTRO_WINDOW, fmax=SPECTRO_FMAX, rate=SPECTRO_RATE):
+    """
+    :return: number of frequencies kept by Spectrogram
+    """
+    return min(int(fmax * window / rate) + 1, window // 2 + 1)
+
+
+class GaitechLiveSpectrogram():
+    """
+    Spectrogram of latest data of a GaitechDataStore, update only computes spectra of windows completed by samples
+    added since last update. Spectra of all channels are kept in a GaitechSampleRing with a row per channel and
+    frequency, times are centers of windows
+    """
+    def __init__(self, store, window=SPECTRO_WINDOW, hop=SPECTRO_HOP, fmax=SPECTRO_FMAX, rate=SPECTRO_RATE,
+                 frames=SPECTRO_FRAMES):
+        """
+        :param store: GaitechDataStore
+        :param window: samples per spectrum
+        :param hop: samples between spectra
+        :param fmax: highest frequency kept
+        :param rate: sample rate
+        :param frames: spectra kept
+        """
+        self.store = store
+        self.window = int(window)
+        self.hop = int(hop)
+        self.fmax = fmax
+        self.rate = float(rate)
+        self.nbins = SpectrogramBins(self.window, fmax, rate)
+        self.freqs = np.arange(self.nbins) * self.rate / self.window
+        self.ring = GaitechSampleRing(len(store.channels) * self.nbins, frames)
+        # Sample number of start of next window, data already in store is used up to number of frames kept #
+        self._next = max(store.first, store.count - self.window - (frames - 1) * self.hop)
+
+    def update(self):
+        """
+        Compute spectra of windows completed since last update
+        :return: number of new spectra
+        """
+        _first = self.store.first
+        if self._next < _first:
+            self._next = _first     # Samples dropped by ring store before they were used
+        _n = (self.store.count - self._next - self.window) // self.hop + 1
+        if _n <= 0:
+            return 0
+        if _n > self.ring.capacity:
+            self._next += (_n - self.ring.capacity) * self.hop
+            _n = self.ring.capacity
+        _i0 = self._next - _first
+        _spec = Spectrogram(self.store.block[:, _i0:_i0 + (_n - 1) * self.hop + self.window],
+                            self.window, self.hop, self.fmax, self.rate)
+        _times = self.store.time[_i0 + self.window // 2:_i0 + self.window // 2 + _n * self.hop:self.hop]
+        # (channels x spectra x frequencies) to rows of channel and frequency #
+        self.ring.extend(_times, _spec.transpose(0, 2, 1).reshape((-1, _n)))
+        self._next += _n * self.hop
+        return _n
+
+    def image(self, channel):
+        """
+        Spectra of channel in order of time
+        :param channel: channel name
+        :return: (np.array of times, np.array (spectra x frequencies))
+        """
+        _ch = self.store.channels.index(channel)
+        _times, _rows = self.ring.latest()
+        return _times, _rows[_ch * self.nbins:(_ch + 1) * self.nbins].T
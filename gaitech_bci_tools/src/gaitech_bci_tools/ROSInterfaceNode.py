@@ -35,13 +35,38 @@
 H10C UI Side interface class
 ROS Node
 """
-import rospy, sys, os, rosbag, rosnode
-from threading import Thread
+import rospy, sys, os, time, socket, rosbag, rosnode, rosgraph
+from threading import Thread, Lock, Condition, Event, Timer, current_thread
 from std_srvs.srv import Empty
 from std_msgs.msg import Header
 from gaitech_bci_bringup.srv import *
-from gaitech_bci_bringup.msg import AverageReference, CommonReference, DeviceInfo
-from gaitech_bci_bringup.msg import LongitudinalBipolar, TransverseBipolar, EEGEvent
+from gaitech_bci_bringup.msg import DeviceInfo, EEGEvent
+import numpy as np
+from gaitech_bci_bringup.EEGMontage import EEG_MONTAGES, EEG_MONTAGE_NAMES, MontageOfType
+from gaitech_bci_bringup.EEGClient import GaitechSampleRing
+from gaitech_bci_bringup.EEGSharedRing import GaitechSharedSubscriber, SharedRingOfTopic
+from .EEGRecordingCache import GaitechRecordingCache, ReadOnlyRecording
+
+EEG_LOADER_VERSION = 1  # Increment whenever LoadEEGDataFromBagFile changes decoded data
+LIVE_FLUSH_RATE = 10.0      # Default rate in Hz at which live data is passed to viewer, set by ~live_flush_rate
+LIVE_FLUSH_INTERVAL = 1.0 / LIVE_FLUSH_RATE
+LIVE_MAX_INTERVAL = 1.0     # Longest interval between batches when viewer is slow to paint
+LIVE_MAX_BACKLOG = 10.0     # Seconds of data collected for a stalled viewer before batch is dropped
+DISCOVERY_WORKERS = 8       # Nodes queried at once when graph has to be discovered node by node
+DISCOVERY_TIMEOUT = 2.0     # Seconds after which a node that does not answer is skipped
+SERVICE_TIMEOUT = 3.0       # Seconds to wait for a service call before it is retried
+SERVICE_RETRIES = 2         # Retries of a failed service call
+SERVICE_BACKOFF = 0.25      # Seconds to wait before first retry, doubled for every next retry
+SERVICE_CLOSE_RETRY = 0.1   # Seconds between tries to close a timed out proxy that has no connection yet
+SERVICE_QUEUE_WAIT = 30.0   # Seconds callers on other threads wait for tasks queued before their call
+DEVICE_TIMEOUT = 30.0       # Seconds to wait for scan and connect, these talk to bluetooth device
+LIVE_SAMPLE_RATE = 1000.0   # Sample rate of device, used to size live buffers
+LIVE_HISTORY_SECONDS = 300.0    # Default common reference history replayed on mode change, set by ~live_history_seconds
+NODE_TOPIC_KEYS = ['common', 'average', 'lb', 'tb']     # Keys of data topics in nodename, by montage index
+NODE_ATTACH_RESOLVING = 'resolving'     # Attach states of node, reported to settings through sigNodeAttachState
+NODE_ATTACH_RESOLVED = 'resolved'
+NODE_ATTACH_READY = 'ready'
+NODE_ATTACH_FAILED = 'failed'
 
 
 ############################################################
@@ -53,21 +78,35 @@ class GaitechROSInterfaceNode():
     """
     def __init__(self, mwref=None, mwsetting=None, mwlive=None):
         rospy.loginfo('Intializing ROS Interface Node')
-        self.mainwindow = mwref
+        self.mainwindow = mwref     # Must provide sigWindowTitle, title is set from worker threads
         self.settings = mwsetting
         self.live = mwlive
         self.nodename = None
         self.datasub = None
         self.infosub = None
         self.datastarttime = None
-        self.datalivupdtime = None
         self.livepacketbuffer = None
+        self.livelock = Lock()      # Guards livepacketbuffer between subscriber and flusher
+        self.liverate = float(rospy.get_param('~live_flush_rate', LIVE_FLUSH_RATE))
+        self.liveinterval = 1.0 / self.liverate
+        self.livestats = {'batches': 0, 'coalesced': 0, 'dropped': 0, 'dropped_samples': 0}
+        self.livemode = None        # Mode shown, derived from common reference data when node publishes it
+        self.livehistory = None     # GaitechLiveHistory of common reference data
+        self.livehistoryseconds = float(rospy.get_param('~live_history_seconds', LIVE_HISTORY_SECONDS))
+        self.livereplay = False     # Next batch replays history, set on mode change
+        self.livemarkers = []       # Markers collected for viewer, passed on in batches by flusher
+        self.datatopic = None       # Topic of datasub
+        self.useshared = bool(rospy.get_param('~shared_memory', True))   # Read shared ring of node on same host
+        self.services = GaitechServicePool()    # Service proxies of node and worker for service calls
+        self.attachlock = Lock()        # Guards nodename and subscriptions between ui and attach thread
+        self.attachgeneration = 0       # Incremented on every node change, outdated attach threads stop
         # Subscribe to Event Messages #
         self.eventsub = rospy.Subscriber('~event', EEGEvent, self._oneventmsg)
         rospy.loginfo('Subsrcibed to %s on %s', self.eventsub.type, self.eventsub.name)
         # Callbacks events and data if live window is None #
         self.callbackevent = None   # Assign function
         self.callbackdata = None    # Assign function
+        self.client = None          # Assign GaitechEEGClient to receive data as numpy blocks instead of callbackdata
         ##### Connect Callbacks ######
         if self.settings is not None:
             self.settings.sigScanDevices.connect(self._performscan)
@@ -79,6 +118,10 @@ class GaitechROSInterfaceNode():
             self.settings.sigNodeModified.connect(self._nodemodified)
             # Scan at startup #
             self._scanNodes(self.settings)
+        if self.live is not None:
+            _flusher = Thread(target=self._liveflusher)
+            _flusher.daemon = True
+            _flusher.start()
 
     def _scanNodes(self, wdgname):
         """
@@ -92,97 +135,104 @@ class GaitechROSInterfaceNode():
             :param wdg:
             :return:
             """
-            _allndoes = rosnode.get_node_names()
-            _nnames = []
-            for _nname in _allndoes:
-                _pubs, _, _ = GaitechROSInterfaceNode.__getpubsubsrv(_nname)
-                _isvalid = False
-                for _pub in _pubs:
-                    if 'gaitech_bci_bringup/TransverseBipolar' in _pub or 'gaitech_bci_bringup/CommonReference' in _pub or \
-                            'gaitech_bci_bringup/AverageReference' in _pub or 'gaitech_bci_bringup/LongitudinalBipolar' in _pub:
-                        _isvalid = True
-                        break
-                if _isvalid:
-                    _nnames.append(_nname)
-            wdg.sigNodesReceived.emit(_nnames)
+            wdg.sigNodesReceived.emit(GaitechROSInterfaceNode.__findgaitechnodes())
 
         Thread(target=_parallel_func, args=(wdgname,)).start()
 
     def _nodemodified(self, newnodename):
         """
-        On Node change update topics and services dict
+        On Node change cleanup old node and start attaching new node in background
+        Attach resolves topics and services of node, then queries its filter and status, progress is
+        reported to settings as it goes, an attach is cancelled as soon as another node is selected
         :param newnodename:
         :return:
         """
-        if newnodename == '':
+        newnodename = str(newnodename)
+        if self.nodename is not None and self.nodename['name'] == newnodename:
+            return
+        with self.attachlock:
+            self.attachgeneration += 1      # Cancels attach in progress
             ### Cleanup procedure ###
+            self.services.clear()
             if self.infosub is not None:
                 self.infosub.unregister()
                 self.infosub = None
             if self.datasub is not None:
                 self.datasub.unregister()
                 self.datasub = None
-            self.nodename = None
-            return
-        if self.nodename is None or self.nodename['name'] != newnodename:
+            if newnodename == '':
+                self.nodename = None
+                return
             self.nodename = {'name': newnodename, 'init': True, 'info': None, 'common': None, 'average': None,
                              'lb': None, 'tb': None, 'scan': None, 'connect': None, 'disconnect': None,
                              'slicence': None, 'glicence': None, 'sfilter': None, 'gfilter': None, 'gstatus': None}
-            ### Cleanup procedure ###
-            if self.infosub is not None:
-                self.infosub.unregister()
-                self.infosub = None
-            if self.datasub is not None:
-                self.datasub.unregister()
-                self.datasub = None
-            ### Update services and other stuff ###
-            ### Now set the names to proper values whenever possible ###
-            _pubs, _, _srvs = GaitechROSInterfaceNode.__getpubsubsrv(self.nodename['name'])
-            for _pub in _pubs:
-                _parts = _pub.split()
-                if len(_parts) < 3:
-                    continue
-                if _parts[0] != '*':
-                    continue
-                if 'gaitech_bci_bringup/TransverseBipolar' in _parts[2]:
-                    self.nodename['tb'] = _parts[1]
-                elif 'gaitech_bci_bringup/LongitudinalBipolar' in _parts[2]:
-                    self.nodename['lb'] = _parts[1]
-                elif 'gaitech_bci_bringup/CommonReference' in _parts[2]:
-                    self.nodename['common'] = _parts[1]
-                elif 'gaitech_bci_bringup/AverageReference' in _parts[2]:
-                    self.nodename['average'] = _parts[1]
-                elif 'gaitech_bci_bringup/DeviceInfo' in _parts[2]:
-                    self.nodename['info'] = _parts[1]
-            ######### Now for subscribers ################
-            for _srv in _srvs:
-                _parts = _srv.split()
-                if len(_parts) < 2:
-                    continue
-                if _parts[0] != '*':
-                    continue
-                if '/scan' in _parts[1]:
-                    self.nodename['scan'] = _parts[1]
-                elif '/connect' in _parts[1]:
-                    self.nodename['connect'] = _parts[1]
-                elif '/disconnect' in _parts[1]:
-                    self.nodename['disconnect'] = _parts[1]
-                elif '/get_status' in _parts[1]:
-                    self.nodename['gstatus'] = _parts[1]
-                elif '/get_licence' in _parts[1]:
-                    self.nodename['glicence'] = _parts[1]
-                elif '/get_filter' in _parts[1]:
-                    self.nodename['gfilter'] = _parts[1]
-                elif '/set_filter' in _parts[1]:
-                    self.nodename['sfilter'] = _parts[1]
-                elif '/set_licence' in _parts[1]:
-                    self.nodename['slicence'] = _parts[1]
-            # Update Licence previously stored #
-            #self.__updatelicenceafterget()
-            self.__updatefilterafterget()
-            self.__updatedevnameafterget()
-            ### Finally ###
-            self.nodename['init'] = False
+            # Widget state is read here on GUI thread, attach thread only emits signals #
+            _activemode = self.settings.getActiveMode() if self.settings is not None else None
+            _attach = Thread(target=self._attachnode, args=(self.nodename, self.attachgeneration, _activemode))
+            _attach.daemon = True
+            _attach.start()
+
+    def _attachnode(self, node, generation, activemode=None):
+        """
+        Attach node in states resolving -> resolved -> ready, stops silently once generation is outdated
+        :param node: nodename dict to fill
+        :param generation: attach generation this attach belongs to
+        :param activemode: mode active in settings when attach started
+        :return:
+        """
+        self.__attachstate(node, generation, NODE_ATTACH_RESOLVING)
+        try:
+            _pubs, _, _srvs = GaitechROSInterfaceNode.__getpubsubsrv(node['name'])
+        except Exception as _ex:
+            rospy.logwarn('Unable to resolve node %s : %s', node['name'], str(_ex))
+            self.__attachstate(node, generation, NODE_ATTACH_FAILED)
+            return
+        _found = {}
+        for _pub in _pubs:
+            _parts = _pub.split()
+            if len(_parts) < 3:
+                continue
+            if _parts[0] != '*':
+                continue
+            _montage = MontageOfType(_parts[2])
+            if _montage is not None:
+                _found[NODE_TOPIC_KEYS[_montage.index]] = _parts[1]
+            elif 'gaitech_bci_bringup/DeviceInfo' in _parts[2]:
+                _found['info'] = _parts[1]
+        ######### Now for services ################
+        for _srv in _srvs:
+            _parts = _srv.split()
+            if len(_parts) < 2:
+                continue
+            if _parts[0] != '*':
+                continue
+            if '/scan' in _parts[1]:
+                _found['scan'] = _parts[1]
+            elif '/connect' in _parts[1]:
+                _found['connect'] = _parts[1]
+            elif '/disconnect' in _parts[1]:
+                _found['disconnect'] = _parts[1]
+            elif '/get_status' in _parts[1]:
+                _found['gstatus'] = _parts[1]
+            elif '/get_licence' in _parts[1]:
+                _found['glicence'] = _parts[1]
+            elif '/get_filter' in _parts[1]:
+                _found['gfilter'] = _parts[1]
+            elif '/set_filter' in _parts[1]:
+                _found['sfilter'] = _parts[1]
+            elif '/set_licence' in _parts[1]:
+                _found['slicence'] = _parts[1]
+        with self.attachlock:
+            if generation != self.attachgeneration:
+                return
+            node.update(_found)
+            node['init'] = False        # Names are known, node can be used while remaining queries run
+        self.__attachstate(node, generation, NODE_ATTACH_RESOLVED)
+        # Update Licence previously stored #
+        #self.__updatelicenceafterget()
+        self.__updatefilterafterget(generation)
+        self.__updatedevnameafterget(generation, activemode)
+        self.__attachstate(node, generation, NODE_ATTACH_READY)
 
     def _performscan(self, wdgname):
         """
@@ -190,16 +240,17 @@ class GaitechROSInterfaceNode():
         :param wdgname:
         :return:
         """
-        def _parallel_func(wdg):
-            _sproxy = rospy.ServiceProxy(self.nodename['scan'], DeviceScan)
-            _res = _sproxy()
+        def _parallel_func(wdg, _srvname):
+            _res = self.services.call(_srvname, DeviceScan, timeout=DEVICE_TIMEOUT, retries=0)
             _devs = []
-            for _i in range(len(_res.devices)):
-                _devs.append((_res.devices[_i], _res.validity[_i]))
+            if _res is not None:
+                for _i in range(len(_res.devices)):
+                    _devs.append((_res.devices[_i], _res.validity[_i]))
             wdg.sigScanReceived.emit(_devs)
 
         if self.nodename is not None and not self.nodename['init'] and self.nodename['scan'] is not None:
-            Thread(target=_parallel_func, args=(wdgname,)).start()
+            _srvname = self.nodename['scan']
+            self.services.submit(lambda: _parallel_func(wdgname, _srvname), 'scan')
         else:
             wdgname.sigScanReceived.emit([])
 
@@ -220,9 +271,9 @@ class GaitechROSInterfaceNode():
                     lv.sigDeviceStatus.emit('Avertus %s' % _dname)
             if self.mainwindow is not None:
                 if _dname is not None:
-                    self.mainwindow.setWindowTitle('Gaitech H10C Device : Avertus %s' % _dname)
+                    self.mainwindow.sigWindowTitle.emit('Gaitech H10C Device : Avertus %s' % _dname)
                 else:
-                    self.mainwindow.setWindowTitle('Gaitech H10C Device')
+                    self.mainwindow.sigWindowTitle.emit('Gaitech H10C Device')
 
         def _def_connect(wdg, lv, _dname, _activemode):
             if wdg is not None:
@@ -234,27 +285,25 @@ class GaitechROSInterfaceNode():
                 self.__subscibetomode(_activemode)
             if self.mainwindow is not None:
                 if _dname is not None:
-                    self.mainwindow.setWindowTitle('Gaitech H10C Device : Avertus %s' % _dname)
+                    self.mainwindow.sigWindowTitle.emit('Gaitech H10C Device : Avertus %s' % _dname)
                 else:
-                    self.mainwindow.setWindowTitle('Gaitech H10C Device')
+                    self.mainwindow.sigWindowTitle.emit('Gaitech H10C Device')
             # Subscribe to information messages #
             if self.nodename is not None and not self.nodename['init'] and self.nodename['info'] is not None:
                 self.infosub = rospy.Subscriber(self.nodename['info'], DeviceInfo, self._oninfomsg)
                 rospy.loginfo('Subscribed to : %s', self.nodename['info'])
 
-        def _parallel_func_connect(wdg, _dev, _lv, _activemode):
-            _sproxy = rospy.ServiceProxy(self.nodename['connect'], DeviceConnect)
+        def _parallel_func_connect(wdg, _dev, _lv, _activemode, _srvname):
             _spreq = DeviceConnectRequest()
             _spreq.device = str(_dev)
-            _res = _sproxy(_spreq)
-            if _res.connected:
+            _res = self.services.call(_srvname, DeviceConnect, _spreq, timeout=DEVICE_TIMEOUT, retries=0)
+            if _res is not None and _res.connected:
                 _def_connect(wdg, _lv, _dev, _activemode)
             else:
                 _def_disconnect(wdg, _lv, _dev)
 
-        def _parallel_func_disconnect(wdg, _dev, _lv):
-            _sproxy = rospy.ServiceProxy(self.nodename['disconnect'], Empty)
-            _sproxy()
+        def _parallel_func_disconnect(wdg, _dev, _lv, _srvname):
+            self.services.call(_srvname, Empty)
             _def_disconnect(wdg, _lv)
 
         # Un-register information messages #
@@ -271,12 +320,17 @@ class GaitechROSInterfaceNode():
         if dm == 0:
             if self.nodename['connect'] is not None:
                 _activemode = wdgname.getActiveMode()
-                Thread(target=_parallel_func_connect, args=(wdgname, dname, self.live, _activemode)).start()
+                _srvname = self.nodename['connect']
+                # Only last of rapid connect/disconnect toggles is performed #
+                self.services.submit(lambda: _parallel_func_connect(wdgname, dname, self.live, _activemode, _srvname),
+                                     'connection')
             else:
                 _def_disconnect(wdgname, self.live)
         else:
             if self.nodename['disconnect'] is not None:
-                Thread(target=_parallel_func_disconnect, args=(wdgname, dname, self.live,)).start()
+                _srvname = self.nodename['disconnect']
+                self.services.submit(lambda: _parallel_func_disconnect(wdgname, dname, self.live, _srvname),
+                                     'connection')
             else:
                 _def_disconnect(wdgname, self.live)
 
@@ -286,22 +340,8 @@ class GaitechROSInterfaceNode():
         :param newmode:
         :return:
         """
-        if newmode == 0:
-            rospy.loginfo('Reference mode changed to Common Reference')
-            if self.nodename['common'] is not None:
-                rospy.loginfo('Will subscribe to %s', self.nodename['common'])
-        elif newmode == 1:
-            rospy.loginfo('Reference mode changed to Average Reference')
-            if self.nodename['average'] is not None:
-                rospy.loginfo('Will subscribe to %s', self.nodename['average'])
-        elif newmode == 2:
-            rospy.loginfo('Reference mode changed to Longitudinal-Bipolar')
-            if self.nodename['lb'] is not None:
-                rospy.loginfo('Will subscribe to %s', self.nodename['lb'])
-        elif newmode == 3:
-            rospy.loginfo('Reference mode changed to Transverse-Bipolar')
-            if self.nodename['tb'] is not None:
-                rospy.loginfo('Will subscribe to %s', self.nodename['tb'])
+        if 0 <= newmode < len(EEG_MONTAGES):
+            rospy.loginfo('Reference mode changed to %s', EEG_MONTAGES[newmode].name)
         self.__subscibetomode(newmode)
 
     def _licmodified(self, _newkeys):
@@ -310,14 +350,14 @@ class GaitechROSInterfaceNode():
         :param _newkeys:
         :return:
         """
-        def _parallel_func():
-            _sproxy = rospy.ServiceProxy(self.nodename['slicence'], LicenceUpdate)
+        def _parallel_func(_srvname):
             _req = LicenceUpdateRequest()
             _req.licences = _newkeys
-            _sproxy(_req)
+            self.services.call(_srvname, LicenceUpdate, _req)
 
         if self.nodename is not None and not self.nodename['init'] and self.nodename['slicence'] is not None:
-            Thread(target=_parallel_func).start()
+            _srvname = self.nodename['slicence']
+            self.services.submit(lambda: _parallel_func(_srvname), 'licence')
 
     def _filtermodified(self, _newvals):
         """
@@ -325,201 +365,106 @@ class GaitechROSInterfaceNode():
         :param _newvals:
         :return:
         """
-        def _parallel_func():
-            _sproxy = rospy.ServiceProxy(self.nodename['sfilter'], FilterUpdate)
+        def _parallel_func(_srvname):
             _sreq = FilterUpdateRequest()
             _sreq.lowpass = _newvals['low']
             _sreq.highpass = _newvals['high']
             _sreq.notchlow = _newvals['nlow']
             _sreq.notchhigh = _newvals['nhigh']
-            _sproxy(_sreq)
+            self.services.call(_srvname, FilterUpdate, _sreq)
 
         if self.nodename is not None and not self.nodename['init'] and self.nodename['sfilter'] is not None:
-            Thread(target=_parallel_func).start()
+            # Rapid filter tweaks are coalesced, only latest values are sent #
+            _srvname = self.nodename['sfilter']
+            self.services.submit(lambda: _parallel_func(_srvname), 'filter')
 
     ##### Subscribers Callback #####
-    def _oncmnmsg(self, msg):
+    def _ondatamsg(self, msg, mode):
         """
-        Callback to Common message, passes data to UI
-        :param msg:
+        Callback to data messages of all modes, passes data to UI
+        :param msg: CommonReference, AverageReference, LongitudinalBipolar or TransverseBipolar
+        :param mode: mode name of message
         :return:
         """
+        _stamp = msg.header.stamp
         if self.datastarttime is None:
-            self.datastarttime = msg.header.stamp
-        if self.datalivupdtime is None:
-            self.datalivupdtime = msg.header.stamp
+            self.datastarttime = _stamp
         if self.live is not None:
-            if self.livepacketbuffer is not None and self.livepacketbuffer['mode'] != 'Common Reference':
-                self.livepacketbuffer = None    # Reset Live Packet Buffer
-            # Build Packet Buffer #
-            if self.livepacketbuffer is None:
-                self.livepacketbuffer = {'mode': 'Common Reference', 'data': dict(),
-                                         'time': [(msg.header.stamp - self.datastarttime).to_sec()]}
-                self.livepacketbuffer['data']['Fp1'] = [msg.fp1]
-                self.livepacketbuffer['data']['Fp2'] = [msg.fp2]
-                self.livepacketbuffer['data']['F7'] = [msg.f7]
-                self.livepacketbuffer['data']['F8'] = [msg.f8]
-                self.livepacketbuffer['data']['T3'] = [msg.t3]
-                self.livepacketbuffer['data']['T4'] = [msg.t4]
-                self.livepacketbuffer['data']['T5'] = [msg.t5]
-                self.livepacketbuffer['data']['T6'] = [msg.t6]
-                self.livepacketbuffer['data']['O1'] = [msg.o1]
-                self.livepacketbuffer['data']['O2'] = [msg.o2]
-            else:
-                self.livepacketbuffer['time'].append((msg.header.stamp - self.datastarttime).to_sec())
-                self.livepacketbuffer['data']['Fp1'].append(msg.fp1)
-                self.livepacketbuffer['data']['Fp2'].append(msg.fp2)
-                self.livepacketbuffer['data']['F7'].append(msg.f7)
-                self.livepacketbuffer['data']['F8'].append(msg.f8)
-                self.livepacketbuffer['data']['T3'].append(msg.t3)
-                self.livepacketbuffer['data']['T4'].append(msg.t4)
-                self.livepacketbuffer['data']['T5'].append(msg.t5)
-                self.livepacketbuffer['data']['T6'].append(msg.t6)
-                self.livepacketbuffer['data']['O1'].append(msg.o1)
-                self.livepacketbuffer['data']['O2'].append(msg.o2)
-            # Update UI every 100 ms #
-            if (msg.header.stamp - self.datalivupdtime).to_sec() > 0.1:
-                self.live.sigData.emit(self.livepacketbuffer)
-                self.datalivupdtime = msg.header.stamp
-                self.livepacketbuffer = None
+            _t = (_stamp.secs - self.datastarttime.secs) + (_stamp.nsecs - self.datastarttime.nsecs) * 1e-9
+            with self.livelock:
+                if self.livepacketbuffer is None or self.livepacketbuffer.mode != mode:
+                    self.livepacketbuffer = GaitechLiveBlockBuffer(mode, self.liveinterval)  # Reset Live Packet Buffer
+                self.livepacketbuffer.append(_t, msg)
+            # Passed to UI by _liveflusher #
+        elif self.client is not None:
+            self.client.addMessage(msg, EEG_MONTAGE_NAMES[mode])
         elif self.callbackdata is not None:
-            data = {'mode': 'Common Reference', 'time': msg.header.stamp,
-                    'data': [msg.fp1, msg.fp2, msg.f7, msg.f8, msg.t3, msg.t4, msg.t5, msg.t6, msg.o1, msg.o2]}
+            _montage = EEG_MONTAGE_NAMES[mode]
+            _values = _montage.decode(msg)
+            if _montage.index == 0 and self.livemode is not None and self.livemode != 0:
+                _montage = EEG_MONTAGES[self.livemode]
+                _values = _montage.derive(np.asarray(_values))
+            data = {'mode': _montage.name, 'time': _stamp, 'data': list(_values)}
             self.callbackdata(data)
 
-    def _onavgmsg(self, msg):
+    def _ondatablock(self, times, block):
         """
-        Callback to Avg Msg, passes data to UI
-        :param msg:
+        Callback to blocks of common reference data read from shared memory ring of node
+        :param times: np.array of sample times
+        :param block: np.array (channels x samples)
         :return:
         """
         if self.datastarttime is None:
-            self.datastarttime = msg.header.stamp
-        if self.datalivupdtime is None:
-            self.datalivupdtime = msg.header.stamp
+            self.datastarttime = rospy.Time.from_sec(float(times[0]))
         if self.live is not None:
-            if self.livepacketbuffer is not None and self.livepacketbuffer['mode'] != 'Average Reference':
-                self.livepacketbuffer = None    # Reset Live Packet Buffer
-            ## Build packet suitable for live #
-            if self.livepacketbuffer is None:
-                self.livepacketbuffer = {'mode': 'Average Reference',  'data': dict(),
-                                         'time': [(msg.header.stamp - self.datastarttime).to_sec()]}
-                self.livepacketbuffer['data']['Fp1-Avg'] = [msg.fp1_avg]
-                self.livepacketbuffer['data']['Fp2-Avg'] = [msg.fp2_avg]
-                self.livepacketbuffer['data']['F7-Avg'] = [msg.f7_avg]
-                self.livepacketbuffer['data']['F8-Avg'] = [msg.f8_avg]
-                self.livepacketbuffer['data']['T3-Avg'] = [msg.t3_avg]
-                self.livepacketbuffer['data']['T4-Avg'] = [msg.t4_avg]
-                self.livepacketbuffer['data']['T5-Avg'] = [msg.t5_avg]
-                self.livepacketbuffer['data']['T6-Avg'] = [msg.t6_avg]
-                self.livepacketbuffer['data']['O1-Avg'] = [msg.o1_avg]
-                self.livepacketbuffer['data']['O2-Avg'] = [msg.o2_avg]
-            else:
-                self.livepacketbuffer['time'].append((msg.header.stamp - self.datastarttime).to_sec())
-                self.livepacketbuffer['data']['Fp1-Avg'].append(msg.fp1_avg)
-                self.livepacketbuffer['data']['Fp2-Avg'].append(msg.fp2_avg)
-                self.livepacketbuffer['data']['F7-Avg'].append(msg.f7_avg)
-                self.livepacketbuffer['data']['F8-Avg'].append(msg.f8_avg)
-                self.livepacketbuffer['data']['T3-Avg'].append(msg.t3_avg)
-                self.livepacketbuffer['data']['T4-Avg'].append(msg.t4_avg)
-                self.livepacketbuffer['data']['T5-Avg'].append(msg.t5_avg)
-                self.livepacketbuffer['data']['T6-Avg'].append(msg.t6_avg)
-                self.livepacketbuffer['data']['O1-Avg'].append(msg.o1_avg)
-                self.livepacketbuffer['data']['O2-Avg'].append(msg.o2_avg)
-            # Update UI every 100 ms #
-            if (msg.header.stamp - self.datalivupdtime).to_sec() > 0.1:
-                self.live.sigData.emit(self.livepacketbuffer)
-                self.datalivupdtime = msg.header.stamp
-                self.livepacketbuffer = None
-        elif self.callbackdata is not None:
-            data = {'mode': 'Average Reference', 'time': msg.header.stamp,
-                    'data': [msg.fp1_avg, msg.fp2_avg, msg.f7_avg, msg.f8_avg, msg.t3_avg, msg.t4_avg, msg.t5_avg,
-                             msg.t6_avg, msg.o1_avg, msg.o2_avg]}
-            self.callbackdata(data)
-
-    def _onlbmsb(self, msg):
-        """
-        Call back to LB Message, passes data to UI
-        :param msg:
-        :return:
-        """
-        if self.datastarttime is None:
-            self.datastarttime = msg.header.stamp
-        if self.datalivupdtime is None:
-            self.datalivupdtime = msg.header.stamp
-        if self.live is not None:
-            if self.livepacketbuffer is not None and self.livepacketbuffer['mode'] != 'Longitudinal-Bipolar':
-                self.livepacketbuffer = None    # Reset Live Packet Buffer
-            ## Build packet suitable for live #
-            if self.livepacketbuffer is None:
-                self.livepacketbuffer = {'mode': 'Longitudinal-Bipolar',  'data': dict(),
-                                         'time': [(msg.header.stamp - self.datastarttime).to_sec()]}
-                self.livepacketbuffer['data']['Fp1-F7'] = [msg.fp1_fp7]
-                self.livepacketbuffer['data']['F7-T3'] = [msg.f7_t3]
-                self.livepacketbuffer['data']['T3-T5'] = [msg.t3_t5]
-                self.livepacketbuffer['data']['T5-O1'] = [msg.t5_o1]
-                self.livepacketbuffer['data']['Fp2-F8'] = [msg.fp2_f8]
-                self.livepacketbuffer['data']['F8-T4'] = [msg.f8_t4]
-                self.livepacketbuffer['data']['T4-T6'] = [msg.t4_t6]
-                self.livepacketbuffer['data']['T6-O2'] = [msg.t6_o2]
-            else:
-                self.livepacketbuffer['time'].append((msg.header.stamp - self.datastarttime).to_sec())
-                self.livepacketbuffer['data']['Fp1-F7'].append(msg.fp1_fp7)
-                self.livepacketbuffer['data']['F7-T3'].append(msg.f7_t3)
-                self.livepacketbuffer['data']['T3-T5'].append(msg.t3_t5)
-                self.livepacketbuffer['data']['T5-O1'].append(msg.t5_o1)
-                self.livepacketbuffer['data']['Fp2-F8'].append(msg.fp2_f8)
-                self.livepacketbuffer['data']['F8-T4'].append(msg.f8_t4)
-                self.livepacketbuffer['data']['T4-T6'].append(msg.t4_t6)
-                self.livepacketbuffer['data']['T6-O2'].append(msg.t6_o2)
-            # Update UI every 100 ms #
-            if (msg.header.stamp - self.datalivupdtime).to_sec() > 0.1:
-                self.live.sigData.emit(self.livepacketbuffer)
-                self.datalivupdtime = msg.header.stamp
-                self.livepacketbuffer = None
-        elif self.callbackdata is not None:
-            data = {'mode': 'Longitudinal-Bipolar', 'time': msg.header.stamp,
-                    'data': [msg.fp1_fp7, msg.f7_t3, msg.t3_t5, msg.t5_o1, msg.fp2_f8, msg.f8_t4, msg.t4_t6, msg.t6_o2]}
-            self.callbackdata(data)
+            _mode = EEG_MONTAGES[0].name
+            with self.livelock:
+                if self.livepacketbuffer is None or self.livepacketbuffer.mode != _mode:
+                    self.livepacketbuffer = GaitechLiveBlockBuffer(_mode, self.liveinterval)
+                self.livepacketbuffer.extend(times - self.datastarttime.to_sec(), block)
+        elif self.client is not None:
+            self.client.addBlock(times, block, EEG_MONTAGES[0])
 
-    def _ontbmsg(self, msg):
+    def _liveflusher(self):
         """
-        Call back to TB Message, passes data to UI
-        :param msg:
-        :return:
+        Pass collected live data and markers to viewer at ~live_flush_rate, runs on its own thread so data is flushed
+        even if messages stop. Interval grows with paint time of viewer, batches are coalesced while viewer has not
+        handled previous one and dropped once LIVE_MAX_BACKLOG seconds are waiting. Markers are never dropped
+        :return: None
         """
-        if self.datastarttime is None:
-            self.datastarttime = msg.header.stamp
-        if self.datalivupdtime is None:
-            self.datalivupdtime = msg.header.stamp
-        if self.live is not None:
-            if self.livepacketbuffer is not None and self.livepacketbuffer['mode'] != 'Transverse-Bipolar':
-                self.livepacketbuffer = None    # Reset Live Packet Buffer
-            ## Build packet suitable for live #
-            if self.livepacketbuffer is None:
-                self.livepacketbuffer = {'mode': 'Transverse-Bipolar',  'data': dict(),
-                                         'time': [(msg.header.stamp - self.datastarttime).to_sec()]}
-                self.livepacketbuffer['data']['Fp1-Fp2'] = [msg.fp1_fp2]
-                self.livepacketbuffer['data']['F7-F8'] = [msg.f7_f8]
-                self.livepacketbuffer['data']['T3-T4'] = [msg.t3_t4]
-                self.livepacketbuffer['data']['T5-T6'] = [msg.t5_t6]
-                self.livepacketbuffer['data']['O1-O2'] = [msg.o1_o2]
-            else:
-                self.livepacketbuffer['time'].append((msg.header.stamp - self.datastarttime).to_sec())
-                self.livepacketbuffer['data']['Fp1-Fp2'].append(msg.fp1_fp2)
-                self.livepacketbuffer['data']['F7-F8'].append(msg.f7_f8)
-                self.livepacketbuffer['data']['T3-T4'].append(msg.t3_t4)
-                self.livepacketbuffer['data']['T5-T6'].append(msg.t5_t6)
-                self.livepacketbuffer['data']['O1-O2'].append(msg.o1_o2)
-            # Update UI every 100 ms #
-            if (msg.header.stamp - self.datalivupdtime).to_sec() > 0.1:
-                self.live.sigData.emit(self.livepacketbuffer)
-                self.datalivupdtime = msg.header.stamp
-                self.livepacketbuffer = None
-        elif self.callbackdata is not None:
-            data = {'mode': 'Transverse-Bipolar', 'time': msg.header.stamp,
-                    'data': [msg.fp1_fp2, msg.f7_f8, msg.t3_t4, msg.t5_t6, msg.o1_o2]}
-            self.callbackdata(data)
+        _reported = 0
+        while not rospy.is_shutdown():
+            time.sleep(self.liveinterval)
+            with self.livelock:
+                _markers, self.livemarkers = self.livemarkers, []
+            if len(_markers) > 0:
+                self.live.sigMarker.emit(_markers)      # One signal for all markers of interval
+            # Adapt interval to viewer, never faster than configured rate #
+            _painttime = getattr(self.live, 'livepainttime', 0.0)
+            self.liveinterval = min(max(1.0 / self.liverate, 2.0 * _painttime), LIVE_MAX_INTERVAL)
+            _backlog = self.livestats['batches'] - getattr(self.live, 'livebatches', self.livestats['batches'])
+            with self.livelock:
+                _buffer = self.livepacketbuffer
+                if _buffer is None or (_buffer.count == 0 and not self.livereplay):
+                    continue
+                if _backlog > 0:
+                    if _buffer.count < LIVE_MAX_BACKLOG * LIVE_SAMPLE_RATE:
+                        self.livestats['coalesced'] += 1     # Send with next batch
+                        continue
+                    self.livestats['dropped'] += 1
+                    self.livestats['dropped_samples'] += _buffer.count
+                    self.__livepacket(_buffer.take(), keeponly=True)
+                    _packet = None
+                else:
+                    _packet = self.__livepacket(_buffer.take())
+                    self.livestats['batches'] += 1
+            if _packet is not None:
+                self.live.sigData.emit(_packet)
+            if self.livestats['dropped'] != _reported:
+                _reported = self.livestats['dropped']
+                rospy.logwarn('Live viewer is behind, dropped %d batches (%d samples), coalesced %d batches',
+                              self.livestats['dropped'], self.livestats['dropped_samples'],
+                              self.livestats['coalesced'])
 
     def _oninfomsg(self, msg):
         """
@@ -555,8 +500,8 @@ class GaitechROSInterfaceNode():
         if self.live is not None and self.datastarttime is not None:
             _marker = (msg.event_id, (msg.header.stamp - self.datastarttime).to_sec(),
                        msg.event_status, msg.event_remark)
-            _M = [_marker]
-            self.live.sigMarker.emit(_M)
+            with self.livelock:
+                self.livemarkers.append(_marker)    # Passed to UI by _liveflusher
         elif self.live is None and self.callbackevent is not None:
             self.callbackevent(msg)
 
@@ -568,8 +513,8 @@ class GaitechROSInterfaceNode():
         """
         if self.live is not None and self.datastarttime is not None:
             _marker = (evnt[0], (rospy.Time.now() - self.datastarttime).to_sec(), evnt[1], evnt[2])
-            _M = [_marker]
-            self.live.sigMarker.emit(_M)
+            with self.livelock:
+                self.livemarkers.append(_marker)    # Passed to UI by _liveflusher
         elif self.live is None and self.callbackevent is not None:
             msg = EEGEvent()
             msg.header.stamp = rospy.Time.now()
@@ -581,31 +526,71 @@ class GaitechROSInterfaceNode():
     ####### Helping Functions ######
     def __subscibetomode(self, mode, forced=False):
         """
-        Subscribe to data for mode
+        Show data of mode, node is subscribed once for common reference data and every mode is derived from it,
+        so a mode change keeps the subscription and replays history in new mode. Nodes that do not publish common
+        reference data are subscribed for topic of mode
         :param mode:
+        :param forced: subscribe even if node is still being attached
         :return:
         """
         if self.live is not None:
             self.live.sigMode.emit(mode)    # Would flush data
+        self.livemode = mode
+        if self.client is not None and 0 <= mode < len(EEG_MONTAGES):
+            self.client.setMontage(EEG_MONTAGES[mode])
+        _topic, _source = None, None
+        if self.nodename is not None and ((not self.nodename['init']) or forced) and 0 <= mode < len(EEG_MONTAGES):
+            if self.nodename['common'] is not None:
+                _topic, _source = self.nodename['common'], EEG_MONTAGES[0]
+            elif self.nodename[NODE_TOPIC_KEYS[mode]] is not None:
+                _topic, _source = self.nodename[NODE_TOPIC_KEYS[mode]], EEG_MONTAGES[mode]
+        if _topic is not None and self.datasub is not None and self.datatopic == _topic:
+            with self.livelock:
+                self.livereplay = self.livehistory is not None
+            return
         if self.datasub is not None:
             self.datasub.unregister()
             self.datasub = None
+        self.datatopic = None
         self.datastarttime = None
-        self.datalivupdtime = None
-        self.livepacketbuffer = None        # Discard old buffer
-        if self.nodename is not None and ((not self.nodename['init']) or forced):
-            if mode == 0 and self.nodename['common'] is not None:
-                self.datasub = rospy.Subscriber(self.nodename['common'], CommonReference, self._oncmnmsg)
-                rospy.loginfo('Subsrcibed to %s', self.nodename['common'])
-            elif mode == 1 and self.nodename['average'] is not None:
-                self.datasub = rospy.Subscriber(self.nodename['average'], AverageReference, self._onavgmsg)
-                rospy.loginfo('Subscribed to %s', self.nodename['average'])
-            elif mode == 2 and self.nodename['lb'] is not None:
-                self.datasub = rospy.Subscriber(self.nodename['lb'], LongitudinalBipolar, self._onlbmsb)
-                rospy.loginfo('Subscribed to %s', self.nodename['lb'])
-            elif mode == 3 and self.nodename['tb'] is not None:
-                self.datasub = rospy.Subscriber(self.nodename['tb'], TransverseBipolar, self._ontbmsg)
-                rospy.loginfo('Subscribed to %s', self.nodename['tb'])
+        with self.livelock:
+            self.livepacketbuffer = None        # Discard old buffer
+            self.livehistory = None
+            self.livereplay = False
+            if _source is not None and _source.index == 0 and self.live is not None:
+                self.livehistory = GaitechLiveHistory(self.livehistoryseconds)
+        if _topic is not None:
+            if _source.index == 0 and self.useshared and (self.live is not None or self.client is not None) and \
+                    SharedRingOfTopic(_topic) is not None:
+                self.datasub = GaitechSharedSubscriber(_topic, self._ondatablock, fallback=lambda: rospy.Subscriber(
+                    _topic, _source.msgclass, self._ondatamsg, _source.name))
+                rospy.loginfo('Reading shared memory data of %s', _topic)
+            else:
+                self.datasub = rospy.Subscriber(_topic, _source.msgclass, self._ondatamsg, _source.name)
+                rospy.loginfo('Subscribed to %s', _topic)
+            self.datatopic = _topic
+
+    def __livepacket(self, packet, keeponly=False):
+        """
+        Keep common reference packet in history and derive it for mode shown, called with livelock held
+        :param packet: packet of GaitechLiveBlockBuffer
+        :param keeponly: only keep packet in history, it is not shown
+        :return: packet for viewer
+        """
+        if self.livehistory is None or packet['mode'] != EEG_MONTAGES[0].name:
+            return packet
+        self.livehistory.extend(packet['time'], packet['block'])
+        if keeponly:
+            return None
+        if self.livereplay:
+            self.livereplay = False
+            packet = self.livehistory.packet()
+        if self.livemode is None or not 0 < self.livemode < len(EEG_MONTAGES):
+            return packet
+        _montage = EEG_MONTAGES[self.livemode]
+        _block = _montage.derive(packet['block'])
+        return {'mode': _montage.name, 'time': packet['time'], 'data': dict(zip(_montage.channels, _block)),
+                'block': _block}
 
     def __updatelicenceafterget(self):
         """
@@ -613,34 +598,56 @@ class GaitechROSInterfaceNode():
         :return:
         """
         if self.nodename is not None and self.nodename['glicence'] is not None:
-            _sproxy = rospy.ServiceProxy(self.nodename['glicence'], LicenceInfo)
-            _res = _sproxy()
+            _res = self.services.call(self.nodename['glicence'], LicenceInfo)
+            if _res is None:
+                return
             _lkeys = _res.licences
             if self.settings is not None:
                 self.settings.sigLicenceUpdated.emit(_lkeys)
 
-    def __updatefilterafterget(self):
+    def __attachstate(self, node, generation, state):
+        """
+        Report attach state of node to settings, if attach is not outdated
+        :param node: nodename dict being attached
+        :param generation: attach generation
+        :param state: one of NODE_ATTACH_* states
+        :return:
+        """
+        if generation != self.attachgeneration:
+            return
+        rospy.loginfo('Node %s : %s', node['name'], state)
+        if self.settings is not None:
+            self.settings.sigNodeAttachState.emit(node['name'], state)
+
+    def __updatefilterafterget(self, generation=None):
         """
         Call service to update filter paramters from node
+        :param generation: attach generation, result is discarded if outdated
         :return:
         """
         if self.nodename is not None and self.nodename['gfilter'] is not None:
-            _sproxy = rospy.ServiceProxy(self.nodename['gfilter'], FilterInfo)
-            _res = _sproxy()
-            if self.settings is not None:
+            _res = self.services.call(self.nodename['gfilter'], FilterInfo)
+            if generation is not None and generation != self.attachgeneration:
+                return
+            if _res is not None and self.settings is not None:
                 self.settings.sigFilterUpdated.emit([_res.highpass, _res.lowpass, _res.notchlow, _res.notchhigh])
 
-    def __updatedevnameafterget(self):
+    def __updatedevnameafterget(self, generation=None, activemode=None):
         """
-        Call service to get status of connected device
+        Call service to get status of connected device, runs off GUI thread so widgets are only reached by signals
+        :param generation: attach generation, result is discarded if outdated
+        :param activemode: mode to subscribe to if device is already connected
         :return:
         """
         if self.nodename is not None and self.nodename['gstatus'] is not None:
-            _sproxy = rospy.ServiceProxy(self.nodename['gstatus'], DeviceStatus)
-            _res = _sproxy()
-            if _res.device != '' and _res.connected:
+            _res = self.services.call(self.nodename['gstatus'], DeviceStatus)
+            if _res is None or _res.device == '' or not _res.connected:
+                return
+            with self.attachlock:
+                if generation is not None and generation != self.attachgeneration:
+                    return
                 if self.mainwindow is not None:
-                    self.mainwindow.setWindowTitle('Gaitech H10C Device : Avertus %s' % _res.device)
+                    self.mainwindow.sigWindowTitle.emit('Gaitech H10C Device : Avertus %s' % _res.device)
                 # Already connected to some device #
                 if self.settings is not None:
                     self.settings.sigDeviceInitialize.emit(_res.device)
@@ -648,8 +655,8 @@ class GaitechROSInterfaceNode():
                 if self.live is not None:
                     self.live.sigConnectionStatus.emit(1)
                     self.live.sigDeviceStatus.emit('Avertus %s' % _res.device)
-                if self.settings is not None:
-                    self.__subscibetomode(self.settings.getActiveMode(), forced=True)
+                if activemode is not None:
+                    self.__subscibetomode(activemode, forced=True)
                 if self.nodename is not None and self.nodename['info'] is not None:
                     if self.infosub is not None:
                         self.infosub.unregister()
@@ -657,17 +664,71 @@ class GaitechROSInterfaceNode():
                     self.infosub = rospy.Subscriber(self.nodename['info'], DeviceInfo, self._oninfomsg)
                     rospy.loginfo('Subscribed to : %s', self.nodename['info'])
 
+    @staticmethod
+    def __findgaitechnodes():
+        """
+        Names of nodes that publish gaitech data, found from one query of master state and topic types
+        Nodes are only queried one by one, in parallel, for topics that master has no type for
+        :return: list of node names
+        """
+        _nnames = set()
+        _state = GetGraphState()
+        if _state is not None:
+            _pubs, _, _types, _ = _state
+            _unknown = set()
+            for _topic, _nodes in _pubs:
+                if _topic not in _types:
+                    _unknown.update(_nodes)
+                elif MontageOfType(_types[_topic]) is not None:
+                    _nnames.update(_nodes)
+            _candidates = sorted(_unknown - _nnames)
+        else:
+            try:
+                _candidates = rosnode.get_node_names()
+            except rosnode.ROSNodeIOException:
+                _candidates = []
+        # Fallback, ask nodes themselves #
+        _descs = ParallelMap(GaitechROSInterfaceNode.__getnodedescription, _candidates,
+                             DISCOVERY_WORKERS, DISCOVERY_TIMEOUT)
+        for _nname, _desc in zip(_candidates, _descs):
+            if _desc is None:
+                continue
+            for _pub in _desc[0]:
+                if MontageOfType(_pub) is not None:
+                    _nnames.add(_nname)
+                    break
+        return sorted(_nnames)
+
     @staticmethod
     def __getpubsubsrv(_nodename):
         """
-        Get Pub, Subs and Srvs of ROS Node
+        Get Pub, Subs and Srvs of ROS Node, from master state or node description if master can not be queried
+        Lines are in format of rosnode info, ' * /topic [type]' and ' * /service'
         :param _nodename:
         :return:
         """
+        _state = GetGraphState()
+        if _state is None:
+            _desc = GaitechROSInterfaceNode.__getnodedescription(_nodename)
+            return _desc if _desc is not None else ([], [], [])
+        _pubs, _subs, _srvs = _state[0], _state[1], _state[3]
+        _types = _state[2]
+        _publines = [' * %s [%s]' % (_t, _types.get(_t, 'unknown type')) for (_t, _n) in _pubs if _nodename in _n]
+        _sublines = [' * %s [%s]' % (_t, _types.get(_t, 'unknown type')) for (_t, _n) in _subs if _nodename in _n]
+        _serlines = [' * %s' % _s for (_s, _n) in _srvs if _nodename in _n]
+        return _publines, _sublines, _serlines
+
+    @staticmethod
+    def __getnodedescription(_nodename):
+        """
+        Get Pub, Subs and Srvs of ROS Node by asking the node
+        :param _nodename:
+        :return: (publines, sublines, serlines) or None if node could not be reached
+        """
         try:
             _desc = rosnode.get_node_info_description(_nodename)
         except:
-            _desc = ''
+            return None
         _publines = []
         _sublines = []
         _serlines = []
@@ -690,17 +751,326 @@ class GaitechROSInterfaceNode():
         return _publines, _sublines, _serlines
 
 
+class GaitechLiveBlockBuffer():
+    """
+    Preallocated block of live samples of one mode, sized for one flush interval
+    Filled one message at a time and handed to UI as array views, a new block is started after every take
+    """
+    def __init__(self, mode, interval=LIVE_FLUSH_INTERVAL, rate=LIVE_SAMPLE_RATE):
+        self.mode = mode
+        _montage = EEG_MONTAGE_NAMES[mode]
+        self.channels = _montage.channels
+        self._getter = _montage.decode
+        self.capacity = int(interval * rate * 1.5) + 16   # Some room for jitter of flush time
+        self.count = 0
+        self._allocate()
+
+    def append(self, _t, msg):
+        """
+        Add sample of message
+        :param _t: time of sample relative to start of data
+        :param msg: data message of mode
+        :return: None
+        """
+        if self.count == self.capacity:
+            self._grow()
+        self.time[self.count] = _t
+        self.block[:, self.count] = self._getter(msg)
+        self.count += 1
+
+    def extend(self, _time, _block):
+        """
+        Add block of samples
+        :param _time: np.array of sample times relative to start of data
+        :param _block: np.array (channels x samples)
+        :return: None
+        """
+        _n = len(_time)
+        while self.count + _n > self.capacity:
+            self._grow()
+        self.time[self.count:self.count + _n] = _time
+        self.block[:, self.count:self.count + _n] = _block
+        self.count += _n
+
+    def take(self):
+        """
+        Packet of collected samples and start a new block, views stay valid as block is not reused
+        :return: {mode: mode, time: np.array, data: {chname: np.array}, block: np.array (channels x samples)}
+        """
+        _n = self.count
+        _block = self.block[:, :_n]
+        _packet = {'mode': self.mode, 'time': self.time[:_n], 'data': dict(zip(self.channels, _block)),
+                   'block': _block}
+        self._allocate()
+        return _packet
+
+    def _allocate(self):
+        self.time = np.empty(self.capacity, dtype='float64')
+        self.block = np.empty((len(self.channels), self.capacity), dtype='float64')
+        self.count = 0
+
+    def _grow(self):
+        _time, _block = self.time, self.block
+        self.capacity *= 2
+        self.time = np.empty(self.capacity, dtype='float64')
+        self.block = np.empty((len(self.channels), self.capacity), dtype='float64')
+        self.time[:self.count] = _time[:self.count]
+        self.block[:, :self.count] = _block[:, :self.count]
+
+
+class GaitechLiveHistory(GaitechSampleRing):
+    """
+    Ring of latest common reference samples, replayed in any mode when mode of viewer changes
+    """
+    def __init__(self, seconds=LIVE_HISTORY_SECONDS, rate=LIVE_SAMPLE_RATE):
+        self.channels = EEG_MONTAGES[0].channels
+        GaitechSampleRing.__init__(self, len(self.channels), seconds * rate)
+
+    def packet(self):
+        """
+        Copy of history in order of time
+        :return: {mode: mode, time: np.array, data: {chname: np.array}, block: np.array (channels x samples)}
+        """
+        _time, _block = self.latest()
+        return {'mode': EEG_MONTAGES[0].name, 'time': _time, 'data': dict(zip(self.channels, _block)),
+                'block': _block}
+
+
+class GaitechServicePool():
+    """
+    Persistent service proxies shared by all UI actions, and one worker thread that runs service tasks in order
+    Proxies are only used on worker thread, calls made on other threads wait a bounded time for their turn on
+    worker. A timer closes proxy of an attempt that takes longer than timeout, so a node that never answers fails
+    the call instead of blocking worker. Failed calls are retried with backoff and proxy is reconnected
+    """
+    def __init__(self, timeout=SERVICE_TIMEOUT, retries=SERVICE_RETRIES, backoff=SERVICE_BACKOFF):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesced = 0          # Tasks replaced by a newer task with same key before they ran
+        self._proxies = dict()      # Service name to persistent proxy
+        self._lock = Lock()
+        self._tasks = []            # [key, func] waiting for worker
+        self._cond = Condition()
+        self._worker = Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def call(self, name, srvtype, request=None, timeout=None, retries=None):
+        """
+        Call service, blocks caller
+        :param name: service name
+        :param srvtype: service class
+        :param request: request or None for empty request
+        :param timeout: seconds for each attempt, default self.timeout
+        :param retries: retries after first attempt, default self.retries
+        :return: response or None if all attempts failed
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        if current_thread() is not self._worker:
+            _done = Event()
+            _result = [None]
+
+            def _task():
+                try:
+                    _result[0] = self.call(name, srvtype, request, timeout, retries)
+                finally:
+                    _done.set()
+            self.submit(_task)
+            # Every attempt waits for service and call at most timeout each #
+            _limit = SERVICE_QUEUE_WAIT + (retries + 1) * 2 * timeout + self.backoff * (2 ** retries)
+            if not _done.wait(_limit):
+                rospy.logwarn('Service call to %s not done after %.1f sec, giving up', name, _limit)
+            return _result[0]
+        for _attempt in range(retries + 1):
+            if _attempt > 0:
+                time.sleep(self.backoff * (2 ** (_attempt - 1)))
+            try:
+                _proxy = self._proxy(name, srvtype, timeout)
+            except rospy.ROSException as e:
+                rospy.logwarn('Service %s not available : %s', name, e)
+                continue
+            _state = {'done': False, 'lock': Lock()}
+            _timer = Timer(timeout, self._expire, (_proxy, _state))
+            _timer.daemon = True
+            _timer.start()
+            try:
+                _res = _proxy() if request is None else _proxy(request)
+            except Exception as e:      # Proxy closed by timer can fail with any error of rospy transport
+                rospy.logwarn('Service call to %s failed, attempt %d of %d : %s', name, _attempt + 1, retries + 1, e)
+                self._drop(name)    # Stream of a timed out call can not be used again
+                continue
+            finally:
+                with _state['lock']:
+                    _state['done'] = True
+                _timer.cancel()
+            return _res
+        return None
+
+    def _expire(self, proxy, state):
+        """
+        Close proxy of an attempt that took longer than its timeout, runs on timer thread
+        rospy makes connection of a new proxy inside call, until then it is tried again
+        """
+        with state['lock']:
+            if state['done']:
+                return
+            if getattr(proxy, 'transport', None) is not None:
+                proxy.close()
+                return
+        _timer = Timer(SERVICE_CLOSE_RETRY, self._expire, (proxy, state))
+        _timer.daemon = True
+        _timer.start()
+
+    def submit(self, func, key=None):
+        """
+        Run func on worker thread, a waiting task with same key is replaced by this one
+        :param func: callable without arguments
+        :param key: tasks with same key are coalesced, None to always run
+        :return: None
+        """
+        with self._cond:
+            if key is not None:
+                for _task in self._tasks:
+                    if _task[0] == key:
+                        _task[1] = func
+                        self.coalesced += 1
+                        return
+            self._tasks.append([key, func])
+            self._cond.notify()
+
+    def clear(self):
+        """
+        Close all proxies, e.g. when node changes
+        :return: None
+        """
+        with self._lock:
+            _proxies = self._proxies.values()
+            self._proxies = dict()
+        for _proxy in _proxies:
+            _proxy.close()
+
+    def _proxy(self, name, srvtype, timeout):
+        with self._lock:
+            _proxy = self._proxies.get(name)
+        if _proxy is None or _proxy.request_class != srvtype._request_class:
+            rospy.wait_for_service(name, timeout)
+            _proxy = rospy.ServiceProxy(name, srvtype, persistent=True)
+            with self._lock:
+                self._proxies[name] = _proxy
+        return _proxy
+
+    def _drop(self, name):
+        with self._lock:
+            _proxy = self._proxies.pop(name, None)
+        if _proxy is not None:
+            _proxy.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._tasks) == 0:
+                    self._cond.wait()
+                _key, _func = self._tasks.pop(0)
+            try:
+                _func()
+            except Exception as e:
+                rospy.logerr('Service task %s failed : %s', str(_key), e)
+
+
 #################################
 ### Helping Functions ###########
 #################################
-def LoadEEGDataFromBagFile(wdg, _fname):
+def GetGraphState():
+    """
+    Query master once for system state and topic types
+    :return: (publishers, subscribers, {topic: type}, services) as returned by master, or None if master can not be
+     queried
+    """
+    try:
+        _master = rosgraph.Master(rospy.get_name())
+        _pubs, _subs, _srvs = _master.getSystemState()
+        _types = dict(_master.getTopicTypes())
+    except (rosgraph.MasterException, socket.error) as e:
+        rospy.logwarn('Could not query master : %s', e)
+        return None
+    return _pubs, _subs, _types, _srvs
+
+
+def ParallelMap(func, items, workers, timeout):
+    """
+    Call func on every item with at most workers calls running at once
+    Calls taking longer than timeout are abandoned on their daemon thread and give None
+    :param func:
+    :param items:
+    :param workers:
+    :param timeout: seconds
+    :return: list of results in order of items
+    """
+    _results = [None] * len(items)
+
+    def _call(_i, _item):
+        try:
+            _results[_i] = func(_item)
+        except:
+            _results[_i] = None
+
+    _pending = list(enumerate(items))
+    _running = []
+    while len(_pending) > 0 or len(_running) > 0:
+        _now = time.time()
+        _running = [(_th, _st) for (_th, _st) in _running if _th.is_alive() and _now - _st < timeout]
+        while len(_pending) > 0 and len(_running) < workers:
+            _i, _item = _pending.pop(0)
+            _th = Thread(target=_call, args=(_i, _item))
+            _th.daemon = True
+            _th.start()
+            _running.append((_th, _now))
+        if len(_running) > 0:
+            time.sleep(0.01)
+    return list(_results)
+
+
+def LoadEEGDataFromBagFile(wdg, _fname, cache=True):
     """
-    Loads Data from Bag file
+    Loads Data from Bag file, decoded recordings are kept in GaitechRecordingCache
     :param wdg: Data Viewer Widget or None
     :param _fname: Path of rosbag to load from
-    :return: None (if wdg is not None) else returns Data
+    :param cache: Use recording cache, decoded data is memory mapped from cache when present
+    :return: None (if wdg is not None) else returns Data, {mode, time, data, markers} where time and every channel of
+     data are read only float64 np.arrays whether or not they came from cache, copy them before modifying
     """
     def _parallel_func(_wdg, _fn):
+        _bagdata = None
+        _cache = None
+        if cache:
+            _cache = GaitechRecordingCache()
+            _key = _cache.key(_fn, EEG_LOADER_VERSION)
+            _bagdata = _cache.load(_key)
+        if _bagdata is None:
+            _bagdata = _decode_func(_fn)
+            if _bagdata is not None:
+                _bagdata = ReadOnlyRecording(_bagdata)     # Same types as a cache hit
+            if _bagdata is not None and _cache is not None:
+                try:
+                    _cache.save(_key, _bagdata)
+                except (IOError, OSError) as e:
+                    print 'Unable to cache data of %s : %s' % (_fn, str(e))
+        if _bagdata is None:
+            return None
+        try:
+            rospy.get_rostime()
+            rospy.loginfo('Loaded data from %s', _fn)
+        except rospy.ROSInitException as e:
+            print 'Loaded data from %s' % _fn
+        if _wdg is not None:
+            _wdg.sigLoadData.emit(_bagdata, os.path.basename(unicode(_fn)))
+            return None
+        else:
+            return _bagdata
+
+    def _decode_func(_fn):
         with rosbag.Bag(_fn, 'r') as _bag:
             try:
                 rospy.get_rostime()
@@ -708,52 +1078,22 @@ def LoadEEGDataFromBagFile(wdg, _fname):
             except rospy.ROSInitException as e:
                 print 'Loading data from %s' % _fn
             _msgtypes = _bag.get_type_and_topic_info()[0].keys()
-            _isvalid = False
             _hasevent = False
-            _mode = -1
+            _montage = None
             _bagdata = {'mode': '', 'time': [], 'data': dict(), 'markers': []}
             for _msgtyp in _msgtypes:
                 if 'gaitech_bci_bringup/EEGEvent' in _msgtyp:
                     _hasevent = True
-                if 'gaitech_bci_bringup/TransverseBipolar' in _msgtyp:
-                    _mode = 3
-                    _bagdata['mode'] = 'Transverse-Bipolar'
-                    _bagdata['data'] = {'Fp1-Fp2': [], 'F7-F8': [], 'T3-T4': [], 'T5-T6': [], 'O1-O2': []}
-                    _isvalid = True
-                if 'gaitech_bci_bringup/LongitudinalBipolar' in _msgtyp:
-                    _mode = 2
-                    _bagdata['mode'] = 'Longitudinal-Bipolar'
-                    _bagdata['data'] = {'Fp1-F7': [], 'F7-T3': [], 'T3-T5': [], 'T5-O1': [], 'Fp2-F8': [],
-                                        'F8-T4': [], 'T4-T6': [], 'T6-O2': []}
-                    _isvalid = True
-                if 'gaitech_bci_bringup/AverageReference' in _msgtyp:
-                    _mode = 1
-                    _bagdata['mode'] = 'Average Reference'
-                    _bagdata['data'] = {'Fp1-Avg': [], 'Fp2-Avg': [], 'F7-Avg': [], 'F8-Avg': [], 'T3-Avg': [],
-                                        'T4-Avg': [], 'T5-Avg': [], 'T6-Avg': [], 'O1-Avg': [], 'O2-Avg': []}
-                    _isvalid = True
-                if 'gaitech_bci_bringup/CommonReference' in _msgtyp:
-                    _mode = 0
-                    _bagdata['mode'] = 'Common Reference'
-                    _bagdata['data'] = {'Fp1': [], 'Fp2': [], 'F7': [], 'F8': [], 'T3': [], 'T4': [],
-                                        'T5': [], 'T6': [], 'O1': [], 'O2': []}
-                    _isvalid = True
-            if _isvalid and _mode != -1:
+                if MontageOfType(_msgtyp) is not None:
+                    _montage = MontageOfType(_msgtyp)
+            if _montage is not None:
                 # Only load if valid
+                _bagdata['mode'] = _montage.name
                 # Take topic name based on mode
                 _topicdata = None
                 _topicevent = None
                 for _k, _v in _bag.get_type_and_topic_info()[1].items():
-                    if _mode == 0 and 'gaitech_bci_bringup/CommonReference' in _v[0]:
-                        _topicdata = _k
-                        break
-                    if _mode == 1 and 'gaitech_bci_bringup/AverageReference' in _v[0]:
-                        _topicdata = _k
-                        break
-                    if _mode == 2 and 'gaitech_bci_bringup/LongitudinalBipolar' in _v[0]:
-                        _topicdata = _k
-                        break
-                    if _mode == 3 and 'gaitech_bci_bringup/TransverseBipolar' in _v[0]:
+                    if _montage.msgtype in _v[0]:
                         _topicdata = _k
                         break
                 if _hasevent:
@@ -763,68 +1103,27 @@ def LoadEEGDataFromBagFile(wdg, _fname):
                             break
                 if _topicdata is not None:
                     _init_time = rospy.Time(_bag.get_start_time())
+                    _decode = _montage.decode
+                    _rows = []
                     for _, _msg, _ in _bag.read_messages(topics=[_topicdata]):
-                        _tm = (_msg.header.stamp - _init_time).to_sec()
-                        if _mode == 0:
-                            _bagdata['time'].append(_tm)
-                            _bagdata['data']['Fp1'].append(_msg.fp1)
-                            _bagdata['data']['Fp2'].append(_msg.fp2)
-                            _bagdata['data']['F7'].append(_msg.f7)
-                            _bagdata['data']['F8'].append(_msg.f8)
-                            _bagdata['data']['T3'].append(_msg.t3)
-                            _bagdata['data']['T4'].append(_msg.t4)
-                            _bagdata['data']['T5'].append(_msg.t5)
-                            _bagdata['data']['T6'].append(_msg.t6)
-                            _bagdata['data']['O1'].append(_msg.o1)
-                            _bagdata['data']['O2'].append(_msg.o2)
-                        elif _mode == 1:
-                            _bagdata['time'].append(_tm)
-                            _bagdata['data']['Fp1-Avg'].append(_msg.fp1_avg)
-                            _bagdata['data']['Fp2-Avg'].append(_msg.fp2_avg)
-                            _bagdata['data']['F7-Avg'].append(_msg.f7_avg)
-                            _bagdata['data']['F8-Avg'].append(_msg.f8_avg)
-                            _bagdata['data']['T3-Avg'].append(_msg.t3_avg)
-                            _bagdata['data']['T4-Avg'].append(_msg.t4_avg)
-                            _bagdata['data']['T5-Avg'].append(_msg.t5_avg)
-                            _bagdata['data']['T6-Avg'].append(_msg.t6_avg)
-                            _bagdata['data']['O1-Avg'].append(_msg.o1_avg)
-                            _bagdata['data']['O2-Avg'].append(_msg.o2_avg)
-                        elif _mode == 2:
-                            _bagdata['time'].append(_tm)
-                            _bagdata['data']['Fp1-F7'].append(_msg.fp1_fp7)
-                            _bagdata['data']['F7-T3'].append(_msg.f7_t3)
-                            _bagdata['data']['T3-T5'].append(_msg.t3_t5)
-                            _bagdata['data']['T5-O1'].append(_msg.t5_o1)
-                            _bagdata['data']['Fp2-F8'].append(_msg.fp2_f8)
-                            _bagdata['data']['F8-T4'].append(_msg.f8_t4)
-                            _bagdata['data']['T4-T6'].append(_msg.t4_t6)
-                            _bagdata['data']['T6-O2'].append(_msg.t6_o2)
-                        elif _mode == 3:
-                            _bagdata['time'].append(_tm)
-                            _bagdata['data']['Fp1-Fp2'].append(_msg.fp1_fp2)
-                            _bagdata['data']['F7-F8'].append(_msg.f7_f8)
-                            _bagdata['data']['T3-T4'].append(_msg.t3_t4)
-                            _bagdata['data']['T5-T6'].append(_msg.t5_t6)
-                            _bagdata['data']['O1-O2'].append(_msg.o1_o2)
+                        _stamp = _msg.header.stamp
+                        _bagdata['time'].append((_stamp.secs - _init_time.secs) +
+                                                (_stamp.nsecs - _init_time.nsecs) * 1e-9)
+                        _rows.append(_decode(_msg))
+                    # Rows of samples to list per channel #
+                    _columns = zip(*_rows) if len(_rows) > 0 else [[] for _ in _montage.channels]
+                    for _ch, _col in zip(_montage.channels, _columns):
+                        _bagdata['data'][_ch] = list(_col)
                     # Load Markers #
                     if _topicevent is not None:
                         for _, _msg, _ in _bag.read_messages(topics=[_topicevent]):
                             _tm = (_msg.header.stamp - _init_time).to_sec()
                             _bagdata['markers'].append((_msg.event_id, _tm, _msg.event_status, _msg.event_remark))
-                    # All okay emit signal to load data in ui #
                     # Fix for time 0
                     if (len(_bagdata['time']) > 0) and _bagdata['time'][0] < 0:
                         _bagdata['time'][0] = 0.0
-                    try:
-                        rospy.get_rostime()
-                        rospy.loginfo('Loaded data from %s', _fn)
-                    except rospy.ROSInitException as e:
-                        print 'Loaded data from %s' % _fn
-                    if _wdg is not None:
-                        _wdg.sigLoadData.emit(_bagdata, os.path.basename(unicode(_fn)))
-                        return None
-                    else:
-                        return _bagdata
+                    return _bagdata
+        return None
 
     if wdg is None:
         return _parallel_func(None, _fname)
@@ -851,63 +1150,15 @@ def SaveEEGDataToBagFile(wdg, _DATA, _fn):
             print 'Saving data to %s' % _fname
         with rosbag.Bag(_fname, 'w') as _bag:
             _inittim = rospy.Time(time.time()) - rospy.Time(_data['time'][-1])
-            if _data['mode'] == 'Common Reference':
-                for _i in range(len(_data['time'])):
-                    _msg = CommonReference()
-                    _msg.header.seq = _i+1
-                    _msg.header.stamp = _inittim + rospy.Time(_data['time'][_i])
-                    _msg.fp1 = _data['data']['Fp1'][_i]
-                    _msg.fp2 = _data['data']['Fp2'][_i]
-                    _msg.f7 = _data['data']['F7'][_i]
-                    _msg.f8 = _data['data']['F8'][_i]
-                    _msg.t3 = _data['data']['T3'][_i]
-                    _msg.t4 = _data['data']['T4'][_i]
-                    _msg.t5 = _data['data']['T5'][_i]
-                    _msg.t6 = _data['data']['T6'][_i]
-                    _msg.o1 = _data['data']['O1'][_i]
-                    _msg.o2 = _data['data']['O2'][_i]
-                    _bag.write('/saved_data/data_comref', _msg, _msg.header.stamp)
-            elif _data['mode'] == 'Average Reference':
-                for _i in range(len(_data['time'])):
-                    _msg = AverageReference()
-                    _msg.header.seq = _i + 1
-                    _msg.header.stamp = _inittim + rospy.Time(_data['time'][_i])
-                    _msg.fp1_avg = _data['data']['Fp1-Avg'][_i]
-                    _msg.fp2_avg = _data['data']['Fp2-Avg'][_i]
-                    _msg.f7_avg = _data['data']['F7-Avg'][_i]
-                    _msg.f8_avg = _data['data']['F8-Avg'][_i]
-                    _msg.t3_avg = _data['data']['T3-Avg'][_i]
-                    _msg.t4_avg = _data['data']['T4-Avg'][_i]
-                    _msg.t5_avg = _data['data']['T5-Avg'][_i]
-                    _msg.t6_avg = _data['data']['T6-Avg'][_i]
-                    _msg.o1_avg = _data['data']['O1-Avg'][_i]
-                    _msg.o2_avg = _data['data']['O2-Avg'][_i]
-                    _bag.write('/saved_data/data_avgref', _msg, _msg.header.stamp)
-            elif _data['mode'] == 'Longitudinal-Bipolar':
-                for _i in range(len(_data['time'])):
-                    _msg = LongitudinalBipolar()
-                    _msg.header.seq = _i + 1
-                    _msg.header.stamp = _inittim + rospy.Time(_data['time'][_i])
-                    _msg.fp1_fp7 = _data['data']['Fp1-F7'][_i]
-                    _msg.f7_t3 = _data['data']['F7-T3'][_i]
-                    _msg.t3_t5 = _data['data']['T3-T5'][_i]
-                    _msg.t5_o1 = _data['data']['T5-O1'][_i]
-                    _msg.fp2_f8 = _data['data']['Fp2-F8'][_i]
-                    _msg.f8_t4 = _data['data']['F8-T4'][_i]
-                    _msg.t4_t6 = _data['data']['T4-T6'][_i]
-                    _msg.t6_o2 = _data['data']['T6-O2'][_i]
-                    _bag.write('/saved_data/data_lb', _msg, _msg.header.stamp)
-            elif _data['mode'] == 'Transverse-Bipolar':
-                for _i in range(len(_data['time'])):
-                    _msg = TransverseBipolar()
+            if _data['mode'] in EEG_MONTAGE_NAMES:
+                _montage = EEG_MONTAGE_NAMES[_data['mode']]
+                _topic = '/saved_data/%s' % _montage.topic
+                _columns = [_data['data'][_ch] for _ch in _montage.channels]
+                for _i, _vals in enumerate(zip(*_columns)):
+                    _msg = _montage.encode(_vals)
                     _msg.header.seq = _i + 1
                     _msg.header.stamp = _inittim + rospy.Time(_data['time'][_i])
-                    _msg.fp1_fp2 = _data['data']['Fp1-Fp2'][_i]
-                    _msg.f7_f8 = _data['data']['F7-F8'][_i]
-                    _msg.t3_t4 = _data['data']['T3-T4'][_i]
-                    _msg.t5_t6 = _data['data']['T5-T6'][_i]
-                    _msg.o1_o2 = _data['data']['O1-O2'][_i]
-                    _bag.write('/saved_data/data_tb', _msg, _msg.header.stamp)
+                    _bag.write(_topic, _msg, _msg.header.stamp)
             else:
                 print 'Data Type Unknown cannot save!'
             # Save Markers #
@@ -2,8 +2,16 @@
 ROS BCI GUI Nodes
 """
 from .ROSInterfaceNode import GaitechROSInterfaceNode, LoadEEGDataFromBagFile, SaveEEGDataToBagFile
+from .EEGRecordingCache import GaitechRecordingCache
+from .EEGEpochs import ExtractEEGEpochs, LoadEEGEpochsFromBagFile, GaitechEpochStore
+from .EEGBagCatalog import GaitechBagCatalog
+from .EEGMarkerIndex import GaitechMarkerIndex
+from .EEGDataStore import GaitechDataStore
+from .EEGDecimation import GaitechMinMaxPyramid, GaitechDisplayDecimator
+from .EEGSpectrogram import GaitechLiveSpectrogram, Spectrogram
 from gaitech_bci_tools.pyqt.GaitechSettings import GaitechSettings
 from gaitech_bci_tools.pyqt.GaitechDataViewer import GaitechDataViewerWidget
+from gaitech_bci_tools.pyqt.GaitechTraceViewer import GaitechMultiTraceWidget
 from gaitech_bci_tools.pyqt.GaitechVideoExpBuilder import GaitechVideoExperimentBuilder, GaitechVideoExperimentPlayer
 from gaitech_bci_tools.pyqt.GaitechDialogs import GaitechAboutDialog
 from gaitech_bci_tools.interface.resources import resource_dir
@@ -14,8 +22,20 @@ __all__ = [
     'GaitechROSInterfaceNode',
     'LoadEEGDataFromBagFile',
     'SaveEEGDataToBagFile',
+    'GaitechRecordingCache',
+    'ExtractEEGEpochs',
+    'LoadEEGEpochsFromBagFile',
+    'GaitechEpochStore',
+    'GaitechBagCatalog',
+    'GaitechMarkerIndex',
+    'GaitechDataStore',
+    'GaitechMinMaxPyramid',
+    'GaitechDisplayDecimator',
+    'GaitechLiveSpectrogram',
+    'Spectrogram',
     'GaitechSettings',
     'GaitechDataViewerWidget',
+    'GaitechMultiTraceWidget',
     'GaitechVideoExperimentBuilder',
     'GaitechVideoExperimentPlayer',
     'GaitechAboutDialog',
@@ -76,7 +76,7 @@ class Ui_H10CDataViewer(object):
         self.label_2.setAlignment(QtCore.Qt.AlignCenter)
         self.label_2.setObjectName(_fromUtf8("label_2"))
         self.verticalLayout.addWidget(self.label_2)
-        self.twMarkers = QtGui.QTableWidget(H10CDataViewer)
+        self.twMarkers = QtGui.QTableView(H10CDataViewer)
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Preferred, QtGui.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -90,14 +90,6 @@ class Ui_H10CDataViewer(object):
         self.twMarkers.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
         self.twMarkers.setShowGrid(False)
         self.twMarkers.setObjectName(_fromUtf8("twMarkers"))
-        self.twMarkers.setColumnCount(3)
-        self.twMarkers.setRowCount(0)
-        item = QtGui.QTableWidgetItem()
-        self.twMarkers.setHorizontalHeaderItem(0, item)
-        item = QtGui.QTableWidgetItem()
-        self.twMarkers.setHorizontalHeaderItem(1, item)
-        item = QtGui.QTableWidgetItem()
-        self.twMarkers.setHorizontalHeaderItem(2, item)
         self.twMarkers.horizontalHeader().setDefaultSectionSize(70)
         self.twMarkers.horizontalHeader().setMinimumSectionSize(30)
         self.twMarkers.verticalHeader().setVisible(False)
@@ -172,10 +164,6 @@ class Ui_H10CDataViewer(object):
         self.lblDMode.setText(_translate("H10CDataViewer", "Common Reference", None))
         self.gbChannels.setTitle(_translate("H10CDataViewer", "Display Channels", None))
         self.label_2.setText(_translate("H10CDataViewer", "User Markers In Data", None))
-        item = self.twMarkers.horizontalHeaderItem(0)
-        item.setText(_translate("H10CDataViewer", "Marker", None))
-        item = self.twMarkers.horizontalHeaderItem(1)
-        item.setText(_translate("H10CDataViewer", "Time", None))
         self.tbtnStart.setToolTip(_translate("H10CDataViewer", "Goto start of data", None))
         self.tbtnStart.setText(_translate("H10CDataViewer", "...", None))
         self.tbtnEnd.setToolTip(_translate("H10CDataViewer", "Goto end of data", None))
@@ -35,14 +35,29 @@
 Gaitech BCI Data Viewer Widget
 """
 import sys, os, math, time
+from collections import OrderedDict
 import numpy as np
-from bisect import bisect_left
 from PyQt4 import QtCore, QtGui
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'interface'))
 from H10CDataViewer import Ui_H10CDataViewer
 from GaitechDialogs import GaiTechDataMakerDialog
+from gaitech_bci_tools.EEGMarkerIndex import GaitechMarkerIndex
+from gaitech_bci_tools.EEGDataStore import GaitechDataStore
+from gaitech_bci_tools.EEGDecimation import GaitechMinMaxPyramid, GaitechDisplayDecimator, DisplayBucket
+from gaitech_bci_tools.pyqt.GaitechLiveCurve import GaitechLiveCurveItem
+from gaitech_bci_tools.pyqt.GaitechViewerWorker import GaitechViewerWorker
+from gaitech_bci_tools.pyqt.GaitechMarkerTable import GaitechMarkerTableModel, GaitechMarkerButtonsDelegate
+from gaitech_bci_tools.pyqt.GaitechSpectrogramPanel import GaitechSpectrogramPanel
+from gaitech_bci_tools.pyqt.GaitechTraceViewer import GaitechMultiTraceWidget, GaitechPaintTimer
+from gaitech_bci_tools.EEGSpectrogram import Spectrogram, GaitechLiveSpectrogram, SPECTRO_WINDOW, SPECTRO_HOP, \
+    SPECTRO_FMAX, SPECTRO_RATE, SPECTRO_FRAMES
 
 import pyqtgraph as pg
+
+VIEWER_TASK_STEP = 100000   # Samples converted between progress reports of worker tasks
+MARKER_SYMBOL_SIZE = 24     # Size of marker symbols in pixels, also area of hovering over a marker
+SPECTRO_CACHE = 8           # Spectrograms of offline ranges kept
+SPECTRO_LIVE_RATE = 10.0    # Redraws of live spectrogram per second
 pg.setConfigOption('foreground', 'k')   # Global Settingss
 
 
@@ -66,10 +81,14 @@ class GaitechDataViewerWidget(QtGui.QWidget):
     sigMode = QtCore.pyqtSignal(int)                    # On Mode Changed
     sigStream = QtCore.pyqtSignal(bool)                 # On forcefully setting streaming
 
-    def __init__(self, parent=None, live=False):
+    def __init__(self, parent=None, live=False, liveseconds=None, livedecimation='minmax', singlecanvas=False):
         """
         Initialize Gaitech DataViewer Widget
         :param parent:
+        :param live: widget shows live data
+        :param liveseconds: keep only latest seconds of live data, None to keep all
+        :param livedecimation: 'none', 'minmax' or 'lttb', decimation of live samples drawn by live curves
+        :param singlecanvas: show all channels in one GaitechMultiTraceWidget instead of stacked plots
         """
         super(GaitechDataViewerWidget, self).__init__(parent)
         self.ui = Ui_H10CDataViewer()
@@ -80,9 +99,16 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         self.plots = []             # Plot Items
         self.plotdata = []          # Plot data items
         self.live = live            # Type of widget
-        self.data = dict()          # Main data storage object
+        self.data = dict()          # Main data storage object, time and data are views of store
+        self.store = None           # GaitechDataStore holding samples
+        self.pyramid = None         # GaitechMinMaxPyramid of store, used to draw views wider than plot
+        self.liveseconds = liveseconds  # Seconds of live data kept, None for all
+        self.livedecimation = livedecimation    # Method of GaitechDisplayDecimator of live curves
+        self.livedecimator = None   # GaitechDisplayDecimator of store, full rate samples stay in store
+        self.markerindex = GaitechMarkerIndex()  # Time index over self.data['markers']
+        self.markermodel = GaitechMarkerTableModel(self)  # Model of markers table, shares self.data['markers']
         self._dataYdisplay = False  # Internally used to decide whether to display data values on mouse hovering
-        self.__markerlines = []     # To store marker lines for display purpose
+        self.__markerlines = dict() # Marker lines for display purpose, by position of marker
         self._flagaddmarker = False # Internally used to decide whether to add new marker
         self._flageditmarker = False# Internally used to decide whether to edit marker
         self._flagstreamon = False  # Internally used to check if streaming is on
@@ -91,7 +117,27 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         self.__datacacheinmem = 2000  # Cache Data that is not in view
         self.__dataupdatechkval = 1000 # To update cache when view change
         self.__livescrolling = False # Internally Used flag for live scrolling
+        self.__liveappending = False # Internally used to tell range changes made by live scrolling
+        self.__livecurveend = None  # Samples of store drawn by live curves, None when they are not in use
         self.__lastsavedir = ''     # To keep save file dialog directory
+        self.livebatches = 0        # Live batches handled, read by interface to detect backlog
+        self.livepainttime = 0.0    # Smoothed time taken to display a live batch, read by interface to adapt rate
+        self.painttimer = GaitechPaintTimer(self)   # Measures painting of plotter and single canvas
+        self.painttimer.watch(self.ui.plotter)
+        self.redraws = {'events': 0, 'updates': 0, 'data': 0, 'lines': 0}  # Range change signals, coalesced updates,
+                                    # reloads of plot data and marker lines added, read to check cost of interactions
+        self.__rangepending = None  # (viewbox, range) of latest range change not handled yet
+        self.__rangeuser = False    # Pending range change includes changes not made by live scrolling
+        self.__rangetimer = QtCore.QTimer(self)     # Handles range changes of all linked plots once per event loop
+        self.__rangetimer.setSingleShot(True)
+        self.__rangetimer.setInterval(0)
+        self.__rangetimer.timeout.connect(self._applyrangechange)
+        self.worker = GaitechViewerWorker(self)     # Prepares data for display and saving in background
+        self.__tasks = dict()       # Latest task of every name and title shown while it runs
+        self.livespectrogram = None # GaitechLiveSpectrogram of store while spectrogram is shown live
+        self.traceview = None       # GaitechMultiTraceWidget shown instead of stacked plots, made when first used
+        self.__spectrocache = OrderedDict()  # Spectrograms of offline ranges by (store, channel, start, end)
+        self.__spectrolastdisp = 0.0    # Internally used to limit redraws of live spectrogram
         ####### Initialize Other Stuff #############
         self._initializeforlive() # Initialize according to live attribute
         if self.live:
@@ -99,6 +145,9 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             self.__dataupdatechkval = 500
         self._connectothersignals() # Connect Signals
         self._loadicons()   # Load Display Resources
+        self._initmarkerstable()    # Model and button delegate of markers table
+        self._initspectrogram()     # Spectrogram panel below plots, hidden by default
+        self._inittraceview(singlecanvas)   # Button to show all channels on one canvas
         self._setchnls(0)   # Default Mode initialization
         self._loadmarkerstable() # Default initialization
 
@@ -129,6 +178,10 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             self.ui.lblDSig.setVisible(False)
             self.sigLoadData.connect(self.loadOfflineData)
         self.sigSaveDone.connect(self._savingcomplete)
+        self.worker.sigTaskDone.connect(self._ontaskdone)
+        self.worker.sigTaskProgress.connect(self._ontaskprogress)
+        self.worker.sigTaskFailed.connect(self._ontaskfailed)
+        self.worker.sigTaskCancelled.connect(self._ontaskcancelled)
 
     @QtCore.pyqtSlot(str)
     def _devname_status(self, dname):
@@ -218,7 +271,7 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             _maxX = 30
             _minX = 0.1
         ### Marker Plot ###
-        self.plotdata.append(pg.ScatterPlotItem(size=24, symbol='s'))
+        self.plotdata.append(pg.ScatterPlotItem(size=MARKER_SYMBOL_SIZE, symbol='s'))
         self.plots.append(pg.PlotItem(enableMenu=False))
         self.plots[-1].channelvisible = True
         self.plots[-1].setLabel('top', text='Time', units='sec')
@@ -269,7 +322,10 @@ class GaitechDataViewerWidget(QtGui.QWidget):
                                          minYRange=0.006, maxYRange=_maxYRange)
                 self.plotdata.append(self.plots[-1].plot(name=str(_cbxs[_i].text()), pen='b'))
                 self.plotdata[-1].channelname = str(_cbxs[_i].text())
-                self.plotdata[-1].setDownsampling(None, True, 'peak')
+                if self.live:
+                    # Curve used while scrolling with live data, new samples are appended to it #
+                    self.plotdata[-1].livecurve = GaitechLiveCurveItem(pen='b')
+                    self.plots[-1].addItem(self.plotdata[-1].livecurve)
                 self.plots[-1].sigXRangeChanged.connect(self._plot_x_range_changed)
                 ## Add helper display Values on data points when in zoomed mode ##
                 self.plots[-1].display_text = pg.TextItem(text='', color='k')
@@ -278,6 +334,10 @@ class GaitechDataViewerWidget(QtGui.QWidget):
                 self.plots[-1].addItem(self.plots[-1].display_text, ignorebounds=True)
 
             self._showXaxisOnlyOnLast()
+            self.spectrogram.setChannels([str(_cbx.text()) for _cbx in _cbxs])
+            self.spectrogram.linkTo(self.plots[-1])
+            if self.traceview is not None:
+                self.traceview.setXLink(self.plots[-1])
 
     def _autobtn_y_showAll(self):
         """
@@ -306,9 +366,9 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         if _idx != -1 and 'markers' in self.data:
             _newvals = (self.data['markers'][_mid][0], _txval,
                         self.data['markers'][_mid][2], self.data['markers'][_mid][3])
-            self.data['markers'][_mid] = _newvals
-            self._plotmarkersandverlines()
-            self.ui.twMarkers.item(_mid, 1).setText("%.3f" % _txval)
+            self.markermodel.setMarker(_mid, _newvals)
+            self.markerindex.rebuild(self.data['markers'])
+            self._plotmarkersandverlines(full=True)
 
     @QtCore.pyqtSlot(pg.GraphicsScene)
     def _onMouseClickedPlot(self, obj):
@@ -322,14 +382,12 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             _actpos = self.plotdata[0].mapFromScene(obj.scenePos())
             _txval, _idx = self._find_nearest_time_in_data(_actpos.x())
             if _idx != -1 and 'markers' in self.data:
-                _origpos = 0 # Insert after this position
-                for _i in range(len(self.data['markers'])):
-                    if self.data['markers'][_i][1] < _txval:
-                        _origpos = _i+1
+                _origpos = self.markerindex.count_before(_txval) # Insert after this position
                 _mname = self._generate_random_marker_name()
                 _mnew = (_mname, _txval, 'Event', '')
-                self.data['markers'].insert(_origpos, _mnew)
-                self._loadmarkerstable()
+                self.markermodel.insertMarker(_origpos, _mnew)
+                self.markerindex.rebuild(self.data['markers'])
+                self._plotmarkersandverlines(full=True)
             obj.accept()
         else:
             obj.ignore()
@@ -343,24 +401,19 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         """
         ### For Displaying Markers Info ###
         _actpos = self.plotdata[0].mapFromScene(pos)
-        _p1 = self.plotdata[0].pointsAt(_actpos)
-        if len(_p1) != 0:
+        # Nearest marker from index, hovered if pointer is over its symbol #
+        _mpos = self.markerindex.nearest(_actpos.x()) if 'markers' in self.data else -1
+        _hovered = False
+        if _mpos != -1:
+            _xval = self.data['markers'][_mpos][1]
+            _pixx, _pixy = self.plots[0].getViewBox().viewPixelSize()
+            _hovered = abs(_xval - _actpos.x()) <= (MARKER_SYMBOL_SIZE / 2) * _pixx and \
+                       abs(_actpos.y()) <= (MARKER_SYMBOL_SIZE / 2) * _pixy
+        if _hovered:
             self.plots[0].setYRange(-1.0, 1.0)
-            _xval = _p1[0].pos()[0]
-            _mname = None
-            # Search for value in markers #
-            if 'markers' in self.data:
-                for _elem in self.data['markers']:
-                    if _elem[1] == _xval:
-                        _mname = _elem[0]
-                        break
-            if _mname is not None:
-                self.plots[0].display_text.setText(_mname)
-                __yr = _actpos.y()
-                self.plots[0].display_text.setPos(_xval, __yr)
-                self.plots[0].display_text.show()
-            else:
-                self.plots[0].display_text.hide()
+            self.plots[0].display_text.setText('%s' % self.data['markers'][_mpos][0])
+            self.plots[0].display_text.setPos(_xval, _actpos.y())
+            self.plots[0].display_text.show()
         else:
             self.plots[0].display_text.hide()
         ### For Displaying Data Info ###
@@ -403,35 +456,55 @@ class GaitechDataViewerWidget(QtGui.QWidget):
     @QtCore.pyqtSlot(pg.ViewBox, tuple)
     def _plot_x_range_changed(self, obj, _range_change_data):
         """
-        Slot to handle X-Range Change, to display symbols only when feasible
+        Slot to handle X-Range Change of any channel plot, linked plots emit it together so it is only recorded here
+        and handled once by _applyrangechange when control returns to event loop
         :param obj: Viewbox object
         :param _range_change_data:
         :return:
         """
-        if self.__livescrolling:
-            # Don't Allow for values popup since data is being scrolled very fast
-            _chnlname = obj.parentItem().channelname
-            self._dataYdisplay = False
-            for _pltdataitm in self.plotdata:
-                if GaitechDataViewerWidget.__set_symbol_plotdata_None(_pltdataitm, _chnlname):
-                    break
-        elif hasattr(obj.parentItem(), 'channelname'):
-            _chnlname = obj.parentItem().channelname
-            _diff = _range_change_data[1] - _range_change_data[0]
-            _widthpix = obj.screenGeometry().width()
-            if (_diff != 0.0) and ((float(_widthpix) / (_diff*1000.0)) >= 8.0):
-                self._dataYdisplay = True
-                for _pltdataitm in self.plotdata:
-                    if GaitechDataViewerWidget.__set_symbol_plotdata(_pltdataitm, _chnlname):
-                        break
+        self.redraws['events'] += 1
+        self.__rangepending = (obj, _range_change_data)
+        self.__rangeuser = self.__rangeuser or not self.__liveappending
+        if not self.__rangetimer.isActive():
+            self.__rangetimer.start()
+
+    def _applyrangechange(self):
+        """
+        Handle latest X-Range change for all channels, display symbols only when feasible and load data in range
+        :return: None
+        """
+        if self.__rangepending is None:
+            return
+        (_obj, _rng) = self.__rangepending
+        _user = self.__rangeuser
+        self.__rangepending = None
+        self.__rangeuser = False
+        self.redraws['updates'] += 1
+        if self.__singlecanvas():
+            # Stacked plots are hidden, single canvas draws range itself #
+            self._refreshspectrogram()
+            return
+        _diff = _rng[1] - _rng[0]
+        _widthpix = _obj.screenGeometry().width()
+        # Don't Allow for values popup when data is being scrolled very fast #
+        self._dataYdisplay = (not self.__livescrolling) and (_diff != 0.0) and \
+                             ((float(_widthpix) / (_diff*1000.0)) >= 8.0)
+        for _pltdataitm in self.plotdata:
+            if self._dataYdisplay:
+                GaitechDataViewerWidget.__set_symbol_plotdata(_pltdataitm, getattr(_pltdataitm, 'channelname', None))
             else:
-                self._dataYdisplay = False
-                for _pltdataitm in self.plotdata:
-                    if GaitechDataViewerWidget.__set_symbol_plotdata_None(_pltdataitm, _chnlname):
-                        break
+                GaitechDataViewerWidget.__set_symbol_plotdata_None(_pltdataitm,
+                                                                   getattr(_pltdataitm, 'channelname', None))
+        self._load_only_data_in_range(_rng, _user)
+        self._refreshspectrogram()
 
-    @QtCore.pyqtSlot(pg.ViewBox, tuple)
-    def _load_only_data_in_range(self, obj, _rng):
+    def _load_only_data_in_range(self, _rng, _user=True):
+        """
+        Load data around range in plots when view moved far enough from data loaded earlier
+        :param _rng: (start, end) time of view
+        :param _user: False when range was only changed by live scrolling, live curves already have the data
+        :return: None
+        """
         _, _idx1 = self._find_nearest_time_in_data(_rng[0])
         _, _idx2 = self._find_nearest_time_in_data(_rng[1])
         if _idx1 == -1 or _idx2 == -1:
@@ -457,14 +530,16 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         if np.abs(self._idxolddata[1]-_idx2) > self.__dataupdatechkval or\
                         np.abs(self._idxolddata[0]-_idx1) > self.__dataupdatechkval or _force:
             self._idxolddata = [_idx1, _idx2]
-            ### Load Only Portion of Data in plots ###
-            for _pltdata in self.plotdata:
-                if hasattr(_pltdata, 'channelname'):
-                    _chnlname = _pltdata.channelname
-                    if _chnlname in self.data['data']:
-                        _pltdata.clear()
-                        _pltdata.setData(x=self.data['time'][_idx1:_idx2+1],
-                                         y=self.data['data'][_chnlname][_idx1:_idx2+1])
+            if _user:
+                ### Load Only Portion of Data in plots ###
+                self.redraws['data'] += 1
+                self.__clearlivecurves()
+                for _pltdata in self.plotdata:
+                    if hasattr(_pltdata, 'channelname'):
+                        _chnlname = _pltdata.channelname
+                        if _chnlname in self.data['data']:
+                            _pltdata.clear()
+                            self.__setplotdata(_pltdata, _chnlname, _idx1, _idx2)
             ### Load Only Portion of Markers in plots ###
             self._plotmarkersandverlines()
 
@@ -474,14 +549,35 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         _origdiff = self._idxolddata[1] - _orig
         if self._idxolddata[1] - self._idxolddata[0] > 100:
             self._idxolddata[0] = self._idxolddata[0]+_origdiff
-        ### Load Only Portion of Data in plots ###
+        if (self._idxolddata[1] - self._idxolddata[0]) <= 5:   # Only display data when it has a min size
+            return
+        ### Append samples not yet in live curves, fill them with whole range when not in use ###
+        _first = self.store.first
+        _reset = self.__livecurveend is None or self.__livecurveend < _first + self._idxolddata[0]
+        if _reset:
+            _i0 = self._idxolddata[0]
+        else:
+            _i0 = self.__livecurveend - _first
+        _i1 = self._idxolddata[1] + 1
+        _tmin = self.data['time'][self._idxolddata[0]]
+        ### Decimate samples for display, bucket follows zoom of view whenever curves are drawn again ###
+        if self.livedecimator is None:
+            self.livedecimator = GaitechDisplayDecimator(len(self.store.channels), self.livedecimation)
+        if _reset:
+            _rng = self.plots[-1].viewRange()[0]
+            self.livedecimator.reset(DisplayBucket(_rng[1] - _rng[0], self.plots[-1].vb.width(), self.livedecimation))
+        _x, _y = self.livedecimator.push(self.store.time[_i0:_i1], self.store.block[:, _i0:_i1])
         for _pltdata in self.plotdata:
-            if hasattr(_pltdata, 'channelname'):
-                _chnlname = _pltdata.channelname
-                if _chnlname in self.data['data']:
-                    if (self._idxolddata[1] - self._idxolddata[0]) > 5: # Only display data when it has a min size
-                        _pltdata.setData(x=self.data['time'][self._idxolddata[0]: self._idxolddata[1]+1],
-                                     y=self.data['data'][_chnlname][self._idxolddata[0]:self._idxolddata[1]+1])
+            if hasattr(_pltdata, 'livecurve') and _pltdata.channelname in self.data['data']:
+                _ch = self.store.channels.index(_pltdata.channelname)
+                _chx = _x if _x.ndim == 1 else _x[_ch]
+                if _reset:
+                    _pltdata.clear()
+                    _pltdata.livecurve.setData(_chx, _y[_ch])
+                else:
+                    _pltdata.livecurve.appendData(_chx, _y[_ch])
+                    _pltdata.livecurve.trim(_tmin)
+        self.__livecurveend = _first + _i1
         ### Load Only Portion of Markers in plots ###
         ## self._plotmarkersandverlines()  Don't because it is heavy here
 
@@ -493,20 +589,12 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         _totalvisible = 0
         for _plt in self.plots:
             _plt.hideAxis('bottom')
-            # disconnect range change if already connected #
-            try:
-                _plt.sigXRangeChanged.disconnect(self._load_only_data_in_range)
-            except TypeError as e:
-                pass
-            ###################################
             if hasattr(_plt, 'channelvisible') and _plt.channelvisible:
                 _totalvisible += 1
         for _i in reversed(range(len(self.plots))):
             if hasattr(self.plots[_i], 'channelvisible') and self.plots[_i].channelvisible:
                 if hasattr(self.plots[_i], 'channelname'):
                     self.plots[_i].showAxis('bottom')
-                # Connect Range Change to It only #
-                self.plots[_i].sigXRangeChanged.connect(self._load_only_data_in_range)
                 break
         self.ui.plotter.clear()
         self.ui.plotter.update()
@@ -523,7 +611,8 @@ class GaitechDataViewerWidget(QtGui.QWidget):
                 # Clear Marker Lines that are not needed #
                 _allitms = _plt.getViewBox().allChildItems()
                 for _itm in _allitms:
-                    if isinstance(_itm, pg.InfiniteLine) and hasattr(_itm, 'markerNum') and _itm.markerNum == -1:
+                    if isinstance(_itm, pg.InfiniteLine) and hasattr(_itm, 'markerNum') and _itm.markerNum == -1 \
+                            and _itm not in getattr(_plt, 'linepool', []):
                         _plt.getViewBox().removeItem(_itm)
                 # End of patch for ghost lines #
 
@@ -558,6 +647,7 @@ class GaitechDataViewerWidget(QtGui.QWidget):
                 if hasattr(_plt,'channelvisible'):
                     _plt.channelvisible = _state
         self._showXaxisOnlyOnLast()
+        self.__synctraceview()
 
     ################ UI Buttons Callbacks ####################
 
@@ -607,22 +697,33 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         # Stop Streaming #
         if self._flagstreamon:
             self._streamingonoff()
+        # Results of pending tasks are not wanted anymore #
+        self.worker.cancel()
+        self.__tasks = dict()
+        self.livespectrogram = None
+        self.__spectrocache.clear()
+        self.spectrogram.clear()
+        if self.traceview is not None:
+            self.traceview.clear()
         if self.live:
             self.setWindowTitle('Live Data Viewer')
         else:
             self.setWindowTitle('Offline Data')
         self.data = dict()
+        self.markerindex = GaitechMarkerIndex()
         for _plt in self.plotdata:
             _plt.clear()
-        for (_p, _l) in self.__markerlines:
-            _p.removeItem(_l)
-        self.__markerlines = []
-        self.ui.twMarkers.clearContents()
-        self.ui.twMarkers.setRowCount(0)
+        for _pos in list(self.__markerlines):
+            self.__removemarkerlines(_pos)
+        self.markermodel.setMarkers([])
         for _plt in self.plots:
             _plt.setLimits(xMin=0.0)
         ### Clear Data in Memory ###
         self.data = dict()
+        self.store = None
+        self.pyramid = None
+        self.livedecimator = None
+        self.__clearlivecurves()
         self._dataYdisplay = False
         self._flagaddmarker = False
         self._flageditmarker = False
@@ -668,8 +769,10 @@ class GaitechDataViewerWidget(QtGui.QWidget):
                     _fname = unicode(_fileName)
                 self.ui.gbDataRec.setEnabled(False)
                 self.ui.twMarkers.setEnabled(False)
-                self.setWindowTitle('Saving data to %s ...' % _bname)
-                self.sigSaveData.emit(self, self.data, _fname)
+                # Copy samples here so times and channels are of same samples, live store changes on this thread #
+                self.__submittask('save', 'Saving data to %s ...' % _bname, SnapshotViewerData,
+                                  np.array(self.store.time), np.array(self.store.block), list(self.store.channels),
+                                  self.data.get('markers', []), self.data.get('mode', ''), _fname)
 
     def _gotostartofplot(self):
         """
@@ -726,11 +829,13 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             if self.ui.tbtnAddMarker.isEnabled():
                 self.ui.tbtnAddMarker.setEnabled(False)
             # Enable marker line editing #
-            for (_p, _l) in self.__markerlines:
-                _l.setMovable(True)
+            for _lines in self.__markerlines.values():
+                for (_p, _l) in _lines:
+                    _l.setMovable(True)
         else:
-            for (_p, _l) in self.__markerlines:
-                _l.setMovable(False)
+            for _lines in self.__markerlines.values():
+                for (_p, _l) in _lines:
+                    _l.setMovable(False)
             if not self.ui.tbtnAddMarker.isEnabled():
                 self.ui.tbtnAddMarker.setEnabled(True)
 
@@ -889,20 +994,20 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         self.ui.tbtnAddMarker.clicked.connect(self._select_add_marker)
         self.ui.tbtnEdit.clicked.connect(self._select_edit_marker)
         self.ui.tbtnFullScreen.clicked.connect(self._show_fullscreen)
-        self.ui.twMarkers.cellClicked.connect(self._on_marker_table_clicked)
+        self.ui.twMarkers.clicked.connect(self._on_marker_table_clicked)
         self.ui.plotter.keyPressEvent = self._on_fullscreen_esc
         # todo if any other feature
 
     ######## Markers Editing and Display ################
 
-    @QtCore.pyqtSlot(int, int)
-    def _on_marker_table_clicked(self, _row, _col):
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def _on_marker_table_clicked(self, index):
         """
         Adjust to display so that this marker is in view
-        :param _row:
-        :param _col:
+        :param index: model index of cell clicked
         :return: None
         """
+        _row = index.row()
         if 'markers' not in self.data:
             return
         if _row < 0 or _row >= len(self.data['markers']):
@@ -927,119 +1032,279 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             _r1 = _r2 - _xrange
         self.plots[-1].setXRange(_r1, _r2)
 
-    def _plotmarkersandverlines(self):
+    def _plotmarkersandverlines(self, full=False):
         """
         Plot Markers on plot and vertical lines showing them
+        Lines of markers still in range are kept, only lines of markers leaving or entering range are changed
+        :param full: draw all lines again, needed when markers were changed or moved in list
         :return:
         """
-        # Clear Markers Plots #
-        self.plotdata[0].clear()
-        for (_p, _l) in self.__markerlines:
-            _p.removeItem(_l)
-            if _l.scene() is None:
-                _l.markerNum = -1
-        self.__markerlines = []
+        if self.__singlecanvas():
+            self.traceview.setMarkers(self.data.get('markers', []), self.markerindex)
+        if full:
+            for _pos in list(self.__markerlines):
+                self.__removemarkerlines(_pos)
+        _inrange = []
+        if 'markers' in self.data and len(self.markerindex) > 0 and 'time' in self.data and \
+                len(self.data['time']) > 0:
+            _inrange = self.markerindex.range(self.data['time'][self._idxolddata[0]],
+                                              self.data['time'][self._idxolddata[1]]).tolist()
+        # Remove Lines of Markers out of range #
+        _keep = set(_inrange)
+        for _pos in list(self.__markerlines):
+            if _pos not in _keep:
+                self.__removemarkerlines(_pos)
+        ## Add Data to plot of markers ##
+        self.plotdata[0].setData(x=[self.data['markers'][_i][1] for _i in _inrange], y=[0.0] * len(_inrange))
         # Draw Markers Lines #
-        if 'markers' in self.data:
-            for _i in range(len(self.data['markers'])):
-                ## Add Data to plot of markers ##
-                _row = self.data['markers'][_i]
-                if (_row[1] >= self.data['time'][self._idxolddata[0]]) and \
-                        (_row[1] <= self.data['time'][self._idxolddata[1]]):
-                    self.plotdata[0].addPoints(x=[_row[1]], y=[0.0])
-                    for _plt in self.plots:
-                        _lin = _plt.addLine(x=_row[1], z=2, pen='r')
-                        if self._flageditmarker:
-                            _lin.setMovable(True)
-                        else:
-                            _lin.setMovable(False)
-                        _lin.sigPositionChangeFinished.connect(self._markerlinemoved)
-                        _lin.setHoverPen(pg.mkPen(width=5, color='g'))
-                        # Setup Bounds for editing #
-                        if _i-1 >= 0:
-                            _minlinbound = self.data['markers'][_i -1][1]+0.001
-                        else:
-                            _minlinbound = self.data['time'][0]
-                        if _i+1 < len(self.data['markers']):
-                            _maxlinbound = self.data['markers'][_i + 1][1] - 0.001
-                        else:
-                            _maxlinbound = self.data['time'][-1]    # TODO Update on New Data
-                        _lin.setBounds((_minlinbound, _maxlinbound))
-                        _lin.markerNum = _i
-                        ############################
-                        self.__markerlines.append((_plt, _lin))
-
-    def _loadmarkerstable(self):
+        for _i in _inrange:
+            if _i in self.__markerlines:
+                continue
+            _row = self.data['markers'][_i]
+            self.__markerlines[_i] = []
+            self.redraws['lines'] += 1
+            for _plt in self.plots:
+                # Reuse hidden line of plot if there is one #
+                if len(getattr(_plt, 'linepool', [])) > 0:
+                    _lin = _plt.linepool.pop()
+                    _lin.show()
+                else:
+                    _lin = _plt.addLine(x=_row[1], z=2, pen='r')
+                    _lin.sigPositionChangeFinished.connect(self._markerlinemoved)
+                    _lin.setHoverPen(pg.mkPen(width=5, color='g'))
+                if self._flageditmarker:
+                    _lin.setMovable(True)
+                else:
+                    _lin.setMovable(False)
+                # Setup Bounds for editing #
+                if _i-1 >= 0:
+                    _minlinbound = self.data['markers'][_i -1][1]+0.001
+                else:
+                    _minlinbound = self.data['time'][0]
+                if _i+1 < len(self.data['markers']):
+                    _maxlinbound = self.data['markers'][_i + 1][1] - 0.001
+                else:
+                    _maxlinbound = self.data['time'][-1]    # TODO Update on New Data
+                _lin.setBounds((_minlinbound, _maxlinbound))
+                _lin.setValue(_row[1])
+                _lin.markerNum = _i
+                ############################
+                self.__markerlines[_i].append((_plt, _lin))
+
+    def __removemarkerlines(self, _pos):
+        """
+        Hide lines of marker at position, they are kept in line pool of their plot for next marker in range
+        :param _pos: position of marker
+        :return: None
+        """
+        for (_p, _l) in self.__markerlines.pop(_pos, []):
+            _l.hide()
+            _l.setMovable(False)
+            _l.markerNum = -1
+            if not hasattr(_p, 'linepool'):
+                _p.linepool = []
+            _p.linepool.append(_l)
+
+    def _initmarkerstable(self):
+        """
+        Show markers through model, buttons are painted by delegate so no widgets are made per marker
+        :return: None
+        """
+        self.ui.twMarkers.setModel(self.markermodel)
+        self.__markerbuttons = GaitechMarkerButtonsDelegate(self, self.__icon_edit, self.__icon_remove)
+        self.__markerbuttons.sigEdit.connect(self._edit_marker)
+        self.__markerbuttons.sigRemove.connect(self._remove_marker)
+        self.ui.twMarkers.setItemDelegateForColumn(2, self.__markerbuttons)
+        self.ui.twMarkers.verticalHeader().setResizeMode(QtGui.QHeaderView.Fixed)
+        self.ui.twMarkers.verticalHeader().setDefaultSectionSize(self.__markerbuttons.sizeHint(None, None).height())
+        self.ui.twMarkers.horizontalHeader().setResizeMode(0, QtGui.QHeaderView.Stretch)
+
+    def _initspectrogram(self):
+        """
+        Add spectrogram panel below plots and a tool button to show it
+        :return: None
+        """
+        self.spectrogram = GaitechSpectrogramPanel(self)
+        self.spectrogram.hide()
+        self.ui.verticalLayout_2.insertWidget(self.ui.verticalLayout_2.indexOf(self.ui.plotter) + 1, self.spectrogram)
+        self.tbtnSpectrogram = QtGui.QToolButton(self)
+        self.tbtnSpectrogram.setMinimumSize(QtCore.QSize(32, 32))
+        self.tbtnSpectrogram.setCheckable(True)
+        self.tbtnSpectrogram.setText('S')
+        self.tbtnSpectrogram.setToolTip('Show spectrogram')
+        self.ui.horizontalLayout.insertWidget(self.ui.horizontalLayout.indexOf(self.ui.tbtnFullScreen) + 1,
+                                              self.tbtnSpectrogram)
+        self.tbtnSpectrogram.toggled.connect(self._show_spectrogram)
+        self.spectrogram.sigChannelChanged.connect(self._spectrogramchannelchanged)
+
+    @QtCore.pyqtSlot(bool)
+    def _inittraceview(self, _show):
+        """
+        Add tool button to show all channels in one canvas
+        :param _show: show single canvas from start
+        :return: None
+        """
+        self.tbtnSingleCanvas = QtGui.QToolButton(self)
+        self.tbtnSingleCanvas.setMinimumSize(QtCore.QSize(32, 32))
+        self.tbtnSingleCanvas.setCheckable(True)
+        self.tbtnSingleCanvas.setText('C')
+        self.tbtnSingleCanvas.setToolTip('Show all channels on one canvas')
+        self.ui.horizontalLayout.insertWidget(self.ui.horizontalLayout.indexOf(self.ui.tbtnFullScreen) + 1,
+                                              self.tbtnSingleCanvas)
+        self.tbtnSingleCanvas.toggled.connect(self._show_singlecanvas)
+        self.tbtnSingleCanvas.setChecked(_show)
+
+    @QtCore.pyqtSlot(bool)
+    def _show_singlecanvas(self, _show):
+        """
+        Show channels in single canvas or in stacked plots, hidden view is not updated
+        :param _show:
+        :return: None
+        """
+        if self.traceview is None:
+            if not _show:
+                return
+            self.traceview = GaitechMultiTraceWidget(self)
+            self.painttimer.watch(self.traceview)
+            self.ui.verticalLayout_2.insertWidget(self.ui.verticalLayout_2.indexOf(self.ui.plotter), self.traceview)
+            if len(self.plots) > 0:
+                self.traceview.setXLink(self.plots[-1])
+        self.traceview.setVisible(_show)
+        self.ui.plotter.setVisible(not _show)
+        if _show:
+            self.__synctraceview()
+            self.traceview.setMarkers(self.data.get('markers', []), self.markerindex)
+            if len(self.plots) > 0:
+                _rng = self.plots[-1].viewRange()[0]
+                self.traceview.setXRange(_rng[0], _rng[1], padding=0.0)
+        elif len(self.plots) > 0:
+            # Stacked plots missed changes while hidden, load data of view again #
+            self.__clearlivecurves()
+            self._idxolddata = [0, 0]
+            self._load_only_data_in_range(self.plots[-1].viewRange()[0], True)
+
+    @QtCore.pyqtSlot(bool)
+    def _show_spectrogram(self, _show):
+        """
+        Show or hide spectrogram panel, nothing is computed while it is hidden
+        :param _show:
+        :return: None
+        """
+        self.spectrogram.setVisible(_show)
+        self.livespectrogram = None
+        if _show:
+            self._refreshspectrogram()
+            self.__updatelivespectrogram(force=True)
+        else:
+            self.worker.cancel('spectrogram')
+
+    @QtCore.pyqtSlot(str)
+    def _spectrogramchannelchanged(self, _channel):
+        """
+        Show spectrogram of selected channel
+        :param _channel:
+        :return: None
+        """
+        self._refreshspectrogram()
+        self.__updatelivespectrogram(force=True)
+
+    def _refreshspectrogram(self):
+        """
+        Show spectrogram of visible range of offline data, from cache or computed by worker
+        :return: None
+        """
+        if self.live or not self.spectrogram.isVisible() or self.store is None or len(self.plots) == 0:
+            return
+        _channel = self.spectrogram.channel()
+        if _channel not in self.store.channels:
+            return
+        _rng = self.plots[-1].viewRange()[0]
+        _, _idx1 = self._find_nearest_time_in_data(_rng[0])
+        _, _idx2 = self._find_nearest_time_in_data(_rng[1])
+        if _idx1 == -1 or _idx2 == -1:
+            return
+        _key = (id(self.store), _channel, _idx1, _idx2)
+        if _key in self.__spectrocache:
+            _result = self.__spectrocache[_key]
+            self.spectrogram.setSpectrogram(_result['times'], _result['freqs'], _result['power'])
+        else:
+            self.__submittask('spectrogram', None, SpectrogramOfRange, self.store, _channel, _idx1, _idx2, _key)
+
+    def __updatelivespectrogram(self, force=False):
+        """
+        Compute spectra of new samples and redraw live spectrogram, at most SPECTRO_LIVE_RATE times per second
+        :param force: redraw now
+        :return: None
+        """
+        if not self.live or not self.spectrogram.isVisible() or self.store is None:
+            return
+        _channel = self.spectrogram.channel()
+        if _channel not in self.store.channels:
+            return
+        if self.livespectrogram is None or self.livespectrogram.store is not self.store:
+            self.livespectrogram = GaitechLiveSpectrogram(self.store)
+        self.livespectrogram.update()
+        if force or (time.time() - self.__spectrolastdisp) >= (1.0 / SPECTRO_LIVE_RATE):
+            self.__spectrolastdisp = time.time()
+            _times, _power = self.livespectrogram.image(_channel)
+            self.spectrogram.setSpectrogram(_times, self.livespectrogram.freqs, _power)
+
+    def _loadmarkerstable(self, reindex=True):
         """
         Load markers that are displayed in UI
+        :param reindex: rebuild time index of markers, False if it is already updated
         :return: None
         """
-        # Clear Markers Table #
-        self.ui.twMarkers.clearContents()
+        if 'markers' not in self.data:
+            self.data['markers'] = []
+        if reindex:
+            self.markerindex.rebuild(self.data['markers'])
         # Load Markers Table #
-        if 'markers' in self.data:
-            self.ui.twMarkers.setRowCount(len(self.data['markers']))
-            for _i in range(len(self.data['markers'])):
-                _row = self.data['markers'][_i]
-                self.ui.twMarkers.setItem(_i, 0, QtGui.QTableWidgetItem('%s'%_row[0]))
-                self.ui.twMarkers.item(_i, 0).setToolTip('%s'%_row[0])
-                self.ui.twMarkers.setItem(_i, 1, QtGui.QTableWidgetItem("%.3f" % _row[1]))
-                _btnedit = QtGui.QToolButton()
-                if self.__icon_edit is not None:
-                    _btnedit.setIcon(self.__icon_edit)
-                else:
-                    _btnedit.setText('E')
-                _btnrem = QtGui.QToolButton()
-                if self.__icon_remove is not None:
-                    _btnrem.setIcon(self.__icon_remove)
-                else:
-                    _btnrem.setText('R')
-                _btnedit.setFixedSize(32, 32)
-                _btnrem.setFixedSize(32, 32)
-                _btnedit.setToolTip('Edit this marker')
-                _btnrem.setToolTip('Remove this marker')
-                _btnedit.marker_row = _i
-                _btnrem.marker_row = _i
-                _btnedit.clicked.connect(self._edit_marker)
-                _btnrem.clicked.connect(self._remove_marker)
-                _lyt = QtGui.QHBoxLayout()
-                _lyt.setContentsMargins(0, 0, 0, 0)
-                _lyt.addWidget(_btnedit)
-                _lyt.addWidget(_btnrem)
-                _lyt.setSizeConstraint(QtGui.QBoxLayout.SetFixedSize)
-                _cwdg = QtGui.QWidget()
-                _cwdg.setLayout(_lyt)
-                self.ui.twMarkers.setCellWidget(_i, 2, _cwdg)
-        else:
-            self.ui.twMarkers.setRowCount(0)
+        self.markermodel.setMarkers(self.data['markers'])
         # Adjust Contents #
-        self.ui.twMarkers.horizontalHeader().setResizeMode(0, QtGui.QHeaderView.Stretch)
         self.ui.twMarkers.resizeColumnToContents(1)
         self.ui.twMarkers.resizeColumnToContents(2)
         # Show in plots #
+        self._plotmarkersandverlines(full=True)
+
+    def _appendmarkerstable(self, markers):
+        """
+        Add markers at end of data, rows already in table are kept
+        :param markers: [(id, time, event, note), ...] appended
+        :return: None
+        """
+        if len(markers) == 0:
+            return
+        _first = len(self.data['markers'])
+        self.markermodel.appendMarkers(markers)
+        if _first == 0:
+            self.ui.twMarkers.resizeColumnToContents(1)
+            self.ui.twMarkers.resizeColumnToContents(2)
+        # Show in plots, bound of line of previous last marker changes #
+        self.__removemarkerlines(_first - 1)
         self._plotmarkersandverlines()
 
-    def _remove_marker(self):
+    @QtCore.pyqtSlot(int)
+    def _remove_marker(self, _row):
         """
         Removes Marker and update display
+        :param _row: row of marker
         :return: None
         """
-        _rowtorem = self.sender().marker_row
-        try:
-            self.data['markers'].pop(_rowtorem)
-        except:
-            print 'Debugging : Error on Marker Removal, Fix it if it shows'
-        self._loadmarkerstable()
+        if 'markers' not in self.data or _row >= len(self.data['markers']):
+            return # Marker No longer Existing, Something went Wrong
+        self.markermodel.removeMarker(_row)
+        self.markerindex.rebuild(self.data['markers'])
+        self._plotmarkersandverlines(full=True)
 
-    def _edit_marker(self):
+    @QtCore.pyqtSlot(int)
+    def _edit_marker(self, _marker_row):
         """
         Callback to edit markers when clicked in markers table
+        :param _marker_row: row of marker
         :return: None
         """
-        if not hasattr(self.sender(), 'marker_row'):
-            return # Signal Sender not our button
-        _marker_row = self.sender().marker_row
-        if _marker_row >= len(self.data['markers']):
+        if 'markers' not in self.data or _marker_row >= len(self.data['markers']):
             return # Marker No longer Existing, Something went Wrong
         # Construct Marker Data for dialog #
         _marker_data = {'marker': self.data['markers'][_marker_row][0], 'time': self.data['markers'][_marker_row][1],
@@ -1050,11 +1315,9 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         _dlgmarker = GaiTechDataMakerDialog(markerlist=_marker_list, data=_marker_data)
         if _dlgmarker.exec_() == QtGui.QDialog.Accepted and _dlgmarker.isModified():
             _dmrkmod = _dlgmarker.getData()
-            self.data['markers'][_marker_row] = (_dmrkmod['marker'], _dmrkmod['time'],
-                                                 _dmrkmod['event'], _dmrkmod['remark'])
-            # Update On Table
-            self.ui.twMarkers.item(_marker_row, 0).setText('%s' % _dmrkmod['marker'])
-            self.ui.twMarkers.item(_marker_row, 0).setToolTip('%s' % _dmrkmod['marker'])
+            self.markermodel.setMarker(_marker_row, (_dmrkmod['marker'], _dmrkmod['time'],
+                                                     _dmrkmod['event'], _dmrkmod['remark']))
+            self.markerindex.rebuild(self.data['markers'])
 
     #####################################################
 
@@ -1064,9 +1327,9 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         :param tsearch: time to search
         :return: (actual_value, idx)
         """
-        if 'time' not in self.data:
+        if 'time' not in self.data or len(self.data['time']) == 0:
             return 0.0, -1
-        _pos = bisect_left(self.data['time'], tsearch)
+        _pos = int(np.searchsorted(self.data['time'], tsearch, side='left'))
         if _pos == 0:
             return self.data['time'][0], 0
         if _pos == len(self.data['time']):
@@ -1085,10 +1348,9 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         """
         if 'markers' not in self.data:
             return 'marker_000001'
-        _marker_list = [_mrk[0] for _mrk in self.data['markers']]
         import random
         _mrk = 'marker_000001'
-        while _mrk in _marker_list:
+        while _mrk in self.markerindex:
             __i = random.randint(0, 999999)
             _mrk = 'marker_%06d' % __i
         return _mrk
@@ -1144,7 +1406,8 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         self.ui.gbDataRec.setEnabled(True)
         ### Clear Data ####
         self._manualclear()
-        # Internally Data is stored in python list instead of numpy list for compatibility with live data
+        # Internally Data is stored in GaitechDataStore, self.data holds views of it, store, pyramid and marker
+        # index are prepared by worker and shown by __showofflinedata
         ###### Load Data #######
         # MODE #
         if 'mode' in offlinedata:
@@ -1162,31 +1425,41 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         else:
             raise ValueError('mode not set in data')
         # Time #
-        if 'time' in offlinedata and isinstance(offlinedata['time'], np.ndarray) and offlinedata['time'].shape[0] > 0:
-            self.data['time'] = offlinedata['time'].tolist()
-        elif 'time' in offlinedata and isinstance(offlinedata['time'], list) and len(offlinedata['time']) > 0:
-            self.data['time'] = offlinedata['time']
-        else:
+        if 'time' not in offlinedata or not isinstance(offlinedata['time'], (list, np.ndarray)) or \
+                len(offlinedata['time']) == 0:
             raise ValueError('time in data not present')
-        _mintime = self.data['time'][0]
-        _maxtime = self.data['time'][-1]
-        # Initialize dict item for data #
-        self.data['data'] = dict()
-        # Load Markers #
-        if 'markers' in offlinedata:
-            self.data['markers'] = offlinedata['markers']
-        else:
-            self.data['markers'] = []   # Dont raise errors as markers are optional
-        self._loadmarkerstable()
-        # Draw Plots #
+        # Data of channels that are plotted #
+        _channels = []
+        _columns = dict()
         for _pltdata in self.plotdata:
             if hasattr(_pltdata, 'channelname'):
                 _chnlname = _pltdata.channelname
-                if _chnlname in offlinedata['data']:
-                    if isinstance(offlinedata['data'][_chnlname], np.ndarray):
-                        self.data['data'][_chnlname] = offlinedata['data'][_chnlname].tolist()
-                    elif isinstance(offlinedata['data'][_chnlname], list):
-                        self.data['data'][_chnlname] = offlinedata['data'][_chnlname]
+                if _chnlname in offlinedata['data'] and \
+                        isinstance(offlinedata['data'][_chnlname], (list, np.ndarray)):
+                    _channels.append(_chnlname)
+                    _columns[_chnlname] = offlinedata['data'][_chnlname]
+        # Markers, Dont raise errors as markers are optional #
+        _markers = offlinedata['markers'] if 'markers' in offlinedata else []
+        self.ui.gbDataRec.setEnabled(False)
+        self.__submittask('load', 'Preparing %s ...' % _fn, PrepareViewerData,
+                          _channels, offlinedata['time'], _columns, _markers, _fn)
+
+    def __showofflinedata(self, _prepared):
+        """
+        Swap in data prepared by PrepareViewerData and show it
+        :param _prepared: result of PrepareViewerData
+        :return: None
+        """
+        self.store = _prepared['store']
+        self.pyramid = _prepared['pyramid']
+        self.__syncdata()
+        _mintime = self.data['time'][0]
+        _maxtime = self.data['time'][-1]
+        # Load Markers #
+        self.data['markers'] = _prepared['markers']
+        self.markerindex = _prepared['markerindex']
+        self._loadmarkerstable(reindex=False)
+        _fn = _prepared['name']
         # Add Plot Time Limits #
         _dispXMaxTime = _mintime + 30.0
         if _dispXMaxTime > _maxtime:
@@ -1196,17 +1469,107 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             _plt.setXRange(_mintime, _dispXMaxTime)
         if _fn is not None and _fn != '':
             self.setWindowTitle('%s' % _fn)
+        else:
+            self.setWindowTitle('Offline Data')
+        self.ui.gbDataRec.setEnabled(True)
+
+    def __submittask(self, name, title, func, *args):
+        """
+        Run func in worker, only latest task of a name is used
+        :param name: 'load', 'save' or 'spectrogram'
+        :param title: window title while task runs, None to keep title
+        :param func: func(task, *args)
+        :return: None
+        """
+        if title is not None:
+            self.setWindowTitle(title)
+        self.__tasks[name] = (self.worker.submit(name, func, *args), title)
+
+    @QtCore.pyqtSlot(object, object)
+    def _ontaskdone(self, task, result):
+        """
+        Use result of task finished in worker
+        :param task: GaitechViewerTask
+        :param result: result of task function
+        :return: None
+        """
+        if task.cancelled or self.__tasks.get(task.name, (None, ''))[0] is not task:
+            return
+        del self.__tasks[task.name]
+        if task.name == 'load':
+            self.__showofflinedata(result)
+        elif task.name == 'save':
+            self.sigSaveData.emit(self, result, task.args[-1])
+        elif task.name == 'spectrogram':
+            self.__spectrocache[result['key']] = result
+            while len(self.__spectrocache) > SPECTRO_CACHE:
+                self.__spectrocache.popitem(last=False)
+            self.spectrogram.setSpectrogram(result['times'], result['freqs'], result['power'])
+
+    @QtCore.pyqtSlot(object, float)
+    def _ontaskprogress(self, task, fraction):
+        """
+        Show progress of task in window title
+        :param task: GaitechViewerTask
+        :param fraction: 0.0 to 1.0
+        :return: None
+        """
+        if self.__tasks.get(task.name, (None, ''))[0] is task and self.__tasks[task.name][1] is not None:
+            self.setWindowTitle('%s %d%%' % (self.__tasks[task.name][1], int(fraction * 100.0)))
+
+    @QtCore.pyqtSlot(object, str)
+    def _ontaskfailed(self, task, error):
+        """
+        Task failed, enable UI again
+        :param task: GaitechViewerTask
+        :param error: error message
+        :return: None
+        """
+        print 'Debugging : Task %s failed : %s' % (task.name, error)
+        self._ontaskcancelled(task)
+
+    @QtCore.pyqtSlot(object)
+    def _ontaskcancelled(self, task):
+        """
+        Task stopped without result, enable UI again if it was latest of its name
+        :param task: GaitechViewerTask
+        :return: None
+        """
+        if self.__tasks.get(task.name, (None, ''))[0] is not task:
+            return
+        del self.__tasks[task.name]
+        if task.name not in ('load', 'save'):
+            return
+        if self.live:
+            self.setWindowTitle('Live Data Viewer')
+        else:
+            self.setWindowTitle('Offline Data')
+        self.ui.gbDataRec.setEnabled(True)
+        self.ui.twMarkers.setEnabled(True)
+
+    def closeEvent(self, event):
+        """
+        Stop worker with widget
+        """
+        self.worker.stop()
+        super(GaitechDataViewerWidget, self).closeEvent(event)
 
     @QtCore.pyqtSlot(int)
     def _onNewMode(self, md):
         """
-        Handle to mode change event
+        Handle to mode change event, live streaming and markers are kept as interface replays data in new mode
         :param md: mode
         :return:
         """
+        _streaming = self._flagstreamon
+        _markers = list(self.data.get('markers', []))
         if self._flagstreamon:
             self._streamingonoff()
         self._setchnls(md)
+        if self.live and _streaming:
+            self.data['markers'] = _markers
+            self._loadmarkerstable()
+            self._streamingonoff()
 
     @QtCore.pyqtSlot(list)
     def _onNewMarker(self, evnt):
@@ -1221,23 +1584,42 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             return
         if 'markers' not in self.data:
             self.data['markers'] = []
-        _marker_list = [_mrk[0] for _mrk in self.data['markers']]
+            self.markermodel.setMarkers(self.data['markers'])
+        _seen = set()
+        _new = []
         for _mrk in evnt:
-            if _mrk[0] in _marker_list:
+            _me = _mrk
+            if _mrk[0] in self.markerindex or _mrk[0] in _seen:
                 _mname = self._generate_random_marker_name()
-                _me = (_marker_list, _mrk[1], _mrk[2], _mrk[3])
-            else:
-                _me = _mrk
-            self.data['markers'].append(_me)
-        #### Update Markers Table ####
-        self._loadmarkerstable()
+                while _mname in _seen:
+                    _mname = self._generate_random_marker_name()
+                _me = (_mname, _mrk[1], _mrk[2], _mrk[3])
+            _seen.add(_me[0])
+            _new.append(_me)
+        self.markerindex.extend(_new)   # Live markers arrive in order, no need to rebuild index
+        #### Add new rows to Markers Table ####
+        self._appendmarkerstable(_new)
 
     @QtCore.pyqtSlot(dict)
     def _onNewData(self, _data):
         """
-        Handle New Data
+        Handle New Data, measures time taken to display it
+        Display time is time of appending batch plus paint time of shown view, painting itself happens later in
+        event loop so latest measured frame time stands for the frame this batch causes
+        :param _data: see __appendlivedata
+        :return: None
+        """
+        _tstart = time.time()
+        self.__appendlivedata(_data)
+        _spent = time.time() - _tstart + self.painttimer.frametime
+        self.livepainttime = 0.8 * self.livepainttime + 0.2 * _spent
+        self.livebatches += 1
+
+    def __appendlivedata(self, _data):
+        """
+        Append New Data
         :param _data: {mode:'Common Reference|Average Reference|Longitudinal-Bipolar|Transverse-Bipolar',
-         data=dict(depending upon mode, same format as offline data but python list), time= list}
+         data=dict(depending upon mode, same format as offline data, python list or np.array), time= list or np.array}
         :return: None
         """
         if not self._flagstreamon:
@@ -1246,7 +1628,7 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             return
         if 'mode' not in _data or _data['mode'] is None:
             return
-        if 'time' not in _data or _data['time'] is None or not isinstance(_data['time'], list):
+        if 'time' not in _data or _data['time'] is None or not isinstance(_data['time'], (list, np.ndarray)):
             return
         if 'data' not in _data or _data['data'] is None or not isinstance(_data['data'], dict):
             return
@@ -1272,42 +1654,38 @@ class GaitechDataViewerWidget(QtGui.QWidget):
         _origXRange = self.plots[-1].viewRange()[0]
         _origXrangeDiff = _origXRange[1] - _origXRange[0]
         _rideatend = False
-        if 'time' in self.data and isinstance(self.data['time'], list):
+        if 'time' in self.data and len(self.data['time']) > 0:
             if np.abs(self.data['time'][-1] - _origXRange[1]) < 0.5:
                 _rideatend = True
-        if 'time' not in self.data:
+        else:
             _rideatend = True
-        ### Load Data if earlier present ###
-        if 'time' in self.data and isinstance(self.data['time'], list) and 'data' in self.data and \
-                isinstance(self.data['data'], dict) and (set(self.data['data'].keys()) == set(_data['data'].keys())):
-            if _len > 0:    # There is time data
-                _dataGood = True
-                # Test Data is numpy array and has same length #
-                for _k in _data['data']:
-                    if not isinstance(_data['data'][_k], list) or len(_data['data'][_k]) != _len:
-                        _dataGood = False
-                        break
-                ##
-                if _dataGood:
-                    # All Good Append Data #
-                    self.data['time'].extend(_data['time'])
-                    for _k in self.data['data']:
-                        self.data['data'][_k].extend(_data['data'][_k])
-                    _dataupdated = True
-        ### Create Empty Data fields if not present earlier ###
-        if 'time' not in self.data and 'data' not in self.data and _len > 0:
-            _datagoodinit = True
-            ### Initialize Data if got a valid one ###
-            for _k in _data['data']:
-                if not isinstance(_data['data'][_k], list) or len(_data['data'][_k]) != _len:
-                    _datagoodinit = False
-                    break
-            if _datagoodinit:
-                self.data['time'] = _data['time']
-                self.data['data'] = _data['data']
+        ### Test data has same length as time ###
+        _dataGood = _len > 0
+        for _k in _data['data']:
+            if not isinstance(_data['data'][_k], (list, np.ndarray)) or len(_data['data'][_k]) != _len:
+                _dataGood = False
+                break
+        ### Create Store if not present earlier ###
+        if _dataGood and self.store is None:
+            _channels = [_plt.channelname for _plt in self.plotdata if hasattr(_plt, 'channelname')]
+            _maxsamples = None
+            if self.liveseconds:
+                _maxsamples = int(self.liveseconds * 1000.0)    # Device sends 1000 samples per second
+            self.store = GaitechDataStore(_channels, maxsamples=_maxsamples)
+            if 'markers' not in self.data:
                 self.data['markers'] = []   # Initialize Markers
-                ### Add A New Marker For Showing Streaming Started ### TODO
-                _dataupdated = True
+                self.markermodel.setMarkers(self.data['markers'])
+            ### Add A New Marker For Showing Streaming Started ### TODO
+        ### Append Data ###
+        if _dataGood:
+            _first = self.store.first
+            self.store.extend(_data['time'], _data['data'])
+            self.__syncdata()
+            # Indices of displayed range move left when ring store drops samples #
+            _dropped = self.store.first - _first
+            if _dropped > 0:
+                self._idxolddata = [max(self._idxolddata[0] - _dropped, 0), max(self._idxolddata[1] - _dropped, 0)]
+            _dataupdated = True
         ### Update Views Etc. ###
         if _dataupdated:
             _mintime = self.data['time'][0]
@@ -1323,8 +1701,12 @@ class GaitechDataViewerWidget(QtGui.QWidget):
                 _dispsttime = _maxtime - _origXrangeDiff
                 if _dispsttime < self.data['time'][0]:
                     _dispsttime = self.data['time'][0]
-                self._update_data_loaded_recently()
+                if not self.__singlecanvas():
+                    self._update_data_loaded_recently()
+                self.__liveappending = True
                 self.plots[-1].setXRange(_dispsttime, _maxtime, padding=0.0)
+                self.__liveappending = False
+                self.__updatelivespectrogram()
             else:
                 self.__livescrolling = False
 
@@ -1376,6 +1758,67 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             self.ui.lblDMode.setText('Unknown Mode')
         return _cbxs
 
+    def __syncdata(self):
+        """
+        Point time and data of self.data to views of store and update pyramid, needed after every change of store
+        :return: None
+        """
+        self.data['time'] = self.store.time
+        self.data['data'] = self.store.columns()
+        if self.pyramid is None or self.pyramid.store is not self.store:
+            self.pyramid = GaitechMinMaxPyramid(self.store)
+        else:
+            self.pyramid.update()
+        self.__synctraceview()
+
+    def __singlecanvas(self):
+        """
+        :return: True if channels are shown in single canvas instead of stacked plots
+        """
+        return self.traceview is not None and not self.traceview.isHidden()
+
+    def __synctraceview(self):
+        """
+        Show samples of store and enabled channels in single canvas, if it is shown
+        :return: None
+        """
+        if not self.__singlecanvas() or self.store is None:
+            return
+        _channels = [_plt.channelname for _plt in self.plots
+                     if hasattr(_plt, 'channelname') and getattr(_plt, 'channelvisible', True)]
+        if self.traceview.store is not self.store or self.traceview.channels != _channels:
+            self.traceview.setStore(self.store, _channels, self.pyramid)
+        else:
+            self.traceview.refresh()
+
+    def __clearlivecurves(self):
+        """
+        Stop drawing with live curves, plot data items show data again
+        :return: None
+        """
+        for _pltdata in self.plotdata:
+            if hasattr(_pltdata, 'livecurve'):
+                _pltdata.livecurve.clear()
+        self.__livecurveend = None
+
+    def __setplotdata(self, _pltdata, _chnlname, _idx1, _idx2):
+        """
+        Show samples _idx1 to _idx2 of channel in plot data item, as min/max envelope from pyramid when there are
+        more samples than pixels
+        :param _pltdata: plot data item
+        :param _chnlname: channel name
+        :param _idx1: first sample
+        :param _idx2: last sample, inclusive
+        :return: None
+        """
+        _vb = _pltdata.getViewBox()
+        _pixels = 1000 if _vb is None else max(int(_vb.width()), 100)
+        if self.pyramid is not None and _chnlname in self.pyramid.store.channels:
+            _x, _y = self.pyramid.envelope(_chnlname, _idx1, _idx2, _pixels)
+        else:
+            _x, _y = self.data['time'][_idx1:_idx2+1], self.data['data'][_chnlname][_idx1:_idx2+1]
+        _pltdata.setData(x=_x, y=_y)
+
     @staticmethod
     def __set_symbol_plotdata_None(_pltitm, chnlname):
         if hasattr(_pltitm, 'channelname') and _pltitm.channelname == chnlname:
@@ -1392,3 +1835,69 @@ class GaitechDataViewerWidget(QtGui.QWidget):
             return True
         return False
 
+
+#################################
+### Helping Functions ###########
+def PrepareViewerData(task, channels, _time, columns, markers, name):
+    """
+    Worker task converting loaded data to store, pyramid and marker index of viewer
+    :param task: GaitechViewerTask
+    :param channels: channels plotted
+    :param _time: sample times
+    :param columns: {chname: samples}
+    :param markers: [(id, time, event, note), ...]
+    :param name: file name shown in title
+    :return: {store, pyramid, markers, markerindex, name}
+    """
+    _n = len(_time)
+    _store = GaitechDataStore(channels, chunk=max(_n, 1))
+    for _i0 in range(0, _n, VIEWER_TASK_STEP):
+        task.progress(0.8 * _i0 / _n)
+        _i1 = _i0 + VIEWER_TASK_STEP
+        _store.extend(_time[_i0:_i1], dict((_ch, columns[_ch][_i0:_i1]) for _ch in channels))
+    task.progress(0.8)
+    _pyramid = GaitechMinMaxPyramid(_store)
+    task.progress(0.95)
+    _markers = list(markers)
+    return {'store': _store, 'pyramid': _pyramid, 'markers': _markers, 'markerindex': GaitechMarkerIndex(_markers),
+            'name': name}
+
+
+def SnapshotViewerData(task, _time, block, channels, markers, mode, _fname):
+    """
+    Worker task arranging a copy of viewer data for saving, viewer may keep changing its data while it is saved
+    :param task: GaitechViewerTask
+    :param _time: copy of sample times of store
+    :param block: copy of samples of store, np.array (channels x samples) taken together with _time
+    :param channels: channel names of block rows
+    :param markers: [(id, time, event, note), ...]
+    :param mode: montage name
+    :param _fname: file to save to, used by viewer when task is done
+    :return: {mode, time, data, markers} like data of viewer
+    """
+    task.progress(0.0)
+    return {'mode': mode, 'time': _time, 'data': dict(zip(channels, block)), 'markers': list(markers)}
+
+
+def SpectrogramOfRange(task, store, channel, _idx1, _idx2, key):
+    """
+    Worker task computing spectrogram of samples _idx1 to _idx2 of a channel, at most SPECTRO_FRAMES spectra
+    :param task: GaitechViewerTask
+    :param store: GaitechDataStore
+    :param channel: channel name
+    :param _idx1: first sample
+    :param _idx2: last sample
+    :param key: cache key of viewer
+    :return: {key, times, freqs, power}
+    """
+    _hop = max(SPECTRO_HOP, (_idx2 - _idx1) // SPECTRO_FRAMES)
+    # Windows centered on samples of range #
+    _i0 = max(_idx1 - SPECTRO_WINDOW // 2, 0)
+    _i1 = min(_idx2 + SPECTRO_WINDOW // 2, len(store) - 1)
+    task.progress(0.0)
+    _power = Spectrogram(store.channel(channel)[_i0:_i1 + 1][np.newaxis, :], SPECTRO_WINDOW, _hop, SPECTRO_FMAX,
+                         SPECTRO_RATE)[0]
+    _c0 = _i0 + SPECTRO_WINDOW // 2
+    _times = store.time[_c0:_c0 + _power.shape[0] * _hop:_hop]
+    _freqs = np.arange(_power.shape[1]) * SPECTRO_RATE / SPECTRO_WINDOW
+    return {'key': key, 'times': _times, 'freqs': _freqs, 'power': _power}
@@ -0,0 +1,157 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Curve item for live scrolling plots, new samples are appended to curve instead of replacing it
+"""
+from collections import deque
+import numpy as np
+from PyQt4 import QtCore
+import pyqtgraph as pg
+
+LIVE_CURVE_CHUNK = 256      # Samples per cached path of curve
+
+
+######################################################
+######## Class GaitechLiveCurveItem ##################
+######################################################
+class GaitechLiveCurveItem(pg.GraphicsObject):
+    """
+    Append only curve for live plots
+    Samples are written in a preallocated buffer of LIVE_CURVE_CHUNK samples, every full buffer becomes a cached
+    painter path. Appending only builds path of last partial chunk again and scrolling drops chunks left of view,
+    so an update costs in proportion to new samples instead of samples in view
+    """
+    def __init__(self, pen='b', chunk=LIVE_CURVE_CHUNK):
+        """
+        :param pen: pen of curve, anything accepted by pg.mkPen
+        :param chunk: samples per cached path
+        """
+        pg.GraphicsObject.__init__(self)
+        self.pen = pg.mkPen(pen)
+        self.chunk = int(chunk)
+        # Samples of last chunk, first one is last sample of previous chunk to keep curve connected #
+        self._x = np.zeros(self.chunk + 1, dtype='float64')
+        self._y = np.zeros(self.chunk + 1, dtype='float64')
+        self._n = 0
+        self._paths = deque()   # (first x, last x, min y, max y, QPainterPath) of full chunks
+        self._tail = None       # Same for samples in buffer
+        self._bounds = None
+
+    def clear(self):
+        """
+        Remove all samples
+        :return: None
+        """
+        self.prepareGeometryChange()
+        self._n = 0
+        self._paths.clear()
+        self._tail = None
+        self._bounds = None
+        self.update()
+
+    def setData(self, x, y):
+        """
+        Replace samples of curve
+        :param x: np.array of time
+        :param y: np.array of values
+        :return: None
+        """
+        self.clear()
+        self.appendData(x, y)
+
+    def appendData(self, x, y):
+        """
+        Add samples at end of curve
+        :param x: np.array of time
+        :param y: np.array of values
+        :return: None
+        """
+        _len = len(x)
+        if _len == 0:
+            return
+        self.prepareGeometryChange()
+        _i = 0
+        while _i < _len:
+            _k = min(_len - _i, self.chunk + 1 - self._n)
+            self._x[self._n:self._n + _k] = x[_i:_i + _k]
+            self._y[self._n:self._n + _k] = y[_i:_i + _k]
+            self._n += _k
+            _i += _k
+            if self._n == self.chunk + 1:
+                self._paths.append(self._chunkpath())
+                self._x[0] = self._x[self._n - 1]
+                self._y[0] = self._y[self._n - 1]
+                self._n = 1
+        self._tail = self._chunkpath() if self._n > 1 else None
+        self._bounds = None
+        self.update()
+
+    def trim(self, xmin):
+        """
+        Drop chunks whose samples are all before xmin, used when view scrolls
+        :param xmin: time of left edge
+        :return: None
+        """
+        if len(self._paths) == 0 or self._paths[0][1] >= xmin:
+            return
+        self.prepareGeometryChange()
+        while len(self._paths) > 0 and self._paths[0][1] < xmin:
+            self._paths.popleft()
+        self._bounds = None
+        self.update()
+
+    def boundingRect(self):
+        if self._bounds is None:
+            _chunks = list(self._paths)
+            if self._tail is not None:
+                _chunks.append(self._tail)
+            if len(_chunks) == 0:
+                self._bounds = QtCore.QRectF()
+            else:
+                _ymin = min([_c[2] for _c in _chunks])
+                _ymax = max([_c[3] for _c in _chunks])
+                self._bounds = QtCore.QRectF(_chunks[0][0], _ymin, _chunks[-1][1] - _chunks[0][0], _ymax - _ymin)
+        return self._bounds
+
+    def paint(self, p, *args):
+        p.setPen(self.pen)
+        for _c in self._paths:
+            p.drawPath(_c[4])
+        if self._tail is not None:
+            p.drawPath(self._tail[4])
+
+    def _chunkpath(self):
+        _x = self._x[:self._n]
+        _y = self._y[:self._n]
+        return _x[0], _x[-1], _y.min(), _y.max(), pg.arrayToQPath(_x, _y)
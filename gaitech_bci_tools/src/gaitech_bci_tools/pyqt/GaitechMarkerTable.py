@@ -0,0 +1,192 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Model and delegate of markers table in data viewer, only rows in view are painted and no widgets are made per row
+"""
+from PyQt4 import QtCore, QtGui
+
+MARKER_BUTTON_SIZE = 32     # Size of edit and remove buttons painted in markers table
+
+
+######################################################
+######## Class GaitechMarkerTableModel ###############
+######################################################
+class GaitechMarkerTableModel(QtCore.QAbstractTableModel):
+    """
+    Table model over markers [(id, time, event, note), ...] with columns marker, time and buttons
+    List of markers is shared with owner, it is changed through model so views update only changed rows
+    """
+    HEADERS = ['Marker', 'Time', '']
+
+    def __init__(self, parent=None):
+        super(GaitechMarkerTableModel, self).__init__(parent)
+        self.markers = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.markers)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(GaitechMarkerTableModel.HEADERS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.markers):
+            return None
+        _mrk = self.markers[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            if index.column() == 0:
+                return '%s' % _mrk[0]
+            elif index.column() == 1:
+                return '%.3f' % _mrk[1]
+        elif role == QtCore.Qt.ToolTipRole:
+            if index.column() == 0:
+                return '%s' % _mrk[0]
+            elif index.column() == 2:
+                return 'Edit or remove this marker'
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal and \
+                0 <= section < len(GaitechMarkerTableModel.HEADERS):
+            return GaitechMarkerTableModel.HEADERS[section]
+        return None
+
+    def setMarkers(self, markers):
+        """
+        Show another list of markers
+        :param markers: [(id, time, event, note), ...], kept by reference
+        :return: None
+        """
+        self.beginResetModel()
+        self.markers = markers
+        self.endResetModel()
+
+    def appendMarkers(self, markers):
+        """
+        Add markers at end
+        :param markers: [(id, time, event, note), ...]
+        :return: None
+        """
+        if len(markers) == 0:
+            return
+        _n = len(self.markers)
+        self.beginInsertRows(QtCore.QModelIndex(), _n, _n + len(markers) - 1)
+        self.markers.extend(markers)
+        self.endInsertRows()
+
+    def insertMarker(self, pos, marker):
+        """
+        Insert marker at position
+        :param pos: row
+        :param marker: (id, time, event, note)
+        :return: None
+        """
+        self.beginInsertRows(QtCore.QModelIndex(), pos, pos)
+        self.markers.insert(pos, marker)
+        self.endInsertRows()
+
+    def removeMarker(self, pos):
+        """
+        Remove marker at position
+        :param pos: row
+        :return: None
+        """
+        if pos < 0 or pos >= len(self.markers):
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), pos, pos)
+        self.markers.pop(pos)
+        self.endRemoveRows()
+
+    def setMarker(self, pos, marker):
+        """
+        Replace marker at position
+        :param pos: row
+        :param marker: (id, time, event, note)
+        :return: None
+        """
+        self.markers[pos] = marker
+        self.dataChanged.emit(self.index(pos, 0), self.index(pos, len(GaitechMarkerTableModel.HEADERS) - 1))
+
+
+######################################################
+######## Class GaitechMarkerButtonsDelegate ##########
+######################################################
+class GaitechMarkerButtonsDelegate(QtGui.QStyledItemDelegate):
+    """
+    Paints edit and remove buttons in cells of a column and emits row of button clicked
+    """
+    sigEdit = QtCore.pyqtSignal(int)       # Edit clicked in row
+    sigRemove = QtCore.pyqtSignal(int)     # Remove clicked in row
+
+    def __init__(self, parent=None, editicon=None, removeicon=None):
+        """
+        :param parent:
+        :param editicon: QIcon of edit button, text is shown if None
+        :param removeicon: QIcon of remove button, text is shown if None
+        """
+        super(GaitechMarkerButtonsDelegate, self).__init__(parent)
+        self.buttons = [(editicon, 'E', self.sigEdit), (removeicon, 'R', self.sigRemove)]
+
+    def paint(self, painter, option, index):
+        super(GaitechMarkerButtonsDelegate, self).paint(painter, option, index)
+        _style = QtGui.QApplication.style()
+        for (_rect, (_icon, _text, _)) in zip(self._rects(option.rect), self.buttons):
+            _opt = QtGui.QStyleOptionButton()
+            _opt.rect = _rect
+            _opt.state = QtGui.QStyle.State_Enabled
+            if _icon is not None:
+                _opt.icon = _icon
+                _opt.iconSize = QtCore.QSize(MARKER_BUTTON_SIZE - 8, MARKER_BUTTON_SIZE - 8)
+            else:
+                _opt.text = _text
+            _style.drawControl(QtGui.QStyle.CE_PushButton, _opt, painter)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QtCore.QEvent.MouseButtonRelease and event.button() == QtCore.Qt.LeftButton:
+            for (_rect, (_, _, _sig)) in zip(self._rects(option.rect), self.buttons):
+                if _rect.contains(event.pos()):
+                    _sig.emit(index.row())
+                    return True
+        return False
+
+    def sizeHint(self, option, index):
+        return QtCore.QSize(MARKER_BUTTON_SIZE * len(self.buttons), MARKER_BUTTON_SIZE)
+
+    def _rects(self, rect):
+        _y = rect.y() + max(rect.height() - MARKER_BUTTON_SIZE, 0) / 2
+        return [QtCore.QRect(rect.x() + _i * MARKER_BUTTON_SIZE, _y, MARKER_BUTTON_SIZE, MARKER_BUTTON_SIZE)
+                for _i in range(len(self.buttons))]
@@ -65,6 +65,7 @@ class GaitechSettings(QtGui.QWidget):
     sigRefModeUpdated = QtCore.pyqtSignal(int) # Reference mode update from outside, to be received by Gaitech Settings
     sigDeviceInitialize = QtCore.pyqtSignal(str) # Initialize UI based on device name
     sigElectrodeUpdated = QtCore.pyqtSignal(dict) # Electrode connectivity information received
+    sigNodeAttachState = QtCore.pyqtSignal(str, str) # Progress of attaching active node, node name and state
     ##
 
     def __init__(self, parent=None):
@@ -136,6 +137,7 @@ class GaitechSettings(QtGui.QWidget):
         self.sigFilterUpdated.connect(self._filterupdated)
         self.sigNodesReceived.connect(self._nodeupdated)
         self.sigElectrodeUpdated.connect(self._onelectrodeupdate)
+        self.sigNodeAttachState.connect(self._nodeattachstate)
 
     def getActiveMode(self):
         """
@@ -336,6 +338,27 @@ class GaitechSettings(QtGui.QWidget):
             self._activenode = None
             self.sigNodeModified.emit('')
 
+    @QtCore.pyqtSlot(str, str)
+    def _nodeattachstate(self, nodename, state):
+        """
+        Show progress of attaching active node, device controls are usable once node is resolved
+        :param nodename: node being attached
+        :param state: resolving, resolved, ready or failed
+        :return:
+        """
+        if self._activenode is None or str(nodename) != self._activenode:
+            return  # Stale state of previously selected node
+        state = str(state)
+        if state == 'resolving':
+            self.ui.cmbNode.setToolTip('Connecting to %s' % self._activenode)
+            self._enable_All_Interface(False)
+        elif state == 'failed':
+            self.ui.cmbNode.setToolTip('%s is not responding' % self._activenode)
+            self._enable_All_Interface(True)
+        else:
+            self.ui.cmbNode.setToolTip('Select gaitech_bci node')
+            self._enable_All_Interface(True)
+
     def _update_connectable_devices(self):
         """
         Update Connectable devices in combo list
@@ -0,0 +1,133 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Spectrogram panel of data viewer
+"""
+import numpy as np
+from PyQt4 import QtCore, QtGui
+import pyqtgraph as pg
+
+SPECTRO_COLORS = [(0, 0, 0), (0, 0, 160), (0, 170, 0), (255, 255, 0)]   # Colors from weakest to strongest
+
+
+######################################################
+######## Class GaitechSpectrogramPanel ###############
+######################################################
+class GaitechSpectrogramPanel(QtGui.QWidget):
+    """
+    Spectrogram of one channel as an image, time on x axis and frequency on y axis, log of magnitude as color
+    """
+    sigChannelChanged = QtCore.pyqtSignal(str)  # Emitted when user selects another channel
+
+    def __init__(self, parent=None):
+        super(GaitechSpectrogramPanel, self).__init__(parent)
+        _lyt = QtGui.QVBoxLayout(self)
+        _lyt.setContentsMargins(0, 0, 0, 0)
+        _top = QtGui.QHBoxLayout()
+        _top.addWidget(QtGui.QLabel('Spectrogram of', self))
+        self.cbChannel = QtGui.QComboBox(self)
+        self.cbChannel.setToolTip('Channel shown in spectrogram')
+        _top.addWidget(self.cbChannel)
+        _top.addStretch(1)
+        _lyt.addLayout(_top)
+        self.plot = pg.PlotWidget(self, enableMenu=False)
+        self.plot.setBackground(None)
+        self.plot.hideButtons()
+        self.plot.setMouseEnabled(y=False)
+        self.plot.setLabel('left', text='Frequency', units='Hz')
+        self.image = pg.ImageItem()
+        _cmap = pg.ColorMap(np.linspace(0.0, 1.0, len(SPECTRO_COLORS)), np.array(SPECTRO_COLORS, dtype=np.ubyte))
+        self.image.setLookupTable(_cmap.getLookupTable(0.0, 1.0, 256))
+        self.plot.addItem(self.image)
+        _lyt.addWidget(self.plot)
+        self.setMinimumHeight(160)
+        self.cbChannel.currentIndexChanged.connect(self._channelchanged)
+
+    def setChannels(self, channels):
+        """
+        Channels that can be selected, current one is kept if present
+        :param channels: channel names
+        :return: None
+        """
+        _current = self.channel()
+        self.cbChannel.blockSignals(True)
+        self.cbChannel.clear()
+        self.cbChannel.addItems(channels)
+        if _current in channels:
+            self.cbChannel.setCurrentIndex(channels.index(_current))
+        self.cbChannel.blockSignals(False)
+        self.clear()
+
+    def channel(self):
+        """
+        :return: name of channel shown
+        """
+        return str(self.cbChannel.currentText())
+
+    def linkTo(self, plotitem):
+        """
+        Share time axis range with a plot of viewer
+        :param plotitem: pg.PlotItem
+        :return: None
+        """
+        self.plot.setXLink(plotitem)
+
+    def clear(self):
+        """
+        Remove spectrogram
+        :return: None
+        """
+        self.image.clear()
+
+    def setSpectrogram(self, times, freqs, power):
+        """
+        Show spectrogram
+        :param times: np.array of center times of spectra, equally spaced
+        :param freqs: np.array of frequencies, equally spaced
+        :param power: np.array (spectra x frequencies) of magnitudes
+        :return: None
+        """
+        if len(times) < 2 or len(freqs) < 2:
+            self.image.clear()
+            return
+        _dt = (times[-1] - times[0]) / (len(times) - 1)
+        _df = freqs[1] - freqs[0]
+        self.image.setImage(np.log10(power + 1e-9), autoLevels=True)
+        self.image.setRect(QtCore.QRectF(times[0] - _dt / 2.0, freqs[0] - _df / 2.0, _dt * len(times),
+                                         _df * len(freqs)))
+        self.plot.setYRange(freqs[0], freqs[-1], padding=0.0)
+
+    @QtCore.pyqtSlot(int)
+    def _channelchanged(self, _idx):
+        self.sigChannelChanged.emit(self.channel())
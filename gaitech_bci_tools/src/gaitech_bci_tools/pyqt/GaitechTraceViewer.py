@@ -0,0 +1,272 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Single canvas view of all EEG channels, alternative to stacked plots of GaitechDataViewerWidget
+"""
+import time
+import numpy as np
+from PyQt4 import QtCore, QtGui
+import pyqtgraph as pg
+from gaitech_bci_tools.EEGMarkerIndex import GaitechMarkerIndex
+from gaitech_bci_tools.EEGDecimation import GaitechMinMaxPyramid
+
+TRACE_SPACING = 0.2         # Distance between baselines of channels in Volts
+TRACE_MAX_LABELS = 50       # Marker names shown at once, more markers in view are drawn as lines only
+
+
+######################################################
+######## Class GaitechMultiTraceItem #################
+######################################################
+class GaitechMultiTraceItem(pg.GraphicsObject):
+    """
+    All channel traces as one painter path, so whole view is drawn with one call
+    """
+    def __init__(self, pen='b'):
+        pg.GraphicsObject.__init__(self)
+        self.pen = pg.mkPen(pen)
+        self.path = QtGui.QPainterPath()
+        self._bounds = QtCore.QRectF()
+
+    def setTraces(self, traces):
+        """
+        Replace traces
+        :param traces: [(x, y), ...] np.arrays, already moved to baselines of channels
+        :return: None
+        """
+        self.prepareGeometryChange()
+        traces = [(_x, _y) for (_x, _y) in traces if len(_x) > 0]
+        if len(traces) == 0:
+            self.path = QtGui.QPainterPath()
+        else:
+            _x = np.concatenate([_t[0] for _t in traces])
+            _y = np.concatenate([_t[1] for _t in traces])
+            # Do not connect last point of a channel to first point of next one #
+            _connect = np.ones(_x.shape[0], dtype=np.ubyte)
+            _connect[np.cumsum([len(_t[0]) for _t in traces]) - 1] = 0
+            self.path = pg.arrayToQPath(_x, _y, connect=_connect)
+        self._bounds = self.path.boundingRect()
+        self.update()
+
+    def boundingRect(self):
+        return self._bounds
+
+    def paint(self, p, *args):
+        p.setPen(self.pen)
+        p.drawPath(self.path)
+
+
+######################################################
+######## Class GaitechPaintTimer #####################
+######################################################
+class GaitechPaintTimer(QtCore.QObject):
+    """
+    Measures paint time of graphics views it watches, event filter on their viewports delivers paint events itself
+    so the time spent in paintEvent of view is known. frametime holds smoothed paint time of any watched view
+    """
+    def __init__(self, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.views = dict()         # Graphics view by its viewport
+        self.frametime = 0.0        # Smoothed time of painting a frame in seconds
+        self.frames = 0             # Frames painted by watched views
+
+    def watch(self, view):
+        """
+        Start measuring paint time of view
+        :param view: QGraphicsView, e.g. pg.GraphicsLayoutWidget or pg.PlotWidget
+        :return: None
+        """
+        _viewport = view.viewport()
+        if _viewport in self.views:
+            return
+        self.views[_viewport] = view
+        _viewport.installEventFilter(self)
+
+    def eventFilter(self, obj, ev):
+        if ev.type() != QtCore.QEvent.Paint or obj not in self.views:
+            return False
+        # Same call scroll area makes for its viewport, but timed #
+        _start = time.time()
+        self.views[obj].viewportEvent(ev)
+        self.frametime = 0.9 * self.frametime + 0.1 * (time.time() - _start)
+        self.frames += 1
+        return True
+
+
+######################################################
+######## Class GaitechMultiTraceWidget ###############
+######################################################
+class GaitechMultiTraceWidget(pg.PlotWidget):
+    """
+    Draw channels of a GaitechDataStore in one plot, channel i around baseline -i * spacing
+    There is one view box and time axis for all channels, traces are one item and marker lines another, both rebuilt
+    from min/max pyramid of store for the pixel width of view whenever time range changes or refresh is called.
+    Uses OpenGL viewport when available, software rendering otherwise. frametime holds smoothed paint time
+    """
+    def __init__(self, parent=None, spacing=TRACE_SPACING, opengl=True):
+        """
+        :param parent:
+        :param spacing: distance between baselines of channels
+        :param opengl: draw with OpenGL viewport if available
+        """
+        pg.PlotWidget.__init__(self, parent, enableMenu=False)
+        if opengl:
+            try:
+                self.useOpenGL(True)
+            except Exception as e:
+                print 'Debugging : OpenGL not available, using software rendering : %s' % str(e)
+        self.setBackground(None)
+        self.spacing = float(spacing)
+        self.store = None           # GaitechDataStore drawn
+        self.pyramid = None         # GaitechMinMaxPyramid of store
+        self.channels = []          # Channels drawn, from top to bottom
+        self.markers = []           # [(id, time, event, note), ...]
+        self.markerindex = GaitechMarkerIndex()
+        self.frametime = 0.0        # Smoothed time of painting a frame in seconds
+        self.hideButtons()
+        self.setLabel('bottom', text='Time', units='sec')
+        self.setMouseEnabled(y=False)
+        self.showGrid(x=True, alpha=0.5)
+        self.traces = GaitechMultiTraceItem(pen='b')
+        self.addItem(self.traces)
+        self.markerlines = pg.PlotCurveItem(pen='r', connect='pairs')
+        self.markerlines.setZValue(2)
+        self.addItem(self.markerlines)
+        self._labels = []           # Pool of TextItems for marker names
+        self.getViewBox().sigXRangeChanged.connect(self._xrangechanged)
+
+    def setStore(self, store, channels=None, pyramid=None):
+        """
+        Show channels of store
+        :param store: GaitechDataStore
+        :param channels: channels to draw, all channels of store if None
+        :param pyramid: GaitechMinMaxPyramid of store if there is one already
+        :return: None
+        """
+        self.store = store
+        self.channels = list(store.channels if channels is None else channels)
+        self.pyramid = pyramid if pyramid is not None else GaitechMinMaxPyramid(store)
+        _ticks = [(-_i * self.spacing, _ch) for (_i, _ch) in enumerate(self.channels)]
+        self.getAxis('left').setTicks([_ticks, []])
+        _half = self.spacing / 2.0
+        self.setLimits(yMin=-len(self.channels) * self.spacing + _half, yMax=_half)
+        self.setYRange(-len(self.channels) * self.spacing + _half, _half, padding=0.0)
+        if len(store) > 0:
+            self.setLimits(xMin=store.time[0], xMax=store.time[-1])
+        self.refresh()
+
+    def setMarkers(self, markers, index=None):
+        """
+        Show markers as vertical lines over all channels
+        :param markers: [(id, time, event, note), ...]
+        :param index: GaitechMarkerIndex of markers kept by caller, None to build one
+        :return: None
+        """
+        self.markers = markers
+        if index is not None:
+            self.markerindex = index
+        else:
+            self.markerindex = GaitechMarkerIndex(markers)
+        self._drawmarkers()
+
+    def clear(self):
+        """
+        Stop showing store and markers
+        :return: None
+        """
+        self.store = None
+        self.pyramid = None
+        self.markers = []
+        self.markerindex = GaitechMarkerIndex()
+        self._drawtraces()
+        self._drawmarkers()
+
+    def refresh(self):
+        """
+        Draw again after samples are added to store
+        :return: None
+        """
+        if self.store is None:
+            return
+        if self.pyramid.store is self.store:
+            self.pyramid.update()
+        if len(self.store) > 0:
+            self.setLimits(xMin=self.store.time[0], xMax=self.store.time[-1])
+        self._drawtraces()
+        self._drawmarkers()
+
+    def paintEvent(self, ev):
+        _start = time.time()
+        pg.PlotWidget.paintEvent(self, ev)
+        self.frametime = 0.9 * self.frametime + 0.1 * (time.time() - _start)
+
+    @QtCore.pyqtSlot(object, object)
+    def _xrangechanged(self, _vb, _rng):
+        self._drawtraces()
+        self._drawmarkers()
+
+    def _drawtraces(self):
+        if self.store is None or len(self.store) == 0:
+            self.traces.setTraces([])
+            return
+        _x0, _x1 = self.getViewBox().viewRange()[0]
+        _i0 = max(int(np.searchsorted(self.store.time, _x0, side='left')) - 1, 0)
+        _i1 = min(int(np.searchsorted(self.store.time, _x1, side='right')), len(self.store) - 1)
+        _pixels = max(int(self.getViewBox().width()), 100)
+        _traces = []
+        for (_i, _ch) in enumerate(self.channels):
+            _x, _y = self.pyramid.envelope(_ch, _i0, _i1, _pixels)
+            _traces.append((_x, _y - _i * self.spacing))
+        self.traces.setTraces(_traces)
+
+    def _drawmarkers(self):
+        _x0, _x1 = self.getViewBox().viewRange()[0]
+        _inrange = self.markerindex.range(_x0, _x1) if len(self.markerindex) > 0 else np.zeros(0, dtype='int64')
+        _times = np.array([self.markers[_i][1] for _i in _inrange.tolist()], dtype='float64')
+        _top = self.spacing / 2.0
+        _bottom = -len(self.channels) * self.spacing + _top
+        self.markerlines.setData(x=np.repeat(_times, 2), y=np.tile([_top, _bottom], _times.shape[0]))
+        # Names of markers, only when there are not too many of them #
+        _show = _inrange.tolist() if _inrange.shape[0] <= TRACE_MAX_LABELS else []
+        while len(self._labels) < len(_show):
+            self._labels.append(pg.TextItem(text='', color='r', anchor=(0, 0)))
+            self._labels[-1].setZValue(3)
+            self.addItem(self._labels[-1], ignoreBounds=True)
+        for (_k, _label) in enumerate(self._labels):
+            if _k < len(_show):
+                _mrk = self.markers[_show[_k]]
+                _label.setText(str(_mrk[2]))
+                _label.setPos(_mrk[1], _top)
+                _label.show()
+            else:
+                _label.hide()
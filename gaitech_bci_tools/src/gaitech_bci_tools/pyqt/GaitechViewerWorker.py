@@ -0,0 +1,170 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+#  Copyright (c) 2018, Gaitech Robotics
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#   * Neither the name of the Gaitech Robotics nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+#####################################################################
+"""
+Worker thread of data viewer, runs heavy preparation of data so UI thread only swaps in results
+"""
+import Queue
+import threading
+import traceback
+from PyQt4 import QtCore
+
+
+class GaitechTaskCancelled(Exception):
+    """
+    Raised inside a task function when its task was cancelled
+    """
+    pass
+
+
+class GaitechViewerTask():
+    """
+    Task queued on GaitechViewerWorker, func is called as func(task, *args) in worker thread
+    Long running functions call task.progress(fraction) every now and then, it reports progress and raises
+    GaitechTaskCancelled once task is cancelled
+    """
+    def __init__(self, worker, name, func, args):
+        self.worker = worker
+        self.name = name
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Ask task to stop, it stops at next progress call or is dropped if it has not started yet
+        :return: None
+        """
+        self.cancelled = True
+
+    def progress(self, fraction):
+        """
+        Report progress of task
+        :param fraction: 0.0 to 1.0
+        :return: None
+        """
+        if self.cancelled:
+            raise GaitechTaskCancelled(self.name)
+        self.worker.sigTaskProgress.emit(self, float(fraction))
+
+
+######################################################
+######## Class GaitechViewerWorker ###################
+######################################################
+class GaitechViewerWorker(QtCore.QThread):
+    """
+    QThread running queued tasks one after another, thread is started on submit and ends when queue is empty
+    Results are delivered by sigTaskDone in thread of receiver, i.e. UI thread for slots of widgets
+    """
+    sigTaskDone = QtCore.pyqtSignal(object, object)     # Task and result
+    sigTaskProgress = QtCore.pyqtSignal(object, float)  # Task and fraction done
+    sigTaskFailed = QtCore.pyqtSignal(object, str)      # Task and error
+    sigTaskCancelled = QtCore.pyqtSignal(object)        # Task
+
+    def __init__(self, parent=None):
+        super(GaitechViewerWorker, self).__init__(parent)
+        self.tasks = Queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = []  # Tasks submitted and not finished, including running one
+        self._running = False
+
+    def submit(self, name, func, *args):
+        """
+        Queue a task, pending tasks of same name are cancelled as new one supersedes them
+        :param name: task name
+        :param func: func(task, *args)
+        :param args: arguments of func
+        :return: GaitechViewerTask
+        """
+        _task = GaitechViewerTask(self, name, func, args)
+        with self._lock:
+            for _t in self._pending:
+                if _t.name == name:
+                    _t.cancel()
+            self._pending.append(_task)
+            self.tasks.put(_task)
+            if not self._running:
+                self._running = True
+                self.wait()     # Thread may still be returning from run
+                self.start()
+        return _task
+
+    def cancel(self, name=None):
+        """
+        Cancel pending tasks
+        :param name: cancel only tasks of this name, None for all
+        :return: None
+        """
+        with self._lock:
+            for _t in self._pending:
+                if name is None or _t.name == name:
+                    _t.cancel()
+
+    def busy(self, name=None):
+        """
+        :param name: only tasks of this name, None for all
+        :return: True if such tasks are pending and not cancelled
+        """
+        with self._lock:
+            return any((not _t.cancelled) and (name is None or _t.name == name) for _t in self._pending)
+
+    def stop(self):
+        """
+        Cancel all tasks and wait for thread to finish
+        :return: None
+        """
+        self.cancel()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._lock:
+                if self.tasks.empty():
+                    self._running = False
+                    return
+                _task = self.tasks.get()
+            try:
+                if _task.cancelled:
+                    raise GaitechTaskCancelled(_task.name)
+                _result = _task.func(_task, *_task.args)
+                if _task.cancelled:
+                    raise GaitechTaskCancelled(_task.name)
+                self.sigTaskDone.emit(_task, _result)
+            except GaitechTaskCancelled:
+                self.sigTaskCancelled.emit(_task)
+            except Exception as e:
+                traceback.print_exc()
+                self.sigTaskFailed.emit(_task, str(e))
+            finally:
+                with self._lock:
+                    self._pending.remove(_task)